@@ -0,0 +1,200 @@
+"""
+    asyncio version of DatabaseHelper, built on psycopg 3 and psycopg_pool.
+
+    The builder is exactly the same (AsyncDatabaseHelper subclasses DatabaseHelper, so select/where_*/custom_select/compile/build are
+    inherited as-is), only the functions that talk to the db are coroutines. That lets one api process overlap many independent
+    screens and chart queries instead of blocking a worker on each one. Porting a call site is just adding an await:
+
+        dbh = AsyncDatabaseHelper()
+        rows = await dbh.select(["ticker", "close_plus_1"]).where_price_diff(1, -1, percent=1.1).execute()
+
+    psycopg 3 uses the same %s placeholders as psycopg2, so the compiled query templates, the result cache, and the pool settings
+    in db_pool are all shared with the sync helper.
+"""
+
+import io
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from . import db_pool
+from . import result_cache
+from .db_helpers import DatabaseHelper, PREPARE_THRESHOLD, STREAM_ITERSIZE, _cursor_ids
+
+
+logger = logging.getLogger(__name__)
+
+
+_pool = None
+_pool_lock = None
+
+async def get_async_pool():
+    """ Returns the shared async pool, creating and opening it on first use. Same size/lifetime settings as the sync pool """
+    global _pool, _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+
+    async with _pool_lock:
+        if _pool is None:
+            pool = AsyncConnectionPool(
+                db_pool.get_dsn(),
+                min_size=db_pool.POOL_MIN,
+                max_size=db_pool.POOL_MAX,
+                max_lifetime=db_pool.MAX_LIFETIME,
+                timeout=db_pool.CHECKOUT_TIMEOUT,
+                check=AsyncConnectionPool.check_connection, # health check each connection as it's checked out
+                open=False,
+            )
+            await pool.open()
+            _pool = pool
+
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+
+class AsyncDatabaseHelper(DatabaseHelper):
+    """ DatabaseHelper with async execution. All the query building functions are inherited unchanged """
+
+    async def connect(self):
+        """ Checks a connection out of the async pool and holds it until disconnect(), same as DatabaseHelper.connect """
+        if self.conn is not None and not self.conn.closed:
+            return self.conn
+
+        pool = await get_async_pool()
+        self.conn = await pool.getconn()
+        return self.conn
+
+
+    async def disconnect(self):
+        if self.conn is not None:
+            try:
+                if not self.conn.closed:
+                    await self.conn.commit()
+            finally:
+                pool = await get_async_pool()
+                await pool.putconn(self.conn)
+                self.conn = None
+
+
+    @asynccontextmanager
+    async def _checkout(self):
+        if self.conn is not None and not self.conn.closed:
+            yield self.conn
+        else:
+            pool = await get_async_pool()
+            async with pool.connection() as conn: # commits on a clean exit, rolls back if the block raises
+                yield conn
+
+
+    async def execute_sql(self, query, params=None):
+        async with self._checkout() as conn:
+            async with conn.cursor() as curs:
+                await curs.execute(query, params)
+                return await curs.fetchall()
+
+
+    async def execute_sql_stream(self, query, params=None, itersize=STREAM_ITERSIZE):
+        """ async generator version of execute_sql, backed by a server-side cursor. See DatabaseHelper.execute_sql_stream """
+        async with self._checkout() as conn:
+            async with conn.cursor(name=f"earni_stream_{next(_cursor_ids)}") as curs:
+                curs.itersize = itersize
+                await curs.execute(query, params)
+                async for row in curs:
+                    yield row
+
+
+    async def execute_batch(self, queries):
+        """ Runs several built queries back to back on one connection, in one transaction. See DatabaseHelper.execute_batch """
+        results = []
+        async with self._checkout() as conn:
+            async with conn.cursor() as curs:
+                for q in queries:
+                    if isinstance(q, str):
+                        await curs.execute(q)
+                    else:
+                        await curs.execute(q[0], q[1])
+                    results.append(await curs.fetchall())
+
+        return results
+
+
+    async def execute(self, as_="rows", cache=True):
+        """ async version of DatabaseHelper.execute, same arguments and results """
+        compiled, params, fmt, key, tickers = self._start_execute(as_, cache)
+        # the cache is shared with the sync helper and reading it polls (and sometimes reconnects) it's LISTEN connection with plain
+        # psycopg2, so it runs on a worker thread instead of blocking the event loop. put waits on the same lock
+        result = await asyncio.to_thread(result_cache.get_cache().get, key) if cache else None
+
+        if result is None:
+            sequence = result_cache.get_cache().sequence() # just reads a counter, doesn't poll
+            if fmt == "rows":
+                result = await self.execute_compiled(compiled, params)
+            else:
+                result = await self.execute_columns(compiled, params)
+            if cache:
+                await asyncio.to_thread(self._cache_result, key, result, tickers, cache, sequence)
+
+        return self._format_result(result, as_)
+
+
+    async def execute_compiled(self, compiled, params):
+        """ Executes a CompiledQuery. psycopg 3 manages server-side prepared statements per connection on it's own, so once a shape
+            is hot we just ask it to prepare """
+        compiled.hits += 1
+
+        async with self._checkout() as conn:
+            async with conn.cursor() as curs:
+                await curs.execute(compiled.sql, params, prepare=True if compiled.hits >= PREPARE_THRESHOLD else None)
+                return await curs.fetchall()
+
+
+    async def execute_columns(self, compiled, params):
+        """ async version of DatabaseHelper.execute_columns """
+        from . import columnar
+
+        async with self._checkout() as conn:
+            if compiled.columns is None:
+                async with conn.cursor() as curs:
+                    await curs.execute(columnar.describe_sql(compiled.sql), params)
+                    compiled.columns = columnar.columns_from_description(curs.description)
+
+            inner = psycopg.AsyncClientCursor(conn).mogrify(compiled.sql, params) if params else compiled.sql
+            out = io.BytesIO()
+            async with conn.cursor() as curs:
+                async with curs.copy(columnar.copy_sql(inner, compiled.columns)) as copy:
+                    async for data in copy:
+                        out.write(data)
+
+        return columnar.decode_copy(out.getbuffer(), compiled.columns)
+
+
+    def stream(self, itersize=STREAM_ITERSIZE):
+        """ Like DatabaseHelper.stream, but returns an async generator. Use with 'async for' """
+        compiled, params = self.compile()
+        self.resetQuery()
+
+        return self.execute_sql_stream(compiled.sql, params, itersize)
+
+
+    async def aggregate(self, values, stats=("count", "avg", "p25", "p75"), group_by=None, cache=True):
+        """ async version of DatabaseHelper.aggregate """
+        names = self._start_aggregate(values, stats, group_by)
+        rows = await self.execute(cache=cache)
+        return self._aggregate_results(names, rows, group_by)
+
+
+    async def histogram(self, bucket_field, low, high, buckets, values=None, stats=("count", "avg", "p25", "p75"), cache=True):
+        """ async version of DatabaseHelper.histogram """
+        names = self._start_histogram(bucket_field, low, high, buckets, values, stats)
+        rows = await self.execute(cache=cache)
+        return self._histogram_results(names, rows, low, high, buckets)
@@ -0,0 +1,275 @@
+"""
+    Columnar results for DatabaseHelper.
+
+    Pretty much every analysis we run (avg of close_plus_N / close_minus_1, bucketing by eps_diff, etc) works on whole columns at a time,
+    so instead of getting back a list of row tuples full of Decimal/date objects this fetches a query with binary COPY and decodes it
+    straight into one typed numpy array per column. Prices stay integer cents as int32, numerics come back as float64, dates as datetime64[D].
+
+    Usage:
+        cols = dbh.select(["ticker", "close_minus_1", "close_plus_1"]).where_price_diff(1, -1).execute(as_="columns")
+        change = cols["close_plus_1"] / cols["close_minus_1"]
+"""
+
+import io
+import struct
+import logging
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError: # only needed for as_="arrow"
+    pa = None
+
+
+logger = logging.getLogger(__name__)
+
+# postgres type oids -> how we decode them. Everything not listed here gets cast to text
+_INT2, _INT4, _INT8 = 21, 23, 20
+_FLOAT4, _FLOAT8, _NUMERIC = 700, 701, 1700
+_BOOL, _DATE = 16, 1082
+
+# decode kind -> (cast used in the COPY query, binary width or None for variable length, numpy dtype of the final column)
+_kinds = {
+    "int32": ("int4", 4, np.int32),
+    "int64": ("int8", 8, np.int64),
+    "float64": ("float8", 8, np.float64),
+    "bool": ("bool", 1, np.bool_),
+    "date": ("date", 4, "datetime64[D]"),
+    "text": ("text", None, str),
+}
+
+_oid_kinds = {
+    _INT2: "int32",
+    _INT4: "int32",
+    _INT8: "int64",
+    _FLOAT4: "float64",
+    _FLOAT8: "float64",
+    _NUMERIC: "float64",
+    _BOOL: "bool",
+    _DATE: "date",
+}
+
+# big-endian dtypes for the fixed width fast path
+_wire_dtypes = {
+    "int32": ">i4",
+    "int64": ">i8",
+    "float64": ">f8",
+    "bool": "?",
+    "date": ">i4",
+}
+
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_PG_EPOCH_DAYS = 10957 # postgres binary dates count days from 2000-01-01, numpy counts from 1970-01-01
+
+_i16 = struct.Struct(">h")
+_i32 = struct.Struct(">i")
+_unpackers = {
+    "int32": struct.Struct(">i").unpack_from,
+    "int64": struct.Struct(">q").unpack_from,
+    "float64": struct.Struct(">d").unpack_from,
+    "bool": struct.Struct("?").unpack_from,
+    "date": struct.Struct(">i").unpack_from,
+}
+
+
+class ColumnarResult:
+    """
+        The result of a columnar query. Acts like a read-only dict of column name -> numpy array.
+
+        Columns that had NULLs get a boolean mask in 'nulls' (True where the value was NULL). float64 columns also get NaN in those
+        spots, other types just get a 0 placeholder since int32/date arrays have no way of representing a missing value.
+    """
+
+    def __init__(self, names, columns, nulls):
+        self.names = names
+        self.columns = columns
+        self.nulls = nulls
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if self.names else 0
+
+    def keys(self):
+        return list(self.names)
+
+    def mask(self, name):
+        """ returns the NULL mask for a column, or None if the column didn't have any NULLs """
+        return self.nulls.get(name)
+
+    def to_arrow(self):
+        """ Converts the result to a pyarrow Table, passing the NULL masks through as real arrow nulls """
+        if pa is None:
+            raise ImportError("pyarrow is required for arrow results. Install it with 'pip install pyarrow'")
+
+        arrays = [pa.array(self.columns[n], mask=self.nulls.get(n)) for n in self.names]
+        return pa.Table.from_arrays(arrays, names=self.names)
+
+
+def _kind_for(type_code):
+    return _oid_kinds.get(type_code, "text")
+
+
+def describe_sql(sql):
+    """ sql that returns no rows, just the column descriptions for a query. Run it with the query's params """
+    return f"SELECT * FROM ({sql}) q LIMIT 0"
+
+
+def columns_from_description(description):
+    """ turns a cursor.description into [(name, kind)] """
+    return [(d.name, _kind_for(d.type_code)) for d in description]
+
+
+def describe(curs, sql, params):
+    """ Gets the column names and decode kinds for a query without fetching any rows """
+    curs.execute(describe_sql(sql), params)
+    return columns_from_description(curs.description)
+
+
+def copy_sql(inner, columns):
+    """ wraps a query in a binary COPY, casting every column to the type we decode it as.
+        COPY can't take bound params, so 'inner' has to have it's params inlined already (cursor.mogrify) """
+    aliases = [f"c{i}" for i in range(len(columns))]
+    casts = ", ".join(f"{a}::{_kinds[kind][0]}" for a, (_, kind) in zip(aliases, columns))
+    return f"COPY (SELECT {casts} FROM ({inner}) AS q({', '.join(aliases)})) TO STDOUT WITH (FORMAT binary)"
+
+
+def _header_length(buf):
+    if bytes(buf[:11]) != _COPY_SIGNATURE:
+        raise ValueError("Unexpected COPY output, missing PGCOPY signature")
+    ext_len = _i32.unpack_from(buf, 15)[0]
+    return 19 + ext_len
+
+
+def _decode_fixed(buf, pos, kinds):
+    """ fast path for results where every column is fixed width and nothing is NULL. Every row is then the same size, so the whole
+        body can be viewed as one structured numpy array with no python loop at all. Returns None if the data doesn't fit that layout """
+    fields = [("n", ">i2")]
+    for i, kind in enumerate(kinds):
+        fields.append((f"l{i}", ">i4"))
+        fields.append((f"v{i}", _wire_dtypes[kind]))
+    dtype = np.dtype(fields)
+
+    body = len(buf) - pos - 2 # last 2 bytes are the -1 trailer
+    if body < 0 or body % dtype.itemsize != 0:
+        return None
+
+    rows = np.frombuffer(buf, dtype=dtype, count=body // dtype.itemsize, offset=pos)
+
+    # if there were any NULLs the rows would be misaligned, so double check every field count and length before trusting it
+    if not (rows["n"] == len(kinds)).all():
+        return None
+    for i, kind in enumerate(kinds):
+        if not (rows[f"l{i}"] == _kinds[kind][1]).all():
+            return None
+
+    return [rows[f"v{i}"] for i in range(len(kinds))], [None] * len(kinds)
+
+
+def _decode_rows(buf, pos, kinds):
+    """ general path. Walks the COPY data field by field, appending each value straight onto it's column, so we never build row tuples """
+    ncols = len(kinds)
+    values = [[] for _ in range(ncols)]
+    nulls = [[] for _ in range(ncols)]
+    unpackers = [_unpackers.get(k) for k in kinds]
+    placeholders = [np.nan if k == "float64" else ("" if k == "text" else 0) for k in kinds]
+
+    buf = memoryview(buf)
+    while True:
+        nfields = _i16.unpack_from(buf, pos)[0]
+        pos += 2
+        if nfields == -1:
+            break
+
+        for i in range(ncols):
+            length = _i32.unpack_from(buf, pos)[0]
+            pos += 4
+            if length == -1:
+                values[i].append(placeholders[i])
+                nulls[i].append(len(values[i]) - 1)
+                continue
+
+            if unpackers[i] is None:
+                values[i].append(str(buf[pos:pos + length], "utf-8"))
+            else:
+                values[i].append(unpackers[i](buf, pos)[0])
+            pos += length
+
+    return values, nulls
+
+
+def _finish_column(kind, values, null_rows, nrows):
+    """ turns decoded values into the final numpy array and NULL mask for a column """
+    if kind == "date":
+        arr = (np.asarray(values, dtype=np.int64) + _PG_EPOCH_DAYS).astype("datetime64[D]")
+    elif kind == "text":
+        arr = np.asarray(values, dtype=str)
+    else:
+        arr = np.asarray(values, dtype=_kinds[kind][2])
+
+    mask = None
+    if null_rows is not None and len(null_rows) > 0:
+        mask = np.zeros(nrows, dtype=bool)
+        mask[null_rows] = True
+
+    return arr, mask
+
+
+def fetch_columns(conn, sql, params=None, columns=None):
+    """
+        Runs a query and returns it as a ColumnarResult.
+
+        Args:
+            conn: psycopg2 connection to run the query on
+            sql (str): query with %s placeholders
+            params (list): bound params for the query
+            columns (list): optional [(name, kind)] for the query, as returned by describe(). Pass this in to skip the extra
+                round trip that describe() costs (DatabaseHelper caches it per query shape)
+    """
+    with conn.cursor() as curs:
+        if columns is None:
+            columns = describe(curs, sql, params)
+
+        inner = curs.mogrify(sql, params).decode() if params else sql
+        out = io.BytesIO()
+        curs.copy_expert(copy_sql(inner, columns), out)
+
+    return decode_copy(out.getbuffer(), columns)
+
+
+def decode_copy(buf, columns):
+    """ Decodes binary COPY output for a query into a ColumnarResult
+
+        Args:
+            buf: bytes-like binary COPY output
+            columns (list): [(name, kind)] for the query, in order
+    """
+    pos = _header_length(buf)
+    kinds = [kind for _, kind in columns]
+
+    decoded = None
+    if all(_kinds[k][1] is not None for k in kinds):
+        decoded = _decode_fixed(buf, pos, kinds)
+    if decoded is None:
+        decoded = _decode_rows(buf, pos, kinds)
+    values, nulls = decoded
+
+    names = [name for name, _ in columns]
+    result_cols = {}
+    result_nulls = {}
+    nrows = len(values[0]) if values else 0
+    for i, (name, kind) in enumerate(columns):
+        arr, mask = _finish_column(kind, values[i], nulls[i], nrows)
+        result_cols[name] = arr
+        if mask is not None:
+            result_nulls[name] = mask
+
+    logger.debug("Fetched %d rows x %d columns as columns", nrows, len(names))
+    return ColumnarResult(names, result_cols, result_nulls)
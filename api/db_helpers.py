@@ -4,10 +4,17 @@
     May abstract parts out later for a general db class.
 """
 
-import psycopg2
 import traceback
-from pathlib import Path
 import logging
+import itertools
+import re
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from . import db_pool
+from . import result_cache
 
 
  # TODO :: move all the logging stuff somewhere else once I create an actual main script
@@ -19,10 +26,6 @@ console_formatter = logging.Formatter('[%(name)s :: %(levelname)s] %(message)s')
 console_handler.setFormatter(console_formatter)
 logger.addHandler(console_handler)
 
-# get the path to the file with my pw in it. will research how to keep passwords secure and change this functionality before deploying this code anywhere
-# TODO :: look into how to keep db passwords hidden in deployed apps
-_pwpath = (Path(__file__).resolve().parent / ".." / "db" / "dbpassword").resolve()
-
 # mapping from int values to column names, so that code can just use integer values to compare prices for different days
 _col_names = {
     -30: "_minus_30", 
@@ -51,7 +54,8 @@ _valid_fields = {
     "period_end": "er.period_end",
     "eps_reported": "er.eps_reported",
     "eps_estimate": "er.eps_estimate",
-    "eps_diff": "(er.eps_reported - er.eps_estimate)",
+    "eps_diff": "(er.eps_reported - er.eps_estimate)", # not price_returns, reports without a returns row still have an eps surprise
+    "eps_surprise_ratio": "pr.eps_surprise_ratio",
     "surprise": "er.surprise",
     "surprise_percent": "er.surprise_percent",
     "time_of_report": "er.time_of_report"
@@ -60,6 +64,25 @@ for t in ["close", "open", "high", "low", "volume"]:
     for c in _col_names:
         _valid_fields[t + _col_names[c]] = "ph." + t + _col_names[c]
 
+# close-to-close returns that are precomputed in the price_returns table (db/migrations/002_price_returns.sql). Has to match the columns there.
+# (a, b) means close_a / close_b. Fields and where_price_diff calls for these pairs get routed to price_returns instead of computing the ratio per row
+_return_pairs = (
+    [(o, -1) for o in [1, 2, 3, 4, 5, 10, 20, 30]] +    # post-earnings move vs the day before
+    [(o, 1) for o in [2, 3, 4, 5, 10, 20, 30]] +        # rebound(or not) after the first day
+    [(-1, o) for o in [-5, -10, -20, -30]]              # pre-earnings run up / drawdown
+)
+def _return_col(a, b):
+    return "return" + _col_names[a] + _col_names[b]
+
+for a, b in _return_pairs:
+    _valid_fields[_return_col(a, b)] = "pr." + _return_col(a, b)
+
+# price_returns gets joined in automatically by _compile when a query uses any of it's fields. LEFT JOIN so selecting a field from it never
+# drops reports that don't have a price_returns row yet (refresh_derived hasn't run for the ticker). Filters on pr fields still need the row,
+# and postgres turns the join back into an inner one for those, so they keep using the price_returns indexes
+_returns_join = " LEFT JOIN price_returns pr ON pr.ticker = ph.ticker AND pr.report_date = ph.report_date"
+_uses_returns = re.compile(r"\bpr\.")
+
 # used in select clauses for constructed fields. If name exists in _special_fields, add the 'as xxxx'
 # these values are duplicated in _valid_fields because WHERE clauses use the normal _valid_field strings. This is an extra check for SELECT clauses
 # if i wanted to I could add a quick loop to append keys from _special_fields to _valid_fields, to remove the risks of code duplication, but I prefer knowing if I missed something
@@ -80,6 +103,91 @@ def _get_field(name, is_strict):
         return _valid_fields[name]
 
 
+# comparison operators allowed in where_value_is. relation gets pasted into the sql so it has to be checked
+_relations = {"<", ">", "=", "<=", ">=", "!="}
+
+
+def _param(val):
+    """ Returns the placeholder for a bound parameter, with an explicit cast based on the python type.
+        The cast matters for prepared statements: without it postgres infers the param type from the column it's compared to,
+        so a percent of 1.1 compared against an INTEGER price column would get silently truncated to 1 """
+    if isinstance(val, bool):
+        return "%s::boolean"
+    if isinstance(val, (int, float, Decimal)):
+        return "%s::numeric"
+    if isinstance(val, datetime):
+        return "%s::timestamp"
+    if isinstance(val, date):
+        return "%s::date"
+    # strings are left untyped so postgres reads them as whatever the column is. e.g. '2024-01-01' compared to report_date is a date
+    return "%s"
+
+
+# compiled query settings
+QUERY_CACHE_SIZE = 256      # how many distinct query shapes to keep compiled sql for
+PREPARE_THRESHOLD = 3       # a shape has to be executed this many times before we bother with a server-side prepared statement
+
+_stmt_ids = itertools.count(1)
+
+# rows fetched per round trip when streaming with a server-side cursor. Bigger is fewer round trips, smaller is less memory
+STREAM_ITERSIZE = 5000
+_cursor_ids = itertools.count(1)
+
+
+class CompiledQuery:
+    """ The normalized sql for one query 'shape' (the same SELECT fields, FROM, and WHERE clauses, ignoring the actual threshold values).
+        Queries that only differ by their params compile to the same CompiledQuery, so they can share a server-side prepared statement """
+    __slots__ = ("sql", "prepare_sql", "name", "nparams", "hits", "columns")
+
+    def __init__(self, sql):
+        self.sql = sql # psycopg2 style, with %s placeholders
+        self.name = f"earni_q{next(_stmt_ids)}"
+
+        # same query with postgres-style $1, $2... placeholders for PREPARE
+        counter = itertools.count(1)
+        body = re.sub(r"%s", lambda m: f"${next(counter)}", sql)
+        self.nparams = next(counter) - 1
+        self.prepare_sql = f"PREPARE {self.name} AS {body}"
+        self.hits = 0
+        self.columns = None # [(name, kind)] for columnar results, filled in the first time this shape is fetched as columns
+
+    def execute_sql(self):
+        """ sql for running the prepared version of this query. Only valid on a connection this has been prepared on """
+        if self.nparams == 0:
+            return f"EXECUTE {self.name}"
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * self.nparams)})"
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _compile(select, from_clause, where, group_by=""):
+    """ builds the sql for a query shape. select and where are tuples of clause templates so the shape can be used as the cache key """
+    # TODO :: Throw error(or just add * ?) if select is empty
+    # TODO :: Throw error if where is empty
+    if any(_uses_returns.search(c) for c in select + where):
+        from_clause = from_clause + _returns_join
+
+    query = "SELECT " + ", ".join(select) + " FROM " + from_clause
+    if where:
+        query = query + " WHERE " + " AND ".join(where)
+    query = query + group_by
+
+    return CompiledQuery(query)
+
+
+# aggregates available to aggregate() and histogram(). {} is replaced with the field's sql. Everything is cast to float8 first so
+# integer cent prices don't get integer math, and so results come back as floats instead of Decimals
+_aggregates = {
+    "count": "count({})",
+    "avg": "avg(({})::float8)",
+    "min": "min(({})::float8)",
+    "max": "max(({})::float8)",
+    "stddev": "stddev_samp(({})::float8)",
+    "median": "percentile_cont(0.5) WITHIN GROUP (ORDER BY ({})::float8)",
+    "p25": "percentile_cont(0.25) WITHIN GROUP (ORDER BY ({})::float8)", # bottom 25% cutoff
+    "p75": "percentile_cont(0.75) WITHIN GROUP (ORDER BY ({})::float8)", # top 25% cutoff
+}
+
+
 """ 
     This class will provide very easy-to-use functions for all types of queries required by the API.
     The goal is that any possible query required by the API can be created in a straightforward and readable way, all the complexity
@@ -97,85 +205,364 @@ class DatabaseHelper:
         self.options = {
             "SELECT": [],
             "FROM": "price_history ph JOIN earnings_reports er ON ph.ticker = er.ticker AND ph.report_date = er.date", # default from. If I end up needing different tables/joins I'll subclass and create separate helpers for different types of queries
-            "WHERE": []
+            "WHERE": [],
+            "SELECT_PARAMS": [], # bound params, in the order their placeholders appear in the SELECT/WHERE templates
+            "WHERE_PARAMS": [],
+            "TICKERS": None, # tickers the query is limited to, if any. Used to invalidate cached results when a ticker gets new data
+            "GROUP_BY": "" # GROUP BY/ORDER BY suffix, only used by aggregate() and histogram()
         }
 
     def connect(self):
         """
-        This method creates a connection to the database, or returns one if it already exists.
+        This method checks a connection out of the shared pool and holds onto it until disconnect() is called, or does nothing
+        if this helper is already holding one. Only needed when a caller wants several calls to run on the same connection,
+        execute_sql checks out a connection per call on its own otherwise.
 
         Returns:
             psycopg2.connection: A connection to the database.
         """
 
-        # TODO :: check if conn is closed
         if self.conn is not None and self.conn.closed == 0:
-            print("[api.db_helpers :: connect] Already connected to db, returning existing connection.")
-            return
-        
-        # grab database password from file
-        with open(_pwpath, "r", encoding="utf-8") as file:
-            dbpassword = file.readline().strip()
+            logger.debug("Already holding a db connection, returning existing connection.")
+            return self.conn
 
-        # create database connection
         try:
-            self.conn = psycopg2.connect(f"dbname='earni' user='earni' host='localhost' password='{dbpassword}'")
-            print("[api.db_helpers :: connect] Connected to earni database", True)
-        except Exception as e:
-            print("[api.db_helpers :: connect] Failed to connect to database", traceback.format_exc())
+            self.conn = db_pool.get_pool().getconn()
+        except Exception:
+            logger.error("Failed to get a connection from the pool: %s", traceback.format_exc())
             raise
 
+        return self.conn
+
     
 
     def disconnect(self):
-        """ This method closes the connection to the database. """
+        """ This method commits and hands the held connection back to the pool. """
         if self.conn is not None:
-            self.conn.commit()
-            self.conn.close()
-            self.conn = None
+            try:
+                if self.conn.closed == 0:
+                    self.conn.commit()
+            finally:
+                db_pool.get_pool().putconn(self.conn)
+                self.conn = None
+
+
+    @contextmanager
+    def _checkout(self):
+        """ yields the connection held by connect() if there is one, otherwise checks one out of the pool just for this request """
+        if self.conn is not None and self.conn.closed == 0:
+            yield self.conn
+        else:
+            with db_pool.get_pool().connection() as conn:
+                yield conn
 
     
-    def execute_sql(self, query):
-        self.connect()
+    def execute_sql(self, query, params=None):
+        with self._checkout() as conn:
+            with conn.cursor() as curs:
+                curs.execute(query, params)
+                return curs.fetchall()
 
-        with self.conn.cursor() as curs:
-            curs.execute(query)
-            return curs.fetchall()
 
+    def execute_sql_stream(self, query, params=None, itersize=STREAM_ITERSIZE):
+        """ Generator version of execute_sql. Uses a named (server-side) cursor so rows come over in chunks of 'itersize'
+            as they're consumed, instead of the whole result set being loaded into memory at once.
+
+            The connection stays checked out until the generator is exhausted or closed, so don't leave half-consumed streams lying around
+        """
+        with self._checkout() as conn:
+            # named cursors only live inside a transaction, and names have to be unique per connection
+            with conn.cursor(name=f"earni_stream_{next(_cursor_ids)}") as curs:
+                curs.itersize = itersize
+                curs.execute(query, params)
+                for row in curs:
+                    yield row
+
+
+    def execute_batch(self, queries):
+        """ Runs several queries back to back on a single checked out connection, in one transaction.
+            Build the queries with build() first. e.g.:
+                q1 = dbh.select(["ticker", "close_plus_1"]).where_price_diff(1, -1).build()
+                q2 = dbh.select(["ticker", "close_plus_5"]).where_price_diff(5, -1).build()
+                r1, r2 = dbh.execute_batch([q1, q2])
+
+            Args:
+                queries (list): list of (sql, params) tuples as returned by build(), or plain sql strings
+
+            Returns:
+                list: one list of result rows per query, in the same order as queries
+        """
+        results = []
+        with self._checkout() as conn:
+            with conn.cursor() as curs:
+                for q in queries:
+                    if isinstance(q, str):
+                        curs.execute(q)
+                    else:
+                        curs.execute(q[0], q[1])
+                    results.append(curs.fetchall())
+
+        return results
+
+
+
+    def compile(self):
+        """ Compiles the current query to it's normalized sql template and bound params, without resetting the builder.
+            Templates are cached by shape, so repeated screens that only change thresholds skip building the sql entirely
+
+            Returns:
+                tuple: (CompiledQuery, list of params)
+        """
+        compiled = _compile(tuple(self.options["SELECT"]), self.options["FROM"], tuple(self.options["WHERE"]), self.options["GROUP_BY"])
+        params = self.options["SELECT_PARAMS"] + self.options["WHERE_PARAMS"]
+        return compiled, params
+
+
+    def build(self):
+        """ Builds the sql for the current query and resets the builder, without executing anything. Used for execute_batch
+
+            Returns:
+                tuple: (sql, params) ready to be passed to cursor.execute
+        """
+        compiled, params = self.compile()
+        self.resetQuery()
+
+        return compiled.sql, params
 
 
     # executes query based on current self.params
-    def execute(self):
+    def execute(self, as_="rows", cache=True):
         """ This function actually executes a query and returns the output. The other helper functions in this module are for building queries, but
-            they need to be passed to this function to actually be executed """
-        
-        # build SELECT clause
-        # TODO :: Throw error(or just add * ?) if options.SELECT is empty
-        query = "SELECT "
-        for s in self.options["SELECT"][:-1]: 
-            query = query + s + ", "
-        query = query + self.options["SELECT"][-1]
-
-        # insert FROM clause
-        query = query + " FROM " + self.options["FROM"]
-
-        # create WHERE clause
-        # TODO :: Throw error if options.WHERE is empty
-        query = query + " WHERE " + self.options["WHERE"][0]
-        for w in self.options["WHERE"][1:]:
-            query = query + " AND " + w
+            they need to be passed to this function to actually be executed
+
+            Args:
+                as_ (str) - default 'rows': format of the result.
+                    'rows' returns a list of row tuples.
+                    'columns' returns a columnar.ColumnarResult, a dict-like of column name -> typed numpy array (prices stay int32 cents, numerics are float64).
+                    'arrow' returns the same columns as a pyarrow Table.
+                cache (bool) - default True: serve the result from the shared result cache if the same query(same sql and params) ran recently,
+                    and cache it if not. Cached results are dropped when populate_prices/insert_eps write new data for a ticker the query covers
+        """
+
+        compiled, params, fmt, key, tickers = self._start_execute(as_, cache)
+        result = result_cache.get_cache().get(key) if cache else None
+
+        if result is None:
+            sequence = result_cache.get_cache().sequence() # so a write that commits while this runs keeps it out of the cache
+            if fmt == "rows":
+                result = self.execute_compiled(compiled, params)
+            else:
+                result = self.execute_columns(compiled, params)
+            self._cache_result(key, result, tickers, cache, sequence)
 
+        return self._format_result(result, as_)
+
+
+    # execute() is split into these steps so AsyncDatabaseHelper(api/async_db_helpers.py) can reuse everything except the actual db calls
+
+    def _start_execute(self, as_, cache):
+        """ validates as_, compiles and resets the current query, and works out it's result cache key """
+        if as_ not in ("rows", "columns", "arrow"):
+            raise ValueError(f"Invalid arg as_: {as_}. Expected one of: 'rows', 'columns', 'arrow'")
+
+        compiled, params = self.compile()
+        tickers = self.options["TICKERS"]
         self.resetQuery()
 
-        # TODO :: Execute query instead of just returning
-        return self.execute_sql(query)
+        fmt = "rows" if as_ == "rows" else "columns" # arrow results are built from the cached columns
+        key = (compiled.sql, tuple(params), fmt)
+        return compiled, params, fmt, key, tickers
+
+
+    def _cache_result(self, key, result, tickers, cache, sequence=None):
+        if cache and len(result) <= result_cache.MAX_CACHED_ROWS:
+            if key[2] == "columns":
+                for col in result.columns.values(): # cached arrays are shared between callers, so nobody gets to modify them
+                    col.flags.writeable = False
+            result_cache.get_cache().put(key, result, tickers, sequence)
+
+
+    def _format_result(self, result, as_):
+        if as_ == "rows":
+            return list(result) # copy so callers can't mutate the cached list
+        return result if as_ == "columns" else result.to_arrow()
+
+
+    def execute_columns(self, compiled, params):
+        """ Executes a CompiledQuery through binary COPY and decodes it straight into numpy columns. See api/columnar.py """
+        from . import columnar # imported here so numpy is only needed by callers that actually want columns
+
+        with self._checkout() as conn:
+            if compiled.columns is None:
+                with conn.cursor() as curs:
+                    compiled.columns = columnar.describe(curs, compiled.sql, params)
+
+            return columnar.fetch_columns(conn, compiled.sql, params, compiled.columns)
+
+
+    def stream(self, itersize=STREAM_ITERSIZE):
+        """ Like execute(), but returns a generator that yields rows one at a time, fetched from the server 'itersize' rows at a time.
+            Use this for big screens (e.g. all tickers, all dates) so memory stays flat no matter how many rows match. e.g.:
+                for row in dbh.select(["ticker", "close_plus_1"]).where_price_diff(1, -1).stream():
+                    ...
+
+            Args:
+                itersize (int): how many rows to fetch per round trip to the server
+        """
+        # build now, not on the first next(), so the builder is reset as soon as stream() is called like it is with execute()
+        # (server-side cursors can't be declared on an EXECUTE, so streams always use the plain sql rather than a prepared statement)
+        compiled, params = self.compile()
+        self.resetQuery()
+
+        return self.execute_sql_stream(compiled.sql, params, itersize)
+
+
+    def _aggregate_selects(self, values, stats):
+        """ validates values/stats and returns (list of select clauses, list of result column names) for them """
+        if type(values) is not list:
+            values = [values]
+        if type(stats) is not list:
+            stats = list(stats) if isinstance(stats, tuple) else [stats]
+
+        selects = []
+        names = []
+        for v in values:
+            if v not in _valid_fields:
+                logger.error(f"Invalid value({v}) passed into aggregate. Valid fields: {list(_valid_fields)}")
+                raise ValueError(f"Invalid aggregate field: {v}. Valid fields are: {list(_valid_fields)}")
+            for stat in stats:
+                if stat not in _aggregates:
+                    raise ValueError(f"Invalid aggregate stat: {stat}. Expected one of: {list(_aggregates)}")
+                selects.append(_aggregates[stat].format(_valid_fields[v]) + f" as {v}_{stat}")
+                names.append(f"{v}_{stat}")
+
+        return selects, names
+
+
+    def aggregate(self, values, stats=("count", "avg", "p25", "p75"), group_by=None, cache=True):
+        """ Runs the current query(FROM/WHERE) as an aggregate in the database, so only the summaries come back instead of every row.
+            Any fields added with select() are ignored. e.g. average post-earnings move at each x-day mark:
+                dbh.where_value_is("eps_diff", ">", 0.05).aggregate(["return_plus_1_minus_1", "return_plus_5_minus_1", "return_plus_30_minus_1"], ["avg", "p25", "p75"])
+
+            Args:
+                values (str | list): fields to summarize
+                stats (list) - default count, avg, p25, p75: which aggregates to compute for each value. See _aggregates
+                group_by (str) - default None: optional field to group by, e.g. 'ticker' or 'time_of_report'. One result per group, ordered by it
+                cache (bool) - default True: use the shared result cache, same as execute()
+
+            Returns:
+                list: one dict per group(or a single dict if group_by is None) mapping '<value>_<stat>' to the result
+        """
+        names = self._start_aggregate(values, stats, group_by)
+        rows = self.execute(cache=cache)
+        return self._aggregate_results(names, rows, group_by)
+
+
+    def _start_aggregate(self, values, stats, group_by):
+        """ sets up the SELECT/GROUP BY for aggregate() and returns the result column names """
+        selects, names = self._aggregate_selects(values, stats)
+
+        if group_by is not None:
+            field = _get_field(group_by, True)
+            selects.insert(0, f"{field} as {group_by}")
+            names.insert(0, group_by)
+            self.options["GROUP_BY"] = " GROUP BY 1 ORDER BY 1"
+
+        self.options["SELECT"] = selects
+        self.options["SELECT_PARAMS"] = []
+        return names
+
+
+    def _aggregate_results(self, names, rows, group_by):
+        results = [dict(zip(names, r)) for r in rows]
+        return results if group_by is not None else results[0]
+
+
+    def histogram(self, bucket_field, low, high, buckets, values=None, stats=("count", "avg", "p25", "p75"), cache=True):
+        """ Buckets the current query's rows by a field with width_bucket, and summarizes each bucket in the database. This is the query
+            behind the bucketed bar graphs, e.g. average 5 day move bucketed by eps_diff in 0.1 steps:
+                dbh.histogram("eps_diff", -0.5, 0.5, 10, values=["return_plus_5_minus_1"], stats=["count", "avg", "p25", "p75"])
+
+            Args:
+                bucket_field (str): field to bucket on
+                low (float): lower bound of the first bucket
+                high (float): upper bound of the last bucket
+                buckets (int): number of equal width buckets between low and high
+                values (list) - default None: fields to summarize in each bucket. Only counts rows if None
+                stats (list) - default count, avg, p25, p75: aggregates to compute for each value
+                cache (bool) - default True: use the shared result cache, same as execute()
+
+            Returns:
+                list: one dict per non-empty bucket, ordered by bucket, with 'bucket', 'low', 'high', 'count' and '<value>_<stat>' keys.
+                    rows below 'low' land in bucket 0 and rows at or above 'high' land in bucket buckets + 1. Those have low/high of -inf/inf
+        """
+        names = self._start_histogram(bucket_field, low, high, buckets, values, stats)
+        rows = self.execute(cache=cache)
+        return self._histogram_results(names, rows, low, high, buckets)
+
+
+    def _start_histogram(self, bucket_field, low, high, buckets, values, stats):
+        """ validates args and sets up the SELECT/GROUP BY for histogram(). Returns the result column names """
+        if bucket_field not in _valid_fields:
+            raise ValueError(f"Invalid bucket field: {bucket_field}. Valid fields are: {list(_valid_fields)}")
+        if type(buckets) is not int or buckets < 1:
+            raise ValueError(f"Invalid arg buckets: {buckets}. Expected a positive int")
+        if not low < high:
+            raise ValueError(f"Invalid bucket range: low({low}) has to be less than high({high})")
+
+        selects, names = self._aggregate_selects(values, stats) if values is not None else ([], [])
+        selects = [f"width_bucket(({_valid_fields[bucket_field]})::float8, %s::float8, %s::float8, %s::int) as bucket", "count(*) as count"] + selects
+        names = ["bucket", "count"] + names
+
+        self.options["SELECT"] = selects
+        self.options["SELECT_PARAMS"] = [low, high, buckets]
+        self.options["GROUP_BY"] = " GROUP BY 1 ORDER BY 1"
+        return names
+
+
+    def _histogram_results(self, names, rows, low, high, buckets):
+        width = (high - low) / buckets
+        results = []
+        for r in rows:
+            result = dict(zip(names, r))
+            b = result["bucket"]
+            result["low"] = float("-inf") if b == 0 else low + (b - 1) * width
+            result["high"] = float("inf") if b == buckets + 1 else low + b * width
+            results.append(result)
+
+        return results
+
+
+    def execute_compiled(self, compiled, params):
+        """ Executes a CompiledQuery. Once a shape is hot (executed PREPARE_THRESHOLD times) it gets prepared on whichever pooled
+            connection runs it, and from then on that connection skips planning for it """
+        compiled.hits += 1
+
+        with self._checkout() as conn:
+            with conn.cursor() as curs:
+                if compiled.hits < PREPARE_THRESHOLD:
+                    curs.execute(compiled.sql, params)
+                    return curs.fetchall()
+
+                prepared = db_pool.get_pool().prepared(conn)
+                if compiled.name not in prepared:
+                    curs.execute(compiled.prepare_sql)
+                    prepared.add(compiled.name)
+                    logger.debug("Prepared %s: %s", compiled.name, compiled.sql)
+
+                curs.execute(compiled.execute_sql(), params)
+                return curs.fetchall()
 
 
     def resetQuery(self):
         self.options = {
             "SELECT": [],
             "FROM": "price_history ph JOIN earnings_reports er ON ph.ticker = er.ticker AND ph.report_date = er.date", # default from. If I end up needing different tables/joins I'll subclass and create separate helpers for different types of queries
-            "WHERE": []
+            "WHERE": [],
+            "SELECT_PARAMS": [], # bound params, in the order their placeholders appear in the SELECT/WHERE templates
+            "WHERE_PARAMS": [],
+            "TICKERS": None, # tickers the query is limited to, if any. Used to invalidate cached results when a ticker gets new data
+            "GROUP_BY": "" # GROUP BY/ORDER BY suffix, only used by aggregate() and histogram()
         }
 
 
@@ -203,8 +590,14 @@ class DatabaseHelper:
 
     def custom_select(self, a, operator, b, name):
         a = _get_field(a, True)
-        b = _get_field(b, False)
+        if b in _valid_fields:
+            b = _valid_fields[b]
+        else: # raw values are bound as params so they don't end up in the sql text
+            self.options["SELECT_PARAMS"].append(b)
+            b = _param(b)
         self.options["SELECT"].append(f"{a} {operator} {b} as {name}")
+
+        return self
     
 
     def where_price_diff(self, a, b, amount=None, percent=None, type_a='close', type_b='close'):
@@ -215,7 +608,7 @@ class DatabaseHelper:
             
             if amount and percent are both none, just do a > b
             if amount isn't none, do a > (b + amount)
-            if percent isn't none, do a >= (b * percent)
+            if percent isn't none, do (a / b) > percent
             
             
             Args:
@@ -242,17 +635,22 @@ class DatabaseHelper:
 
         #print(f"[DEBUG :: where_price_diff] comparing {col_a} and {col_b}")
 
+        # amount and percent are bound as params, so screens that only change the threshold share the same sql
         if amount is not None: # we are doing an amount comparison. a > (b + amount). amount takes precedence if an amount and percent arg are passed in for some reason
-            # NOTE :: I AM HERE. create the where clause(without the word WHERE - that's part of the build func) for a > (b + amount) type queries. Then do the same for percent. Then do the same for basic a > b
-            clause = f"ph.{col_a} > ph.{col_b} + amount"
-            self.options["WHERE"].append(clause)
-            return self 
+            clause = f"ph.{col_a} > ph.{col_b} + {_param(amount)}"
+            self.options["WHERE_PARAMS"].append(amount)
+        elif percent is not None and type_a == type_b == "close" and (a, b) in _return_pairs: # precomputed in price_returns, no math needed
+            clause = f"pr.{_return_col(a, b)} > %s::float8"
+            self.options["WHERE_PARAMS"].append(percent)
         elif percent is not None: # percent comparison. a > (b * percent)
-            clause = f"ph.{col_a} > ph.{col_b} * {percent}"
-            self.options["WHERE"].append(clause)
+            # written as a ratio, the same way price_returns computes them, so an expression index on it can be used if a pair turns out to be popular.
+            # NULLIF keeps bad 0 prices from raising a division by zero, those rows just don't match
+            clause = f"(ph.{col_a}::float8 / NULLIF(ph.{col_b}, 0)) > %s::float8"
+            self.options["WHERE_PARAMS"].append(percent)
         else: # regular comparison. a > b
             clause = f"ph.{col_a} > ph.{col_b}"
 
+        self.options["WHERE"].append(clause)
         return self
     
 
@@ -271,11 +669,24 @@ class DatabaseHelper:
             logger.error(f"Invalid prop({prop}) passed into where_value_is. Valid prop names: {_valid_fields}")
             raise ValueError(f"Invalid arg prop: {prop}. Expected one of: {_valid_fields}")
         
+        if relation not in _relations:
+            logger.error(f"Invalid relation({relation}) passed into where_value_is. Valid relations: {_relations}")
+            raise ValueError(f"Invalid arg relation: {relation}. Expected one of: {_relations}")
+
+        # column names go into the sql, raw values get bound as params
         if val in _valid_fields:
             val = _valid_fields[val]
+        else:
+            if prop == "ticker" and relation == "=" and not offset: # remember which ticker(s) this query is limited to for cache invalidation
+                self.options["TICKERS"] = (self.options["TICKERS"] or frozenset()) | {val}
+            self.options["WHERE_PARAMS"].append(val)
+            val = _param(val)
         
         if offset:
-            clause = f"{_valid_fields[prop]} {relation} {val} + {offset}"
+            # whole numbers are bound as integers, not _param's numeric. date + integer is days, there's no date + numeric operator
+            offset_param = "%s::integer" if isinstance(offset, int) and not isinstance(offset, bool) else _param(offset)
+            clause = f"{_valid_fields[prop]} {relation} {val} + {offset_param}"
+            self.options["WHERE_PARAMS"].append(offset)
         else:
             clause = f"{_valid_fields[prop]} {relation} {val}"
 
@@ -0,0 +1,239 @@
+"""
+    Shared connection pool for the earni database.
+
+    Every DatabaseHelper draws its connections from the one pool in this module instead of opening its own, so the api only pays
+    connection setup latency when the pool actually needs a new connection. Connections are checked out per request and handed
+    back when the request is done, which is what makes it safe to serve parallel requests from multiple threads.
+
+    Usage:
+        with db_pool.get_pool().connection() as conn:
+            with conn.cursor() as curs:
+                curs.execute("SELECT 1")
+"""
+
+import psycopg2
+from psycopg2.pool import PoolError
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# same password file db_helpers used to read on every connect. Now it's only read once per process
+# TODO :: look into how to keep db passwords hidden in deployed apps
+_pwpath = (Path(__file__).resolve().parent / ".." / "db" / "dbpassword").resolve()
+
+# pool settings. These are just reasonable starting points, tune them once the api is actually getting traffic
+POOL_MIN = 1                # connections to keep open even when idle
+POOL_MAX = 10               # hard cap on open connections. checkouts past this block until one is returned
+MAX_LIFETIME = 30 * 60      # seconds. connections older than this are closed and replaced instead of being reused
+HEALTH_CHECK_AFTER = 30     # seconds. connections that sat idle longer than this get a 'SELECT 1' before being handed out
+CHECKOUT_TIMEOUT = 30       # seconds to wait for a free connection before giving up
+
+
+@lru_cache(maxsize=1)
+def _get_dbpassword():
+    """ grab database password from file. Cached so we only touch the disk the first time """
+    with open(_pwpath, "r", encoding="utf-8") as file:
+        return file.readline().strip()
+
+
+def get_dsn():
+    """ Returns the connection string for the earni database """
+    return f"dbname='earni' user='earni' host='localhost' password='{_get_dbpassword()}'"
+
+
+class _PooledConn:
+    """ Small record for a pooled connection, so we know when it was opened and when it was last used """
+    __slots__ = ("conn", "created", "last_used", "prepared")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.prepared = set() # names of server-side prepared statements that exist on this connection
+
+
+class ConnectionPool:
+    """
+        A bounded, thread-safe pool of psycopg2 connections.
+
+        psycopg2.pool.ThreadedConnectionPool raises as soon as it runs out of connections and doesn't know anything about stale
+        or dead connections, so this is a thin pool of our own that blocks until a connection is free, health checks connections
+        that have been idle for a while, and recycles connections once they hit MAX_LIFETIME.
+    """
+
+    def __init__(self, dsn=None, minconn=POOL_MIN, maxconn=POOL_MAX, max_lifetime=MAX_LIFETIME, health_check_after=HEALTH_CHECK_AFTER):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+
+        self._dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._idle = [] # LIFO stack of _PooledConn. Most recently used conns are reused first so the rest can age out
+        self._in_use = {} # id(conn) -> _PooledConn for everything currently checked out
+        self._cond = threading.Condition()
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+
+    def _open(self):
+        dsn = self._dsn if self._dsn is not None else get_dsn()
+        try:
+            pc = _PooledConn(psycopg2.connect(dsn))
+        except Exception:
+            logger.exception("Failed to open pooled connection to database")
+            raise
+
+        logger.debug("Opened new pooled connection (%d in use, %d idle)", len(self._in_use), len(self._idle))
+        return pc
+
+
+    def _discard(self, pc):
+        try:
+            if pc.conn.closed == 0:
+                pc.conn.close()
+        except Exception:
+            logger.warning("Error while closing pooled connection", exc_info=True)
+
+
+    def _is_usable(self, pc):
+        """ checks if an idle connection can be handed out. Closes and returns False if it's dead or too old """
+        now = time.monotonic()
+        if pc.conn.closed != 0 or now - pc.created > self.max_lifetime:
+            self._discard(pc)
+            return False
+
+        if now - pc.last_used > self.health_check_after:
+            try:
+                with pc.conn.cursor() as curs:
+                    curs.execute("SELECT 1")
+                pc.conn.rollback()
+            except Exception:
+                logger.info("Pooled connection failed health check, replacing it")
+                self._discard(pc)
+                return False
+
+        return True
+
+
+    def getconn(self, timeout=CHECKOUT_TIMEOUT):
+        """ Checks a connection out of the pool. Blocks for up to 'timeout' seconds if all connections are in use.
+            Every connection returned by this has to be given back with putconn(), prefer using connection() which does that for you """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                # reuse an idle conn if we have one. Health checks happen while holding the lock, they're only a round trip
+                while self._idle:
+                    pc = self._idle.pop()
+                    if self._is_usable(pc):
+                        self._in_use[id(pc.conn)] = pc
+                        return pc.conn
+
+                # nothing idle, open a new one if we're under the cap
+                if len(self._in_use) < self.maxconn:
+                    pc = self._open()
+                    self._in_use[id(pc.conn)] = pc
+                    return pc.conn
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolError(f"timed out after {timeout}s waiting for a database connection ({self.maxconn} in use)")
+                self._cond.wait(remaining)
+
+
+    def putconn(self, conn):
+        """ Returns a connection to the pool. Any open transaction is rolled back so the next user gets a clean connection """
+        with self._cond:
+            pc = self._in_use.pop(id(conn), None)
+            if pc is None:
+                raise PoolError("trying to put a connection that wasn't checked out of this pool")
+
+            if self._closed or conn.closed != 0:
+                self._discard(pc)
+            else:
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    pc.last_used = time.monotonic()
+                    self._idle.append(pc)
+                except Exception:
+                    self._discard(pc)
+
+            self._cond.notify()
+
+
+    @contextmanager
+    def connection(self, timeout=CHECKOUT_TIMEOUT):
+        """ Checks out a connection for the duration of a with block. Commits if the block finishes cleanly, rolls back if it raises """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if conn.closed == 0:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+
+    def closeall(self):
+        """ Closes every idle connection and stops handing out new ones. Checked out connections are closed as they're returned """
+        with self._cond:
+            self._closed = True
+            for pc in self._idle:
+                self._discard(pc)
+            self._idle = []
+            self._cond.notify_all()
+
+
+    def prepared(self, conn):
+        """ Returns the set of prepared statement names for a checked out connection. Prepared statements only live as long as
+            the connection does, so this goes away with the connection when it's recycled """
+        with self._cond:
+            pc = self._in_use.get(id(conn))
+            if pc is None:
+                raise PoolError("connection wasn't checked out of this pool")
+            return pc.prepared
+
+
+    def stats(self):
+        with self._cond:
+            return {"in_use": len(self._in_use), "idle": len(self._idle), "max": self.maxconn}
+
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """ Returns the shared pool, creating it on first use """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    """ Closes the shared pool. The next get_pool() call will create a fresh one """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,205 @@
+"""
+    In-memory filter engine for interactive screens.
+
+    Loads the price_history x earnings_reports join once into numpy columns (through DatabaseHelper's columnar mode), then evaluates the
+    same filters DatabaseHelper supports as vectorized boolean masks. Tweaking a threshold re-runs a single numpy comparison instead
+    of a full sql round trip, so the web app can re-filter on every keystroke without touching postgres.
+
+    Usage:
+        engine = FilterEngine.load()
+        screen = engine.screen().where_price_diff(5, 1, percent=1.05).where_value_is("eps_diff", ">", 0.08)
+        idx = screen.indices() # matching row indices
+        data = screen.rows(["ticker", "report_date", "close_plus_5"]) # dict of column name -> matching values
+"""
+
+import operator
+import logging
+from collections import OrderedDict
+import numpy as np
+
+from .db_helpers import DatabaseHelper, _valid_fields, _col_names, _relations
+
+
+logger = logging.getLogger(__name__)
+
+# surprise_percent is left out of the default load because the column is actually named surprice_percent in create_db.sh
+_default_fields = [f for f in _valid_fields if f != "surprise_percent"]
+
+_ops = {
+    "<": operator.lt,
+    ">": operator.gt,
+    "=": operator.eq,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "!=": operator.ne,
+}
+
+MASK_CACHE_SIZE = 128 # number of individual clause masks to keep around. Re-running a screen only recomputes the clauses that changed
+
+
+class FilterEngine:
+    """ Holds the joined dataset as columns and hands out Screens to filter it """
+
+    def __init__(self, columns):
+        """
+            Args:
+                columns (columnar.ColumnarResult): the loaded dataset. Use FilterEngine.load() to get one from the db
+        """
+        self.columns = columns
+        self.size = len(columns)
+        self._mask_cache = OrderedDict()
+
+
+    @classmethod
+    def load(cls, fields=None, dbh=None):
+        """ Loads the joined dataset from the db. This is the only query the engine ever runs
+
+            Args:
+                fields (list): _valid_fields names to load. Defaults to every field
+                dbh (DatabaseHelper): helper to run the load with. A new one is created if not passed in
+        """
+        dbh = dbh if dbh is not None else DatabaseHelper()
+        fields = fields if fields is not None else _default_fields
+
+        columns = dbh.select(fields).execute(as_="columns", cache=False) # the engine is it's own cache, no point holding a second copy
+        logger.info("Loaded %d rows x %d fields into the filter engine", len(columns), len(fields))
+        return cls(columns)
+
+
+    def screen(self):
+        """ Returns a new, empty Screen over this engine's data """
+        return Screen(self)
+
+
+    def _column(self, name):
+        if name not in self.columns:
+            logger.error(f"Field({name}) isn't loaded in the filter engine. Loaded fields: {self.columns.keys()}")
+            raise ValueError(f"Invalid field: {name}. Expected one of: {self.columns.keys()}")
+        return self.columns[name]
+
+
+    def _not_null(self, names):
+        """ mask of rows where none of the given columns are NULL. sql comparisons against NULL are never true, so neither are ours """
+        mask = None
+        for n in names:
+            nulls = self.columns.mask(n)
+            if nulls is not None:
+                mask = ~nulls if mask is None else mask & ~nulls
+        return mask
+
+
+    def _clause_mask(self, key, compute):
+        """ returns the cached mask for a clause, or computes and caches it """
+        mask = self._mask_cache.get(key)
+        if mask is not None:
+            self._mask_cache.move_to_end(key)
+            return mask
+
+        mask = compute()
+        self._mask_cache[key] = mask
+        if len(self._mask_cache) > MASK_CACHE_SIZE:
+            self._mask_cache.popitem(last=False)
+        return mask
+
+
+
+class Screen:
+    """
+        A set of filters over a FilterEngine. Mirrors DatabaseHelper's where_* functions and arguments so a screen can be moved
+        between the engine and the db without rewriting it. All clauses are AND'ed together, just like in DatabaseHelper
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.clauses = [] # list of (cache key, compute function)
+
+
+    def where_price_diff(self, a, b, amount=None, percent=None, type_a='close', type_b='close'):
+        """ Same as DatabaseHelper.where_price_diff: keeps rows where price a is greater than price b.
+
+            if amount isn't none, do a > (b + amount)
+            if percent isn't none, do a > (b * percent)
+            otherwise just a > b """
+        if a not in _col_names:
+            raise ValueError(f"Invalid arg a: {a}, {type(a)}. Expected one of: 1, 2, 3, 4, 5, 10, 20, 30 (or the negative of any of these values)")
+        if b not in _col_names:
+            raise ValueError(f"Invalid arg b: {b}, {type(b)}. Expected one of: 1, 2, 3, 4, 5, 10, 20, 30 (or the negative of any of these values)")
+
+        col_a = type_a + _col_names[a]
+        col_b = type_b + _col_names[b]
+        engine = self.engine
+
+        def compute():
+            va = engine._column(col_a)
+            vb = engine._column(col_b)
+            if amount is not None:
+                mask = va > vb + amount
+            elif percent is not None:
+                mask = (vb != 0) & (va > vb.astype(np.float64) * percent) # db side uses NULLIF(b, 0), so 0 prices never match
+            else:
+                mask = va > vb
+
+            not_null = engine._not_null([col_a, col_b])
+            return mask if not_null is None else mask & not_null
+
+        self.clauses.append((("price_diff", col_a, col_b, amount, percent), compute))
+        return self
+
+
+    def where_value_is(self, prop, relation, val, offset=None):
+        """ Same as DatabaseHelper.where_value_is: compares a field against a raw value or another field(if val is in _valid_fields) """
+        if prop not in _valid_fields:
+            raise ValueError(f"Invalid arg prop: {prop}. Expected one of: {_valid_fields}")
+        if relation not in _relations:
+            raise ValueError(f"Invalid arg relation: {relation}. Expected one of: {_relations}")
+
+        engine = self.engine
+        is_field = isinstance(val, str) and val in _valid_fields
+
+        def compute():
+            left = engine._column(prop)
+            names = [prop]
+            if is_field:
+                right = engine._column(val)
+                names.append(val)
+            elif np.issubdtype(left.dtype, np.datetime64):
+                right = np.datetime64(val, "D")
+            else:
+                right = val
+
+            if offset:
+                right = right + offset
+
+            mask = _ops[relation](left, right)
+            not_null = engine._not_null(names)
+            return mask if not_null is None else mask & not_null
+
+        self.clauses.append((("value_is", prop, relation, val, is_field, offset), compute))
+        return self
+
+
+    def mask(self):
+        """ Returns the combined boolean mask for every clause in this screen """
+        mask = np.ones(self.engine.size, dtype=bool)
+        for key, compute in self.clauses:
+            mask &= self.engine._clause_mask(key, compute)
+        return mask
+
+
+    def indices(self):
+        """ Returns the indices of every row matching this screen """
+        return np.flatnonzero(self.mask())
+
+
+    def count(self):
+        return int(np.count_nonzero(self.mask()))
+
+
+    def rows(self, fields):
+        """ Returns a dict of field name -> numpy array of values for every matching row
+
+            Args:
+                fields (list): names of loaded fields to return
+        """
+        idx = self.indices()
+        return {f: self.engine._column(f)[idx] for f in fields}
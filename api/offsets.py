@@ -0,0 +1,92 @@
+"""
+    Prices at arbitrary trading day offsets from an earnings report, read from the local bar store (data/src/bar_store.py).
+
+    price_history only has columns for -30..-1 and 1..30 at fixed steps. This fills in any other offset (+7, -15, +45, ...) for a
+    columnar result on the fly from the bars already stored on disk, without touching the db or the price source.
+
+    Usage:
+        cols = dbh.select(["ticker", "report_date", "time_of_report", "close_minus_1"]).execute(as_="columns")
+        cols = offsets.add_offsets(cols, [7, -15])
+        cols["close_plus_7"] / cols["close_minus_1"]
+"""
+
+import sys
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from .columnar import ColumnarResult
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "data" / "src"))
+import bar_store
+import trading_calendar
+
+
+logger = logging.getLogger(__name__)
+
+_price_fields = ("open", "high", "low", "close")
+
+
+def offset_name(field, offset):
+    """ column name for a field at an offset, same naming as price_history. e.g. ('close', 7) -> close_plus_7 """
+    return f"{field}_{'plus' if offset > 0 else 'minus'}_{abs(offset)}"
+
+
+def add_offsets(result, offsets, fields=("close",), store=None):
+    """
+        Adds a column for every field at every offset to a columnar result.
+
+        Args:
+            result (ColumnarResult): needs ticker, report_date and time_of_report columns
+            offsets (list): trading day offsets from the report, e.g. [7, -15]. 0 isn't an offset
+            fields (list): any of open, high, low, close, volume
+            store (BarStore): defaults to the shared store
+
+        Returns:
+            a new ColumnarResult with the extra columns. Prices are in cents like price_history's, as float64 with NaN (and a null mask)
+            where the store has no bar for that day
+    """
+    for name in ("ticker", "report_date", "time_of_report"):
+        if name not in result:
+            raise ValueError(f"add_offsets needs a {name} column in the result")
+    if 0 in offsets:
+        raise ValueError("Invalid offset 0. Offsets start at 1 (the first session after the report) and -1 (the last one before it)")
+    for f in fields:
+        if f not in bar_store.FIELDS:
+            raise ValueError(f"Invalid field: {f}. Expected one of: {bar_store.FIELDS}")
+
+    store = store or bar_store.get_store()
+    calendar = trading_calendar.get_calendar()
+
+    tickers = result["ticker"]
+    report_dates = result["report_date"]
+    before_open = result["time_of_report"] == "Before Open"
+
+    values = {f: np.full((len(result), len(offsets)), np.nan) for f in fields}
+    for ticker in np.unique(tickers):
+        rows = np.nonzero(tickers == ticker)[0]
+        for f in fields:
+            values[f][rows] = store.at_offsets(str(ticker), report_dates[rows], before_open[rows], offsets, f, calendar)
+
+    names = list(result.names)
+    columns = dict(result.columns)
+    nulls = dict(result.nulls)
+    for f in fields:
+        v = np.trunc(np.round(values[f], 2) * 100) if f in _price_fields else values[f] # same rounding as populate_prices
+        for i, o in enumerate(offsets):
+            name = offset_name(f, o)
+            if name not in columns:
+                names.append(name)
+            columns[name] = v[:, i]
+            missing = np.isnan(v[:, i])
+            if missing.any():
+                nulls[name] = missing
+            else:
+                nulls.pop(name, None)
+
+    missing_tickers = [t for t in np.unique(tickers) if store.span(str(t)) is None]
+    if missing_tickers:
+        logger.warning(f"No stored bars for {len(missing_tickers)} tickers, their offset columns are empty: {missing_tickers[:10]}")
+
+    return ColumnarResult(names, columns, nulls)
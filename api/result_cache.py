@@ -0,0 +1,207 @@
+"""
+    Result cache for DatabaseHelper screens.
+
+    Results are keyed on the normalized sql template plus it's bound params (see db_helpers.CompiledQuery), so any two users running the
+    same screen share an entry no matter how they built it. Entries expire after a TTL, the least recently used entries are evicted past
+    MAX_ENTRIES, and entries are invalidated whenever the scrapers write new rows for a ticker.
+
+    The scrapers run in their own processes, so invalidation goes through postgres: populate_prices and insert_eps send a NOTIFY on
+    INVALIDATE_CHANNEL with the ticker they wrote (see data/src/database.py), and the cache picks those up from a LISTEN connection
+    every time it's read. NOTIFYs are only delivered once the writing transaction commits, so we never drop entries for rolled back writes.
+
+    A query that was already running when a write committed can come back with the old data after the invalidation has been processed,
+    so every invalidation bumps a sequence number. Callers read it with sequence() before they run the query and pass it to put(), which
+    refuses to cache the result if anything was invalidated in between.
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+import psycopg2
+
+from . import db_pool
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "earni_invalidate" # must match data/src/database.py
+ALL_TICKERS = "*" # payload that invalidates everything
+
+MAX_ENTRIES = 512
+TTL = 5 * 60 # seconds
+MAX_CACHED_ROWS = 200000 # results bigger than this aren't worth holding onto, they'd push everything else out
+LISTEN_RETRY = 60 # seconds to wait before retrying the LISTEN connection if it fails
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "tickers")
+
+    def __init__(self, value, expires, tickers):
+        self.value = value
+        self.expires = expires
+        self.tickers = tickers # tickers this result depends on, or None if it depends on every ticker
+
+
+class _Listener:
+    """ Dedicated LISTEN connection for invalidation messages. Polling it is non-blocking, so there's no background thread """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.conn = None
+        self.retry_at = 0
+
+    def poll(self):
+        """ Returns the list of tickers that were invalidated since the last poll """
+        if self.conn is None:
+            if time.monotonic() < self.retry_at:
+                return []
+            try:
+                self.conn = psycopg2.connect(db_pool.get_dsn())
+                self.conn.autocommit = True
+                with self.conn.cursor() as curs:
+                    curs.execute(f"LISTEN {self.channel}")
+            except Exception:
+                logger.warning("Unable to LISTEN for cache invalidations, retrying in %ds", LISTEN_RETRY, exc_info=True)
+                self.conn = None
+                self.retry_at = time.monotonic() + LISTEN_RETRY
+                return []
+
+            # anything cached before we were listening could already be stale
+            return [ALL_TICKERS]
+
+        try:
+            self.conn.poll()
+        except Exception:
+            logger.warning("Lost cache invalidation connection, flushing cache", exc_info=True)
+            self.close()
+            return [ALL_TICKERS]
+
+        payloads = [n.payload for n in self.conn.notifies]
+        self.conn.notifies.clear()
+        return payloads
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+class ResultCache:
+    """ Thread-safe LRU + TTL cache of query results, with hit/miss counters """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, listen=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = _Listener(INVALIDATE_CHANNEL) if listen else None
+        self._sequence = 0 # bumped on every invalidation
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+
+    def _poll_invalidations(self):
+        if self._listener is None:
+            return
+        for ticker in self._listener.poll():
+            self._invalidate(ticker)
+
+
+    def get(self, key):
+        """ Returns the cached value for key, or None if it isn't cached or has expired """
+        with self._lock:
+            self._poll_invalidations()
+
+            entry = self._entries.get(key)
+            if entry is None or entry.expires < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+
+    def sequence(self):
+        """ The current invalidation sequence number. Read it right before running a query and pass it to put() """
+        with self._lock:
+            return self._sequence
+
+
+    def put(self, key, value, tickers=None, sequence=None):
+        """ Caches a value
+
+            Args:
+                key: hashable cache key, usually (sql, params, format)
+                value: the result to cache
+                tickers (set): tickers the result depends on. None means it depends on all of them and is dropped on any write
+                sequence (int): sequence() from before the query ran. If there's been an invalidation since, the value could already be
+                    stale and isn't cached. None caches it regardless
+        """
+        with self._lock:
+            self._poll_invalidations() # pick up any write that committed while the query was running
+            if sequence is not None and sequence != self._sequence:
+                self.stale_puts += 1
+                return
+
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, tickers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def _invalidate(self, ticker):
+        self._sequence += 1
+        if ticker == ALL_TICKERS:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            return
+
+        stale = [k for k, e in self._entries.items() if e.tickers is None or ticker in e.tickers]
+        for k in stale:
+            del self._entries[k]
+        self.invalidations += len(stale)
+
+
+    def invalidate(self, ticker=ALL_TICKERS):
+        """ Drops every entry that depends on ticker (or everything if no ticker is given). Only affects this process,
+            use data/src/database.py notify_changed to invalidate every api process """
+        with self._lock:
+            self._invalidate(ticker)
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """ Returns the shared result cache, creating it on first use """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
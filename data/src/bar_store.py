@@ -0,0 +1,253 @@
+"""
+    Local store of daily bars, one file per ticker.
+
+    Each ticker's bars are a flat binary file of fixed size records (BAR_DTYPE), sorted by date, that's read back as a numpy memmap. So
+    reading a ticker is an mmap instead of a download, slicing a date range is a searchsorted, and each column (bars['close'] etc) is
+    a strided view straight onto the file. Next to it is a small json file with the range of days that's already been fetched
+    (coverage), which can be wider than the bars themselves when the source has nothing for part of it.
+
+    Normally files are only appended to: update() fetches the days after the end of the coverage and adds them to the end. Only
+    completed sessions are ever fetched, so a partial bar for a session that's still trading never gets stored.
+
+    Prices are stored as the source gives them (float dollars, split and dividend adjusted as of the fetch). price_history's integer
+    cents are computed from these. A split or dividend re-adjusts every price before it, so once one shows up in newly fetched days the
+    stored bars are on a different basis than the new ones. When that happens the whole covered range is refetched and the file is
+    rewritten instead, so a ticker's bars are always on one basis. The same goes for a request for history from before the start of
+    the coverage.
+
+    Usage:
+        store = bar_store.get_store()
+        store.update("aapl", date(2015, 1, 1), date.today(), price_source.get_history)
+        bars = store.read("aapl", date(2020, 1, 1), date(2021, 1, 1))
+        bars['date'], bars['close']
+
+        store.at_offsets("aapl", report_dates, before_open, [7, -15])   # close 7 trading days after / 15 before each report
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+import trading_calendar
+
+
+BAR_DIR = Path(os.environ.get("EARNI_BAR_DIR", Path.home() / ".cache" / "earni" / "bars"))
+BAR_DTYPE = np.dtype([
+    ("date", "datetime64[D]"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "i8"),
+])
+FIELDS = ("open", "high", "low", "close", "volume")
+ACTIONS = ("Dividends", "Stock Splits") # corporate action columns from price_source.get_history
+
+_empty = np.zeros(0, dtype=BAR_DTYPE)
+
+
+def from_frame(prices):
+    """ Converts an Open/High/Low/Close/Volume DataFrame indexed by 'YYYY-MM-DD' (price_source.get_history) into a bar array """
+    bars = np.zeros(len(prices), dtype=BAR_DTYPE)
+    if len(prices) == 0:
+        return bars
+    bars['date'] = np.array(prices.index, dtype="datetime64[D]")
+    for f in FIELDS:
+        bars[f] = prices[f.capitalize()].to_numpy()
+    bars = bars[~np.isnan(bars['close'])]
+    return bars[np.argsort(bars['date'], kind="stable")]
+
+
+def has_actions(prices):
+    """ True if a fetched DataFrame has a split or dividend in it """
+    return any(c in prices.columns and bool((prices[c].fillna(0) != 0).any()) for c in ACTIONS)
+
+
+def to_frame(bars):
+    """ The other way around, for code that wants the price_source layout back """
+    import pandas as pd
+    return pd.DataFrame({f.capitalize(): bars[f] for f in FIELDS}, index=[str(d) for d in bars['date']])
+
+
+class BarStore:
+    def __init__(self, directory=BAR_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def path(self, ticker):
+        return self.directory / f"{ticker.lower()}.bars"
+
+    def meta_path(self, ticker):
+        return self.directory / f"{ticker.lower()}.json"
+
+    def _lock(self, ticker):
+        with self.locks_lock:
+            return self.locks.setdefault(ticker.lower(), threading.Lock())
+
+
+    def read(self, ticker, start=None, end=None):
+        """
+            Returns the stored bars for a ticker between start and end (inclusive, either can be None), as a read-only structured array
+            backed by the file. Empty if nothing's stored.
+        """
+        path = self.path(ticker)
+        size = path.stat().st_size if path.exists() else 0
+        count = size // BAR_DTYPE.itemsize # a partly written record at the end (crash mid append) is ignored
+        if count == 0:
+            return _empty
+        bars = np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(count,))
+
+        lo = 0 if start is None else np.searchsorted(bars['date'], np.datetime64(start, "D"), side="left")
+        hi = count if end is None else np.searchsorted(bars['date'], np.datetime64(end, "D"), side="right")
+        return bars[lo:hi]
+
+    def span(self, ticker):
+        """ (first, last) stored day as datetime64, or None """
+        bars = self.read(ticker)
+        return (bars['date'][0], bars['date'][-1]) if len(bars) else None
+
+    def coverage(self, ticker):
+        """
+            (from, through) days as datetime64 that have already been fetched from the source, or None. This is wider than span() when
+            the source has nothing for part of the range, e.g. a ticker that only listed after the backfill start, so asking for the same
+            range again doesn't refetch it. Stores written before there was a coverage file fall back to their span.
+        """
+        path = self.meta_path(ticker)
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            return np.datetime64(meta['from'], "D"), np.datetime64(meta['through'], "D")
+        return self.span(ticker)
+
+    def _set_coverage(self, ticker, start, through):
+        path = self.meta_path(ticker)
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump({'from': str(np.datetime64(start, "D")), 'through': str(np.datetime64(through, "D"))}, file)
+        os.replace(tmp, path)
+
+
+    def append(self, ticker, bars):
+        """ Adds bars after the last stored day. Anything on or before it is dropped, so overlapping fetches are harmless.
+            Returns the number of bars written """
+        bars = np.asarray(bars, dtype=BAR_DTYPE)
+        with self._lock(ticker):
+            path = self.path(ticker)
+            size = path.stat().st_size if path.exists() else 0
+            whole = size - size % BAR_DTYPE.itemsize
+            span = self.span(ticker)
+            if span is not None:
+                bars = bars[bars['date'] > span[1]]
+            if len(bars) == 0:
+                return 0
+
+            with open(path, "r+b" if path.exists() else "wb") as file:
+                file.truncate(whole) # drop a torn record from an earlier crash before appending after it
+                file.seek(whole)
+                file.write(bars.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            return len(bars)
+
+    def replace(self, ticker, bars):
+        """ Rewrites a ticker's whole file. Only used when history from before anything we've fetched is needed """
+        bars = np.asarray(bars, dtype=BAR_DTYPE)
+        with self._lock(ticker):
+            path = self.path(ticker)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as file:
+                file.write(bars.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, path)
+
+
+    def update(self, ticker, start, end, fetch, calendar=None):
+        """
+            Makes sure the store has a ticker's bars from start through end, fetching only what's missing.
+
+            Args:
+                start (date): first day needed
+                end (date): last day needed. Clamped to the last completed trading session, so the store never holds a partial bar for a
+                    session that's still trading, and days that haven't happened yet (+30 offsets for a recent report) don't cost a request
+                    on every run
+                fetch (function): fetch(ticker, start, end) -> DataFrame in price_source.get_history's layout
+
+            Returns:
+                number of bars added (or written, when the file had to be rewritten)
+        """
+        calendar = calendar or trading_calendar.get_calendar()
+        last_session = calendar.last_completed()
+        if last_session is None:
+            return 0
+        start = np.datetime64(start, "D")
+        end = min(np.datetime64(end, "D"), np.datetime64(last_session, "D"))
+        if end < start:
+            return 0
+
+        covered = self.coverage(ticker)
+        if covered is None or start < covered[0]:
+            # nothing fetched yet, or we need older history than we've ever asked for. Fetch everything needed in one go and rewrite
+            last = end if covered is None else max(end, covered[1])
+            bars = from_frame(fetch(ticker, start.item(), last.item()))
+            if len(bars) or self.span(ticker) is None:
+                self.replace(ticker, bars)
+                self._set_coverage(ticker, start, last)
+            return len(bars)
+
+        if end <= covered[1]:
+            return 0
+        prices = fetch(ticker, (covered[1] + 1).item(), end.item())
+        if has_actions(prices):
+            # split or dividend since the last fetch, so the stored bars' adjustment is out of date. Refetch everything in one go
+            bars = from_frame(fetch(ticker, covered[0].item(), end.item()))
+            if len(bars):
+                self.replace(ticker, bars)
+                self._set_coverage(ticker, covered[0], end)
+            return len(bars)
+
+        added = self.append(ticker, from_frame(prices))
+        self._set_coverage(ticker, covered[0], end)
+        return added
+
+
+    def at_offsets(self, ticker, dates, before_open=False, offsets=trading_calendar.OFFSETS, field="close", calendar=None):
+        """
+            Looks up a field at any trading day offsets from a set of report dates, e.g. offsets=[7, -15] for values that aren't in
+            price_history's fixed columns. Same offset rules as populate_prices (see trading_calendar).
+
+            Returns:
+                (len(dates), len(offsets)) float64 array, NaN where there's no stored bar for that day
+        """
+        calendar = calendar or trading_calendar.get_calendar()
+        rel = calendar.relative_dates(dates, before_open, offsets)
+
+        bars = self.read(ticker)
+        out = np.full(rel.shape, np.nan)
+        if len(bars) == 0:
+            return out
+
+        pos = np.searchsorted(bars['date'], rel)
+        pos = np.minimum(pos, len(bars) - 1)
+        found = (bars['date'][pos] == rel) & ~np.isnat(rel)
+        out[found] = bars[field][pos[found]]
+        return out
+
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """ Returns the shared BarStore, creating it on first use """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BarStore()
+    return _store
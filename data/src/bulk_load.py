@@ -0,0 +1,87 @@
+"""
+    Bulk upserts through COPY.
+
+    Inserting rows one execute() at a time costs a round trip (and a statement parse/plan) per row, which is what makes a full
+    price_history backfill take hours. This streams a whole batch through COPY FROM STDIN (csv) into a temp staging table, then merges
+    it into the target with a single INSERT ... SELECT ... ON CONFLICT, so a batch is two statements no matter how many rows it has.
+
+    Nothing here commits. The copy and the merge run in the caller's transaction, so callers keep their all-or-nothing guarantees by
+    committing (or rolling back) around the whole batch, together with anything else that belongs in the same transaction
+    (refresh_derived, notify_changed).
+
+    Usage:
+        with conn.cursor() as curs:
+            bulk_load.upsert(curs, "price_history", rows, key=("ticker", "report_date"))   # rows are dicts
+            db.refresh_derived(curs, ticker)
+        conn.commit()
+"""
+
+import io
+import csv
+
+
+NULL = "\\N"
+
+
+def _columns(rows):
+    """ every column used by any row, in first seen order. Rows don't all have to have the same keys """
+    columns = {}
+    for r in rows:
+        for c in r:
+            columns.setdefault(c, None)
+    return list(columns)
+
+
+def _csv(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for n, r in enumerate(rows):
+        writer.writerow([NULL if r.get(c) is None else r[c] for c in columns] + [n])
+    buf.seek(0)
+    return buf
+
+
+def upsert(curs, table, rows, key, columns=None, update=True):
+    """
+        Loads rows into a table, replacing rows that already exist.
+
+        Args:
+            curs: cursor to run on. Not committed
+            table (str): target table
+            rows (list): dicts of column -> value. A column missing from a row is loaded as NULL
+            key (tuple): the columns of the table's primary key/unique index, for ON CONFLICT
+            columns (list): columns to load. Defaults to every key used in rows
+            update (bool): update existing rows with the new values. False leaves existing rows alone (ON CONFLICT DO NOTHING)
+
+        Returns:
+            number of rows inserted or updated
+    """
+    if len(rows) == 0:
+        return 0
+    columns = columns or _columns(rows)
+    missing = [k for k in key if k not in columns]
+    if missing:
+        raise ValueError(f"upsert into {table} is missing key columns: {missing}")
+
+    staging = f"{table}_staging"
+    cols = ", ".join(columns)
+    keys = ", ".join(key)
+
+    # staging gets the target's column types but none of it's constraints or defaults. _n is the row's position in the batch, so if
+    # a key shows up more than once the last row wins (one INSERT can't touch the same row twice)
+    curs.execute(f"DROP TABLE IF EXISTS pg_temp.{staging}")
+    curs.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA")
+    curs.execute(f"ALTER TABLE {staging} ADD COLUMN _n INT")
+    curs.copy_expert(f"COPY {staging} ({cols}, _n) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", _csv(rows, columns))
+
+    updates = [c for c in columns if c not in key]
+    if update and updates:
+        conflict = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+    else:
+        conflict = "DO NOTHING"
+
+    curs.execute(f"""
+        INSERT INTO {table} ({cols})
+        SELECT DISTINCT ON ({keys}) {cols} FROM {staging} ORDER BY {keys}, _n DESC
+        ON CONFLICT ({keys}) {conflict}""")
+    return curs.rowcount
@@ -13,6 +13,21 @@ pwpath = (current_dir / ".."  / ".." / "db" / "dbpassword").resolve()
 
 conn = None
 
+def connect():
+    """
+    Opens a new connection to the database, separate from the shared one. For short reads that can happen at any time (e.g. from a
+    background thread) and so can't touch the shared connection's transaction. Close it when done.
+
+    Returns:
+        psycopg2.connection: A new connection to the database.
+    """
+
+    # grab database password from file
+    with open(pwpath, "r", encoding="utf-8") as file:
+        dbpassword = file.readline().strip()
+
+    return psycopg2.connect(f"dbname='earni' user='earni' host='localhost' password='{dbpassword}'")
+
 def get_conn():
     """
     This method creates a connection to the database, or returns one if it already exists.
@@ -24,14 +39,10 @@ def get_conn():
     global conn
     if conn is not None:
         return conn
-    
-    # grab database password from file
-    with open(pwpath, "r", encoding="utf-8") as file:
-        dbpassword = file.readline().strip()
 
     # create database connection
     try:
-        conn = psycopg2.connect(f"dbname='earni' user='earni' host='localhost' password='{dbpassword}'")
+        conn = connect()
         print("Connected to earni database", True)
     except Exception as e:
         print("Failed to connect to database", traceback.format_exc())
@@ -48,4 +59,37 @@ def close_conn():
     if conn is not None:
         conn.commit()
         conn.close()
-        conn = None
\ No newline at end of file
+        conn = None
+
+
+def reset_conn():
+    """
+    Throws away the shared connection without committing, e.g. after it's been dropped. The next get_conn() opens a new one.
+    """
+
+    global conn
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        conn = None
+
+
+# channel the api's result cache listens on (api/result_cache.py). Payload is the ticker whose data changed
+INVALIDATE_CHANNEL = "earni_invalidate"
+
+def notify_changed(curs, ticker):
+    """
+    Tells any running api processes that data for a ticker changed, so they drop cached results for it.
+    Call it with the same cursor/transaction that wrote the rows: postgres only delivers the NOTIFY if that transaction commits.
+    """
+    curs.execute("SELECT pg_notify(%s, %s)", (INVALIDATE_CHANNEL, ticker))
+
+
+def refresh_derived(curs, ticker):
+    """
+    Recomputes the precomputed returns in price_returns (db/migrations/002_price_returns.sql) for a ticker.
+    Call it in the same transaction as the inserts, so the derived rows commit or roll back together with them.
+    """
+    curs.execute("SELECT refresh_price_returns(%s)", (ticker,))
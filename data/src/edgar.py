@@ -2,33 +2,19 @@
     This module is used to retrieve data from the SEC EDGAR database.
 """
 import psycopg2
+import symbols
 
 
 def get_cik(ticker):
     """
         This method retrieves the CIK number for a given ticker. CIK numbers are used to identify stocks in requests to the EDGAR database.
 
-        (NOTE: For now, the Ticker to CIK data is currently stored in a text file provided by the SEC. Eventually I'll probably migrate it to 
-        a database for slighty faster access, and this function will need to be updated)
+        Lookups go through the shared symbol master (symbols.py), which loads the ticker/CIK map once and uses the companies table when it's available
 
         Args: 
             ticker (str): The ticker symbol of the company.
 
         Returns:
-            int: the CIK number of the company.
+            int: the CIK number of the company, or None if it's unknown.
     """
-    with open('./symbols.txt', 'r', encoding='utf-8') as file:
-        cik = None
-        for line in file:
-            t, c = line.split('\t')
-
-            print(f"Reading line: {t} - {c}")
-            if t.strip() == ticker:
-                cik = c
-                print(f"FOUND TICKER: {t} - {c}")
-                break
-
-        print(f"Returning CIK: {cik}")
-        return cik
-
-            
\ No newline at end of file
+    return symbols.get_cik(ticker)
@@ -0,0 +1,246 @@
+"""
+    Bulk ingest from the SEC's nightly archives, instead of crawling filings one at a time.
+
+    The SEC publishes everything in two zips (https://www.sec.gov/edgar/sec-api-documentation):
+        companyfacts.zip  - one CIK##########.json per company with every xbrl fact they've ever filed
+        submissions.zip   - one CIK##########.json per company with their filing history (plus CIK##########-submissions-NNN.json
+                            overflow files for companies with long histories)
+
+    Reading a local copy of those replaces hundreds of thousands of request_archive/find_doc_url/request_doc calls with one file read.
+    Members are streamed straight out of the zip one at a time, and members for companies we don't track (anything not in the symbol master)
+    are skipped without even being decompressed.
+
+    Usage:
+        python bulk_ingest.py companyfacts path/to/companyfacts.zip   # quarterly EPS/revenue -> sec_quarterly
+        python bulk_ingest.py submissions path/to/submissions.zip     # 10-Q/10-K filing index -> sec_filings
+        python bulk_ingest.py sample path/to/companyfacts.zip sample.zip aapl msft
+            # writes a trimmed copy with just those companies (and just the concepts we load), small enough to keep around for offline runs
+
+    Tables are created by db/migrations/003_sec_bulk.sql.
+"""
+
+import re
+import sys
+import json
+import zipfile
+import logging
+from datetime import date
+from pathlib import Path
+
+import psycopg2.extras
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import database as db
+import symbols
+
+
+logger = logging.getLogger('EDGAR')
+
+# us-gaap concepts we load. Companies don't agree on which revenue concept to use, so we take all the common ones
+EPS_CONCEPTS = ["EarningsPerShareDiluted", "EarningsPerShareBasic"]
+REVENUE_CONCEPTS = [
+    "Revenues",
+    "RevenueFromContractWithCustomerExcludingAssessedTax",
+    "RevenueFromContractWithCustomerIncludingAssessedTax",
+    "SalesRevenueNet",
+]
+QUARTERLY_CONCEPTS = EPS_CONCEPTS + REVENUE_CONCEPTS
+
+FORMS = {"10-Q", "10-K", "10-Q/A", "10-K/A"}
+QUARTER_DAYS = (75, 105) # same window populate_reports uses to decide a context is quarterly
+BATCH_CIKS = 200 # companies per insert/commit
+
+_member_cik = re.compile(r"^CIK(\d{10})(?:-submissions-\d+)?\.json$")
+
+
+def load_cikmap():
+    """ Returns {cik: ticker} for every company in the symbol master. If a cik has more than one ticker (share classes) the primary one wins """
+    master = symbols.get_master()
+    return {cik: tickers[0] for cik, tickers in master.by_cik.items()}
+
+
+def iter_members(zip_path, ciks=None):
+    """
+        Streams the json members of a bulk archive one at a time.
+
+        Args:
+            zip_path (str): path to companyfacts.zip or submissions.zip
+            ciks (set): only yield members for these ciks. Other members are skipped without decompressing them
+
+        Yields:
+            (cik, member name, parsed json)
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            match = _member_cik.match(info.filename)
+            if match is None:
+                continue
+            cik = int(match.group(1))
+            if ciks is not None and cik not in ciks:
+                continue
+
+            with zf.open(info) as member:
+                try:
+                    data = json.load(member)
+                except ValueError:
+                    logger.error(f"Skipping unreadable member {info.filename} in {zip_path}")
+                    continue
+            yield cik, info.filename, data
+
+
+def quarterly_facts(cik, companyfacts, concepts=QUARTERLY_CONCEPTS):
+    """
+        Pulls the quarterly values for 'concepts' out of one company's companyfacts json.
+
+        The same quarter usually shows up several times (the 10-Q it was reported in, then again as the prior year column a year later,
+        maybe a restatement), so only the most recently filed value is kept for each concept/unit/period end.
+
+        Returns:
+            list of (cik, concept, unit, period_start, period_end, value, accession, form, filed, fiscal_year, fiscal_period)
+    """
+    gaap = companyfacts.get("facts", {}).get("us-gaap", {})
+    latest = {}
+    for concept in concepts:
+        if concept not in gaap:
+            continue
+        for unit, values in gaap[concept]["units"].items():
+            for v in values:
+                if "start" not in v: # instant facts can't be quarterly
+                    continue
+                start = date.fromisoformat(v["start"])
+                end = date.fromisoformat(v["end"])
+                if not QUARTER_DAYS[0] <= (end - start).days <= QUARTER_DAYS[1]:
+                    continue
+
+                key = (concept, unit, end)
+                if key in latest and latest[key][8] >= v["filed"]:
+                    continue
+                latest[key] = (cik, concept, unit, start, end, v["val"], v["accn"].replace("-", ""), v.get("form"),
+                               v["filed"], v.get("fy"), v.get("fp"))
+
+    return list(latest.values())
+
+
+def filing_rows(cik, submissions, forms=FORMS):
+    """ Returns (cik, accession, form, filing_date, report_date) for every filing of 'forms' in a submissions member. Handles both the
+        main CIK##########.json (filings under filings.recent) and the -submissions-NNN.json overflow files (filings at the top level) """
+    recent = submissions["filings"]["recent"] if "filings" in submissions else submissions
+    rows = []
+    for i, form in enumerate(recent.get("form", [])):
+        if form not in forms:
+            continue
+        rows.append((
+            cik,
+            recent["accessionNumber"][i].replace("-", ""),
+            form,
+            recent["filingDate"][i],
+            recent["reportDate"][i] or None,
+        ))
+    return rows
+
+
+_insert_quarterly = """
+    INSERT INTO sec_quarterly (cik, ticker, concept, unit, period_start, period_end, value, accession, form, filed, fiscal_year, fiscal_period)
+    VALUES %s
+    ON CONFLICT (cik, concept, unit, period_end) DO UPDATE SET
+        ticker = EXCLUDED.ticker, period_start = EXCLUDED.period_start, value = EXCLUDED.value, accession = EXCLUDED.accession,
+        form = EXCLUDED.form, filed = EXCLUDED.filed, fiscal_year = EXCLUDED.fiscal_year, fiscal_period = EXCLUDED.fiscal_period
+    WHERE EXCLUDED.filed >= sec_quarterly.filed
+"""
+
+_insert_filings = """
+    INSERT INTO sec_filings (cik, accession, form, filing_date, report_date)
+    VALUES %s
+    ON CONFLICT (cik, accession) DO NOTHING
+"""
+
+
+def _flush(conn, sql, rows):
+    if len(rows) == 0:
+        return
+    with conn.cursor() as curs:
+        psycopg2.extras.execute_values(curs, sql, rows, page_size=5000)
+    conn.commit()
+
+
+def ingest_companyfacts(zip_path, conn=None, cikmap=None):
+    """ Loads quarterly EPS/revenue for every company in the symbol master from a companyfacts.zip. Safe to re-run, newer filings win """
+    conn = conn or db.get_conn()
+    cikmap = cikmap if cikmap is not None else load_cikmap()
+
+    rows = []
+    companies = 0
+    total = 0
+    for cik, name, data in iter_members(zip_path, set(cikmap)):
+        ticker = cikmap[cik]
+        rows.extend((r[0], ticker) + r[1:] for r in quarterly_facts(cik, data))
+        companies += 1
+        if companies % BATCH_CIKS == 0:
+            _flush(conn, _insert_quarterly, rows)
+            total += len(rows)
+            rows = []
+            logger.info(f"companyfacts: {companies} companies, {total} quarterly facts loaded")
+
+    _flush(conn, _insert_quarterly, rows)
+    total += len(rows)
+    logger.info(f"companyfacts: done. {companies} of {len(cikmap)} companies found, {total} quarterly facts loaded")
+    return total
+
+
+def ingest_submissions(zip_path, conn=None, cikmap=None):
+    """ Loads the 10-Q/10-K filing index for every company in the symbol master from a submissions.zip """
+    conn = conn or db.get_conn()
+    cikmap = cikmap if cikmap is not None else load_cikmap()
+
+    rows = []
+    members = 0
+    total = 0
+    for cik, name, data in iter_members(zip_path, set(cikmap)):
+        rows.extend(filing_rows(cik, data))
+        members += 1
+        if members % BATCH_CIKS == 0:
+            _flush(conn, _insert_filings, rows)
+            total += len(rows)
+            rows = []
+
+    _flush(conn, _insert_filings, rows)
+    total += len(rows)
+    logger.info(f"submissions: done. {members} members read, {total} filings loaded")
+    return total
+
+
+def make_sample(zip_path, out_path, ciks, concepts=QUARTERLY_CONCEPTS):
+    """ Writes a trimmed copy of a bulk archive with only the given ciks. companyfacts members are also cut down to just 'concepts',
+        which takes a company from several MB to a few KB """
+    written = 0
+    with zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_DEFLATED) as out:
+        for cik, name, data in iter_members(zip_path, set(ciks)):
+            if "facts" in data:
+                gaap = data["facts"].get("us-gaap", {})
+                data["facts"] = {"us-gaap": {c: gaap[c] for c in concepts if c in gaap}}
+            out.writestr(name, json.dumps(data))
+            written += 1
+
+    logger.info(f"Wrote {written} members to {out_path}")
+    return written
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(name)s :: %(levelname)s] %(message)s')
+
+    commands = {"companyfacts": ingest_companyfacts, "submissions": ingest_submissions}
+    if len(sys.argv) >= 4 and sys.argv[1] == "sample":
+        cikmap = load_cikmap()
+        wanted = {t.lower() for t in sys.argv[4:]}
+        ciks = [cik for cik, ticker in cikmap.items() if ticker in wanted] if wanted else list(cikmap)
+        make_sample(sys.argv[2], sys.argv[3], ciks)
+    elif len(sys.argv) == 3 and sys.argv[1] in commands:
+        try:
+            commands[sys.argv[1]](sys.argv[2])
+        finally:
+            db.close_conn()
+    else:
+        print("Usage: python bulk_ingest.py [companyfacts|submissions] <zip>\n"
+              "       python bulk_ingest.py sample <zip> <out zip> [ticker ...]")
+        sys.exit(2)
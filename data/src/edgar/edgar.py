@@ -9,11 +9,16 @@
 """
 
 
-import requests
 import logging
 from bs4 import BeautifulSoup
 import traceback
 import re
+import sys
+from pathlib import Path
+import sec_http
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import symbols
 
 # create logger that logs to console, as well as .log and .err files. 
 logger = logging.getLogger('EDGAR')
@@ -35,37 +40,34 @@ error_handler.setLevel(logging.ERROR)
 error_handler.setFormatter(log_format)
 logger.addHandler(error_handler)
 
-# necessary headers for EDGAR requests used in multiple functions
-headers = {
-    'User-Agent': 'Your Name (your.email@example.com)'
-}
+# necessary headers for EDGAR requests. sec_http sends them on every request now, kept here for anything still importing them
+headers = sec_http.headers
 
 def get_ciks():
-    with open("./cikmap.txt", "r") as file:
-        ciks = file.readlines()
-        ciks = [line.strip("\n") for line in ciks]
-
-    return ciks
+    """ Returns every 'ticker cik' line from the symbol master """
+    return [f"{ticker} {cik}" for ticker, cik in symbols.get_master().items()]
 
 
 def write_ciks(ciks):
-    with open("./cikmap.txt", "w") as file:
+    master = symbols.get_master()
+    with open(master.path, "w") as file:
         for c in ciks:
             file.write(c + "\n")
+    master.reload()
 
 
 def get_url(cik, num):
-    return f"https://www.sec.gov/Archives/edgar/data/{cik}/{num}"
+    return sec_http.archive_url(cik, num)
 
 
 def request_filings(cik):
     # add leading 0's to CIK to make it 10 digits long because the url requires that
     cik = (10 - len(cik)) * "0" + cik
-    url = f"https://data.sec.gov/submissions/CIK{cik}.json"
+    url = sec_http.submissions_url(f"CIK{cik}.json")
 
     logger.info("\nGetting filings from URL: " + url)
 
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url) # changes whenever they file something, so this gets revalidated with a conditional request
     return resp.json()['filings']
 
 
@@ -95,10 +97,10 @@ def get_access_numbers(filing, type):
 
 def request_archive(cik, access_num):
     """ This function requests the index page for a given accessionNumber for a given company(cik). It is usually an HTML page that needs to be parsed to find the relevant xml docs """
-    url = f"https://www.sec.gov/Archives/edgar/data/{cik}/{access_num}"
+    url = sec_http.archive_url(cik, access_num)
     logger.debug(f"Requesting forms from: {url}")
 
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url, immutable=True) # archives never change once filed
     return resp.text
 
 
@@ -116,17 +118,12 @@ def find_doc_url(page):
     # if len(xml) == 0:
     #     logger.error("Unable to find xml file with XBRL data for page!")
     
-    url = xml[0]
-    if "http://" not in url:
-        url = "https://www.sec.gov" + url
-        
-
-    return url
+    return sec_http.absolute_url(xml[0])
 
 
 def request_doc(url):
     """ This function is used to request xblrp docs from the sec archives. Technically it could be used to request any url though... """
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url, immutable=True)
     return resp
 
 def request_doc_soup(url):
@@ -175,13 +172,9 @@ def get_recent_filings(cik, type):
         return data
 
 
-    datas = []
-    for anum in anums:
-        data = extract_data(anum)
-        if data is not None:
-            datas.append(data)
-
-    return datas
+    # extract_data already logs and returns None on failure. sec_http's rate limiter keeps the threads under the SEC's 10 req/s
+    datas = sec_http.fetch_all(anums, extract_data)
+    return [data for data in datas if data is not None]
 
 
 
@@ -1,13 +1,20 @@
 from datetime import datetime
-import requests
 import logging
 from bs4 import BeautifulSoup
 import traceback
 import re
+import sys
+from pathlib import Path
+import sec_http
+import fact_index
+import xbrl_stream
+import pipeline
+import fact_store
+from fact_store import Filing
 
-headers = {
-    'User-Agent': 'Your Name (your.email@example.com)'
-}
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import symbols
+import database as db
 
 
 # create logger that logs to console, as well as .log and .err files. 
@@ -62,48 +69,50 @@ class EdgarInstance:
         self.filing_list = request_all_filings(self.cik, start_date)
         self.filings = get_filing_info(self.filing_list, "10-Q")
 
-        self.archive_pages = []
-        self.xdocs = []
+        # download every filing concurrently (sec_http's global rate limiter keeps us under the SEC's 10 req/s no matter how many threads
+        # run) and parse them on a process pool
+        results = fetch_filings(self.cik, self.filings)
+        failed = [f for f, r in zip(self.filings, results) if isinstance(r, Exception)]
+        for f in failed:
+            logger.error(f"{ticker}-{self.cik} Unable to download filing {f.access_num}, skipping it")
+        self.filings = [f for f, r in zip(self.filings, results) if not isinstance(r, Exception)]
 
-        for f_info in self.filings:
-            f_info['archive_page'] = request_archive(self.cik, f_info['access_num'])
-            doc_url = find_doc_url(f_info['archive_page'])
-            f_info['xdoc_url'] = doc_url,
-            f_info['xdoc'] = request_doc(doc_url).text
-            f_info['soup'] = BeautifulSoup(f_info['xdoc'], features="xml")
+
+    def store_facts(self, conn=None):
+        """ Writes the numeric facts from every filing into the compact fact store (xbrl_facts). Returns the number of facts written """
+        conn = conn or db.get_conn()
+        with conn.cursor() as curs:
+            count = fact_store.copy_facts(curs, int(self.cik), self.filings)
+        conn.commit()
+        return count
 
 
     # NOTE: report_dates needs to be in format 09/2024 - months less than 10 need the '0' appended in front!!!!
     # TODO :: Can I break this function down? It's too deeply nested and complicated, doing too many things
     def populate_reports(self, report_dates):
+        """ Finds the quarterly contexts and facts in every filing for each of report_dates. Each filing has a FactIndex, so this is a
+            dict probe per report date per filing instead of a scan over every context
+
+            Returns:
+                dict of report_date -> {'context': [contexts], 'facts': [facts]}. Report dates with no matching filing get an empty dict
+        """
         reports = {}
         for d in report_dates:
             reports[d] = {}
-            
+        months = {d: (int(d[3:]), int(d[:2])) for d in report_dates} # parse 'MM/YYYY' once, not once per context
+
         for f in self.filings: # for each filing/xdoc we've pulled down
-            contexts = f['soup'].find_all('context') # grab all the contexts from it's soup
-            
-            for c in contexts: # and for each of those contexts
-                ed = c.find(re.compile(r'enddate', re.IGNORECASE)) # find it's enddate tag if it has one
-                sd = c.find(re.compile(r'startdate', re.IGNORECASE)) # find it's enddate tag if it has one
-                if ed is None or sd is None: 
-                    print(f"enddate-{ed} or startdate-{sd} is None! Exiting")
-                    continue # if it doesn't have an enddate or startdate tag, continue to the next report
-                
-                ed = datetime.strptime(ed.text, "%Y-%m-%d").date()
-                sd = datetime.strptime(sd.text, "%Y-%m-%d").date()
-                days = (ed - sd).days # find out how many days this context is covering to determine if it's actually quarterly data
-
-                if days > 105 or days < 75: 
-                    print(f"days({days}) out of range! exiting.  sd={sd} | ed={ed}")
-                    continue # if the date range is ~90 days then move on to the next context, this one isn't quarterly
-                ed = ed.strftime("%m/%Y") # put the endDate into the correct format so we can compare it against the report_dates passed in
-
-                if ed in reports: # and if that enddate is a key in 'reports'
-                    print(f"Matched a report for endDate {ed}!")
-                    if 'context' not in reports[ed]: # if report for this enddate doesn't exist yet, intialize it as a list
-                        reports[ed]['context'] = []
-                    reports[ed]['context'].append(c) # then append the context to the reports dict for the given enddate
+            for ed, (year, month) in months.items():
+                contexts, facts = f.index.quarter(year, month) # quarterly (~90 day) periods ending in that month
+                if len(contexts) == 0:
+                    continue
+
+                print(f"Matched a report for endDate {ed}!")
+                if 'context' not in reports[ed]: # if report for this enddate doesn't exist yet, intialize it
+                    reports[ed]['context'] = []
+                    reports[ed]['facts'] = []
+                reports[ed]['context'].extend(contexts)
+                reports[ed]['facts'].extend(facts)
 
         return reports
                
@@ -113,38 +122,92 @@ class EdgarInstance:
 
 ######################################################################
 
-def get_cik(ticker):
-    with open("./cikmap.txt", "r") as file:
-        cikmap = file.readlines()
-        cikmap = [line.strip("\n") for line in cikmap]
+def load_index(cik, filing):
+    """ Loads a filing's saved FactIndex into filing.index. Returns False if there isn't one (or it's unreadable) """
+    path = fact_index.index_path(cik, filing.access_num)
+    if not path.exists():
+        return False
+    try:
+        filing.index = fact_index.FactIndex.load(path)
+        filing.xdoc_url = filing.index.xdoc_url
+        return True
+    except (OSError, ValueError, KeyError):
+        logger.warning(f"Fact index for {cik}-{filing.access_num} is unreadable, rebuilding it")
+        return False
+
+
+def download_filing(cik, filing):
+    """ Downloads the raw xbrl doc for a filing. Returns the doc as bytes """
+    archive_page = request_archive(cik, filing.access_num)
+    filing.xdoc_url = find_doc_url(archive_page)
+    return request_doc(filing.xdoc_url).content
+
+
+def store_index(cik, filing, records):
+    """ Builds a filing's FactIndex from parsed records (xbrl_stream.extract_records) and saves it for later runs """
+    filing.index = fact_index.FactIndex.from_records(records, filing.xdoc_url)
+    filing.index.save(fact_index.index_path(cik, filing.access_num), records)
+    return filing
+
+
+def fetch_filing(cik, filing):
+    """ Gets the FactIndex for a single filing, filling in filing.index in place. Safe to run from multiple threads.
+        Indexes are saved to disk once built, so a filing we've seen before costs no requests and no xbrl parsing at all.
+        This parses on the calling thread, use fetch_filings for more than a handful of filings """
+    if load_index(cik, filing):
+        return filing
+    xdoc = download_filing(cik, filing)
+    return store_index(cik, filing, xbrl_stream.extract_records(xdoc)) # streamed, the doc itself isn't kept
+
+
+def fetch_filings(cik, filings, parsers=None):
+    """ fetch_filing for a whole list of filings. Filings with a saved index are loaded straight from disk, the rest go through the
+        download -> parse pipeline so parsing is spread across every core (on 'parsers', a shared pipeline.ParserPool, if given).
+        Returns the filings / exceptions in the same order """
+    results = list(filings)
+    todo = [i for i, f in enumerate(filings) if not load_index(cik, f)]
+
+    parsed = pipeline.run([filings[i] for i in todo], lambda f: download_filing(cik, f), xbrl_stream.extract_records, parsers=parsers)
+    for i, records in zip(todo, parsed):
+        if isinstance(records, Exception):
+            results[i] = records
+        else:
+            results[i] = store_index(cik, filings[i], records)
+    return results
 
-    for line in cikmap:
-        if line.split(" ")[0] == ticker:
-            return line.split(" ")[1]
 
-    return None
+def get_cik(ticker):
+    """ Returns the cik for a ticker as a string (the request functions pad it out to 10 digits), or None if we don't have it """
+    cik = symbols.get_cik(ticker)
+    return str(cik) if cik is not None else None
 
 
-def request_filings(cik):
+def request_filings(cik, max_age=sec_http.http_cache.MUTABLE_MAX_AGE):
+    """ Returns the 'filings' block of a company's submissions json. max_age is how old a cached copy can be before it's revalidated,
+        pass 0 to always check with the SEC (a 304 if nothing changed, so it's still cheap) """
     # add leading 0's to CIK to make it 10 digits long because the url requires that
     cik = (10 - len(cik)) * "0" + cik
-    url = f"https://data.sec.gov/submissions/CIK{cik}.json"
+    url = sec_http.submissions_url(f"CIK{cik}.json")
 
     logger.info("\nGetting filings from URL: " + url)
 
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url, max_age=max_age) # changes whenever they file something, so this gets revalidated with a conditional request
     return resp.json()['filings']
 
 
 def request_filing(filename):
-    url = "https://data.sec.gov/submissions/" + filename
+    url = sec_http.submissions_url(filename)
     print("Requesting Filing: ", url)
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url)
     return resp.json()
 
 def request_all_filings(cik, start_date="1900-01-01"):
     filings = request_filings(cik)
-    files = [request_filing(f['name']) for f in filings['files'] if f['filingTo'] > start_date] # gets info from the 'files' section of each filing(as opposed to 'recent' section)
+    names = [f['name'] for f in filings['files'] if f['filingTo'] > start_date]
+    files = sec_http.fetch_all(names, request_filing) # gets info from the 'files' section of each filing(as opposed to 'recent' section)
+    for name, f in zip(names, files):
+        if isinstance(f, Exception):
+            raise f # missing part of the filing history would silently drop reports, better to fail the whole cik
     files.append(filings['recent']) # append the 'recent' files - now we have all the filing info for the given cik
 
     return files
@@ -157,7 +220,7 @@ def get_filing_info(filings, filing_type):
             filing_type (str): filing_type of docs we are scanning for. e.g. 10-Q for quarterlies, 10-K for yearly reports 
 
         Returns:
-            a list of accession number strings, dashes removed
+            a list of Filing records
     """
     if type(filings) != list:
         filings = [filings]
@@ -174,22 +237,22 @@ def get_filing_info(filings, filing_type):
             
         for i in indexes:
             print(f"Index {i} is {filing_type}. accessionNumber {i} is {filing['accessionNumber'][i]}")
-            info = {
-                'access_num': filing['accessionNumber'][i].replace("-", ""),
-                'filing_date': filing['filingDate'][i],
-                'filing_type': filing['primaryDocDescription'][i],
-                'report_date': filing['reportDate'][i]
-            }
+            info = Filing(
+                access_num=filing['accessionNumber'][i].replace("-", ""),
+                filing_date=filing['filingDate'][i],
+                filing_type=filing['primaryDocDescription'][i],
+                report_date=filing['reportDate'][i]
+            )
             infos.append(info)
             
     return infos
 
 def request_archive(cik, access_num):
     """ This function requests the index page for a given accessionNumber for a given company(cik). It is usually an HTML page that needs to be parsed to find the relevant xml docs """
-    url = f"https://www.sec.gov/Archives/edgar/data/{cik}/{access_num}"
+    url = sec_http.archive_url(cik, access_num)
     logger.debug(f"Requesting forms from: {url}")
 
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url, immutable=True) # archives never change once filed
     return resp.text
 
 
@@ -208,15 +271,10 @@ def find_doc_url(page):
     # if len(xml) == 0:
     #     logger.error("Unable to find xml file with XBRL data for page!")
     
-    url = xml[0]
-    if "http://" not in url:
-        url = "https://www.sec.gov" + url
-        
-
-    return url
+    return sec_http.absolute_url(xml[0])
 
 
 def request_doc(url):
     """ This function is used to request xblrp docs from the sec archives. Technically it could be used to request any url though... """
-    resp = requests.get(url, headers=headers)
+    resp = sec_http.get_cached(url, immutable=True)
     return resp
\ No newline at end of file
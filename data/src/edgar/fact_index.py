@@ -0,0 +1,164 @@
+"""
+    Per-filing index over the contexts and us-gaap facts that xbrl_stream pulls out of an xbrl doc.
+
+    Built once per filing, keyed by (period end, duration bucket, concept), so finding e.g. the quarterly EPS for a given report date is a
+    dict probe instead of a rescan of every context in every filing. Periods are also indexed by (year, month, bucket), since
+    report_dates only give a month and a lot of companies end their quarters on the last saturday of the month instead of the last day.
+
+    Indexes can be saved to disk (gzipped json, one file per accession number) and loaded back on later runs, which skips downloading and
+    parsing the xbrl doc entirely.
+
+    Usage:
+        index = FactIndex.from_doc(xdoc_bytes)
+        index.get(date(2024, 9, 30), "Q", "EarningsPerShareDiluted")
+        index.quarter(2024, 9)   # every quarterly context/fact for a quarter ending in sep 2024
+"""
+
+import os
+import gzip
+import json
+from datetime import date
+from pathlib import Path
+
+import xbrl_stream
+
+
+INDEX_DIR = Path(os.environ.get("EARNI_FACT_INDEX_DIR", Path.home() / ".cache" / "earni" / "facts"))
+
+# duration buckets, by number of days the context covers. Anything that doesn't land in one of these is 'other'
+INSTANT = "I"
+_buckets = [
+    ("Q", 75, 105),    # quarter
+    ("H", 165, 195),   # half year
+    ("9M", 255, 285),  # nine months, 10-Qs for Q3 usually have year-to-date numbers too
+    ("FY", 350, 380),  # full year
+]
+
+
+def duration_bucket(context):
+    if context['instant'] is not None:
+        return INSTANT
+    days = context['days']
+    for name, low, high in _buckets:
+        if low <= days <= high:
+            return name
+    return "other"
+
+
+class FactIndex:
+    def __init__(self, contexts, facts, xdoc_url=None):
+        """
+            Args:
+                contexts (dict): context id -> context dict, as returned by xbrl_stream.extract
+                facts (list): fact dicts, as returned by xbrl_stream.extract
+                xdoc_url (str): url the doc came from, kept so a loaded index still knows where it's data came from
+        """
+        self.contexts = contexts
+        self.facts = facts
+        self.xdoc_url = xdoc_url
+
+        self.by_key = {}    # (end, bucket, concept) -> [facts]
+        self.periods = {}   # (end.year, end.month, bucket) -> [contexts]
+        self.by_context = {} # context id -> [facts]
+
+        buckets = {}
+        for c in contexts.values():
+            if c['end'] is None:
+                continue
+            buckets[c['id']] = bucket = duration_bucket(c)
+            self.periods.setdefault((c['end'].year, c['end'].month, bucket), []).append(c)
+
+        for f in facts:
+            bucket = buckets.get(f['context'])
+            if bucket is None:
+                continue
+            self.by_key.setdefault((f['end'], bucket, f['concept']), []).append(f)
+            self.by_context.setdefault(f['context'], []).append(f)
+
+
+    @classmethod
+    def from_doc(cls, xdoc, xdoc_url=None):
+        contexts, facts = xbrl_stream.extract(xdoc)
+        return cls(contexts, facts, xdoc_url)
+
+
+    def get(self, end, bucket, concept, dims=False):
+        """ Returns the facts for concept over the period ending on 'end'. By default only facts without dimensions (segment breakdowns
+            like per-product revenue) are returned, since those are the company-wide totals we actually want. dims=True returns them all """
+        found = self.by_key.get((end, bucket, concept), [])
+        if dims:
+            return found
+        return [f for f in found if not f['dims']]
+
+
+    def quarter(self, year, month, bucket="Q"):
+        """ Returns (contexts, facts) for every period of 'bucket' length ending in the given month """
+        contexts = self.periods.get((year, month, bucket), [])
+        facts = [f for c in contexts for f in self.by_context.get(c['id'], [])]
+        return contexts, facts
+
+
+    def records(self):
+        """ the index's contexts/facts as compact records, same format as xbrl_stream.extract_records """
+        return {
+            'contexts': {cid: [_iso(c['start']), _iso(c['end']), _iso(c['instant']), c['dims']] for cid, c in self.contexts.items()},
+            'facts': [[f['concept'], f['value'], f['unit'], f['decimals'], f['context']] for f in self.facts],
+        }
+
+
+    @classmethod
+    def from_records(cls, records, xdoc_url=None):
+        """ rebuilds an index from compact records (xbrl_stream.extract_records, or a saved index) without touching any xbrl """
+        contexts = {}
+        for cid, (start, end, instant, dims) in records['contexts'].items():
+            start, end, instant = _date(start), _date(end), _date(instant)
+            contexts[cid] = {
+                'id': cid,
+                'start': start,
+                'end': end,
+                'instant': instant,
+                'days': (end - start).days if start is not None and end is not None else 0,
+                'dims': dims,
+            }
+
+        facts = []
+        for concept, value, unit, decimals, cid in records['facts']:
+            fact = {'concept': concept, 'value': value, 'unit': unit, 'decimals': decimals, 'context': cid}
+            if cid in contexts:
+                xbrl_stream.join_context(fact, contexts[cid])
+                facts.append(fact)
+
+        return cls(contexts, facts, xdoc_url)
+
+
+    def save(self, path, records=None):
+        """ writes the index to 'path' as gzipped json. Only the parsed contexts/facts are saved, the lookup dicts are rebuilt on load.
+            Pass 'records' if you already have them (from a parse worker) to skip converting the index back """
+        data = dict(records if records is not None else self.records())
+        data['xdoc_url'] = self.xdoc_url
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp, path)
+
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls.from_records(data, data['xdoc_url'])
+
+
+def _iso(d):
+    return d.isoformat() if d is not None else None
+
+
+def _date(s):
+    return date.fromisoformat(s) if s is not None else None
+
+
+def index_path(cik, access_num):
+    return INDEX_DIR / str(cik) / f"{access_num}.json.gz"
@@ -0,0 +1,156 @@
+"""
+    Compact storage for xbrl facts (tables in db/migrations/005_fact_store.sql, 007 and 008), plus the Filing record used everywhere a filing is
+    passed around in the edgar code.
+
+    Facts are written with COPY into a temp table and merged from there, so loading a filing is one round trip for the data no matter
+    how many facts it has. Concept and unit names are turned into the integer ids the facts table stores as part of that merge.
+
+    Usage:
+        with conn.cursor() as curs:
+            fact_store.copy_facts(curs, cik, filings)   # filings that have a FactIndex (edgar_api.fetch_filing / fetch_filings)
+        conn.commit()
+
+        fact_store.get_facts(conn, cik, ["EarningsPerShareDiluted"], days=(75, 105))   # quarterly EPS history
+"""
+
+import io
+import logging
+
+
+logger = logging.getLogger('EDGAR')
+
+NULL = "\\N" # COPY's text format null
+
+
+class Filing:
+    """ One filing. Replaces the per-filing dicts, a __slots__ object is a fraction of the size of a dict with the same fields and
+        typos in field names fail loudly instead of quietly adding a new key """
+    __slots__ = ("access_num", "filing_date", "filing_type", "report_date", "xdoc_url", "index")
+
+    def __init__(self, access_num, filing_date=None, filing_type=None, report_date=None, xdoc_url=None, index=None):
+        self.access_num = access_num    # accession number, dashes removed
+        self.filing_date = filing_date  # 'YYYY-MM-DD'
+        self.filing_type = filing_type  # e.g. 10-Q
+        self.report_date = report_date  # 'YYYY-MM-DD' end of the period the filing covers, or None
+        self.xdoc_url = xdoc_url        # url of the xbrl doc, once we've found it
+        self.index = index              # FactIndex, once it's been parsed or loaded
+
+    def __repr__(self):
+        return f"Filing({self.access_num} {self.filing_type} filed {self.filing_date})"
+
+
+
+def fact_rows(cik, filing):
+    """ Yields (cik, concept, period_end, period_days, unit, value, accession, filed) for every numeric, company-wide fact in a filing """
+    accession = int(filing.access_num)
+    filed = filing.filing_date
+    for f in filing.index.facts:
+        if f['dims'] or f['unit'] is None or f['end'] is None:
+            continue
+        try:
+            value = float(f['value'])
+        except ValueError:
+            continue # text blocks, nil values, etc
+        yield (cik, f['concept'], f['end'], f['days'], f['unit'], value, accession, filed)
+
+
+def _filed_order(row):
+    return row[7] or "" # filing dates are 'YYYY-MM-DD' strings. A filing without one never wins over one with a date
+
+
+_staging = """
+    CREATE TEMP TABLE IF NOT EXISTS xbrl_facts_staging (
+        cik INT, concept VARCHAR(255), period_end DATE, period_days SMALLINT, unit VARCHAR(100), value DOUBLE PRECISION, accession BIGINT,
+        filed DATE
+    ) ON COMMIT DELETE ROWS"""
+
+# only names that aren't in the dictionary tables yet are inserted. ON CONFLICT alone would still call nextval() for every name in every
+# batch and burn through the id sequences. The ON CONFLICT is still needed for two loads adding the same new name at once
+_merge = """
+    INSERT INTO xbrl_concepts (name)
+    SELECT DISTINCT s.concept FROM xbrl_facts_staging s WHERE NOT EXISTS (SELECT 1 FROM xbrl_concepts c WHERE c.name = s.concept)
+    ON CONFLICT (name) DO NOTHING;
+    INSERT INTO xbrl_units (name)
+    SELECT DISTINCT s.unit FROM xbrl_facts_staging s WHERE NOT EXISTS (SELECT 1 FROM xbrl_units u WHERE u.name = s.unit)
+    ON CONFLICT (name) DO NOTHING;
+
+    INSERT INTO xbrl_facts (cik, concept_id, period_end, period_days, unit_id, value, accession, filed)
+    SELECT s.cik, c.concept_id, s.period_end, s.period_days, u.unit_id, s.value, s.accession, s.filed
+    FROM xbrl_facts_staging s
+    JOIN xbrl_concepts c ON c.name = s.concept
+    JOIN xbrl_units u ON u.name = s.unit
+    ON CONFLICT (cik, concept_id, period_end, period_days, unit_id) DO UPDATE
+        SET value = EXCLUDED.value, accession = EXCLUDED.accession, filed = EXCLUDED.filed
+        WHERE xbrl_facts.filed IS NULL OR EXCLUDED.filed >= xbrl_facts.filed;
+"""
+
+
+def copy_facts(curs, cik, filings):
+    """
+        Writes the facts from 'filings' into xbrl_facts. Runs in the caller's transaction, so the caller decides when it commits
+        (sync.py commits it together with the filing's watermark).
+
+        Facts are COPY'd into a temp staging table with their concept/unit names, then one statement adds any new names to the
+        dictionary tables and merges the facts in with the names swapped for ids. Doing the name -> id lookup in the db (instead of
+        caching ids in python) means a rolled back transaction can never leave us holding ids that don't exist.
+
+        Returns:
+            number of facts written
+    """
+    rows = {}
+    for filing in filings:
+        if filing.index is None:
+            continue
+        for r in fact_rows(cik, filing):
+            # same fact in two filings being loaded together: keep the later filing, same as the merge does. Accession numbers can't be
+            # used for this, they start with the filer agent's id, not the date
+            key = r[1:5]
+            if key not in rows or _filed_order(rows[key]) <= _filed_order(r):
+                rows[key] = r
+    if len(rows) == 0:
+        return 0
+
+    buf = io.StringIO()
+    for cik_, concept, end, days, unit, value, accession, filed in rows.values():
+        buf.write(f"{cik_}\t{concept}\t{end.isoformat()}\t{days}\t{unit}\t{value!r}\t{accession}\t{filed or NULL}\n")
+    buf.seek(0)
+
+    curs.execute(_staging)
+    curs.execute("TRUNCATE xbrl_facts_staging")
+    curs.copy_expert("COPY xbrl_facts_staging FROM STDIN", buf)
+    curs.execute(_merge)
+
+    logger.debug(f"{cik} Copied {len(rows)} facts from {len(filings)} filings")
+    return len(rows)
+
+
+def get_facts(conn, cik, concepts, days=None, since=None):
+    """
+        Reads facts back out of the store.
+
+        Args:
+            cik (int): company
+            concepts (list): concept names, e.g. ["EarningsPerShareDiluted"]
+            days (tuple): optional (min, max) period length in days, e.g. (75, 105) for quarters, (0, 0) for instants
+            since (date): optional earliest period_end
+
+        Returns:
+            list of (concept, period_end, period_days, unit, value), oldest first
+    """
+    sql = """
+        SELECT c.name, f.period_end, f.period_days, u.name, f.value FROM xbrl_facts f
+        JOIN xbrl_concepts c ON c.concept_id = f.concept_id
+        JOIN xbrl_units u ON u.unit_id = f.unit_id
+        WHERE f.cik = %s AND c.name = ANY(%s)"""
+    params = [cik, list(concepts)]
+    if days is not None:
+        sql += " AND f.period_days BETWEEN %s AND %s"
+        params += list(days)
+    if since is not None:
+        sql += " AND f.period_end >= %s"
+        params.append(since)
+    sql += " ORDER BY f.period_end, c.name"
+
+    with conn.cursor() as curs:
+        curs.execute(sql, params)
+        return curs.fetchall()
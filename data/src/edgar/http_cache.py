@@ -0,0 +1,192 @@
+"""
+    Persistent on-disk cache for SEC requests, so re-runs and debugging sessions don't re-download the same filings over and over.
+
+    Entries are content-addressed by the sha256 of their url: <cache dir>/<first 2 hex chars>/<sha>.gz holds the gzipped body and
+    <sha>.json holds the metadata (url, ETag, Last-Modified, when it was fetched, whether it's immutable).
+
+    - immutable entries (archive pages and xbrl docs, which never change once filed) are served straight from disk forever
+    - mutable entries (the submissions json) are served from disk for max_age seconds, then revalidated with a conditional GET
+      (If-None-Match / If-Modified-Since), which usually comes back as a body-less 304
+    - total size is capped at MAX_BYTES. When it goes over, the least recently used entries are evicted first
+
+    Set EARNI_SEC_CACHE_DIR to move the cache, or EARNI_SEC_CACHE=0 to turn it off.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+import logging
+from pathlib import Path
+
+
+logger = logging.getLogger('EDGAR')
+
+CACHE_DIR = Path(os.environ.get("EARNI_SEC_CACHE_DIR", Path.home() / ".cache" / "earni" / "sec"))
+ENABLED = os.environ.get("EARNI_SEC_CACHE", "1") != "0"
+MAX_BYTES = 5 * 1024 ** 3 # 5GB. xbrl docs compress ~10x so this holds a lot of filings
+MUTABLE_MAX_AGE = 60 * 60 # seconds before a cached submissions json gets revalidated
+
+
+class CachedResponse:
+    """ Minimal stand-in for requests.Response, so callers don't care whether a body came from disk or the network """
+
+    def __init__(self, url, content, status_code=200, from_cache=True):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class DiskCache:
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._size = None # total bytes on disk, computed lazily on the first write
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        folder = self.directory / key[:2]
+        return folder / f"{key}.gz", folder / f"{key}.json"
+
+
+    def _read_meta(self, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+
+    def _read_body(self, body_path):
+        with gzip.open(body_path, "rb") as file:
+            return file.read()
+
+
+    def _write_atomic(self, path, data):
+        """ write to a temp file then rename, so a crash or another thread never sees half an entry """
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, path)
+
+
+    def get(self, url, fetch, immutable=False, max_age=MUTABLE_MAX_AGE):
+        """
+            Returns the response for url, from disk if possible.
+
+            Args:
+                url (str): url to get
+                fetch (function): fetch(url, headers) -> requests.Response. Called on a miss or to revalidate. Must return 304s instead of raising
+                immutable (bool): if True, a cached copy is always good and we never touch the network for it again
+                max_age (int): for mutable urls, how many seconds a cached copy is used before it gets revalidated
+        """
+        body_path, meta_path = self._paths(url)
+        meta = self._read_meta(meta_path) if body_path.exists() else None
+
+        if meta is not None and (immutable or time.time() - meta["fetched"] < max_age):
+            try:
+                content = self._read_body(body_path)
+                os.utime(meta_path) # mark as recently used for eviction
+                self.hits += 1
+                return CachedResponse(url, content)
+            except OSError:
+                meta = None # entry got evicted or corrupted under us, just refetch
+
+        conditional = {}
+        if meta is not None:
+            if meta.get("etag"):
+                conditional["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                conditional["If-Modified-Since"] = meta["last_modified"]
+
+        resp = fetch(url, conditional)
+
+        if resp.status_code == 304 and meta is not None:
+            self.revalidated += 1
+            meta["fetched"] = time.time()
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            return CachedResponse(url, self._read_body(body_path))
+
+        self.misses += 1
+        self._store(url, resp, immutable, body_path, meta_path)
+        return CachedResponse(url, resp.content, resp.status_code, from_cache=False)
+
+
+    def _store(self, url, resp, immutable, body_path, meta_path):
+        body = gzip.compress(resp.content, compresslevel=6)
+        meta = {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "fetched": time.time(),
+            "immutable": immutable,
+            "size": len(body),
+        }
+
+        old_size = 0
+        if body_path.exists():
+            old_size = body_path.stat().st_size
+
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(body_path, body)
+        self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+        with self.lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(body) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+
+    def _disk_usage(self):
+        return sum(p.stat().st_size for p in self.directory.glob("*/*.gz"))
+
+
+    def _evict(self):
+        """ deletes least recently used entries until we're 10% under the cap, so we aren't evicting on every single write """
+        target = self.max_bytes * 0.9
+        entries = []
+        for meta_path in self.directory.glob("*/*.json"):
+            body_path = meta_path.with_suffix(".gz")
+            try:
+                entries.append((meta_path.stat().st_mtime, meta_path, body_path, body_path.stat().st_size))
+            except OSError:
+                continue
+        entries.sort()
+
+        removed = 0
+        for _, meta_path, body_path, size in entries:
+            if self._size <= target:
+                break
+            for p in (body_path, meta_path):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            self._size -= size
+            removed += 1
+
+        logger.info(f"Evicted {removed} entries from the SEC cache, now {self._size / 1024 ** 2:.0f}MB")
+
+
+    def stats(self):
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
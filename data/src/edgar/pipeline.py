@@ -0,0 +1,174 @@
+"""
+    Two stage download -> parse pipeline for filings.
+
+    Downloading is I/O bound (and capped at 10 req/s by sec_http anyway) while xbrl parsing is CPU bound, so running both on the same
+    threads means the GIL serializes all the parsing onto one core. This splits them:
+
+        download threads --> bounded queue --> process pool of parser workers
+
+    - downloads run on a thread pool, same as sec_http.fetch_all
+    - downloaded docs go into a bounded queue. When the parsers fall behind the queue fills up and the downloaders block, so a big
+      backfill never piles hundreds of raw docs up in memory
+    - parsing runs in a ProcessPoolExecutor, one worker per core by default. Workers send back compact records (plain lists/strings,
+      see xbrl_stream.extract_records), which are cheap to pickle back to the main process, never parse trees
+
+    A run creates (and shuts down) it's own process pool by default. Callers that run the pipeline for lots of companies at once, like
+    sync.py, create one ParserPool up front and pass it to every run instead, so the worker processes are only started once and several
+    companies' downloads can overlap while they share the parsers.
+
+    Usage:
+        results = pipeline.run(filings, download=lambda f: get_doc_bytes(f), parse=xbrl_stream.extract_records)
+
+        with pipeline.ParserPool() as parsers:
+            results = pipeline.run(filings, download, parse, parsers=parsers)   # from any number of threads
+"""
+
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import sec_http
+
+
+logger = logging.getLogger('EDGAR')
+
+QUEUE_SIZE = 16 # downloaded docs waiting to be parsed. xbrl docs are a few MB each, so this bounds the buffer to ~100MB at worst
+PARSE_WORKERS = os.cpu_count() or 1
+
+
+class ParserPool:
+    """ Process pool of parser workers that any number of pipeline.run calls can share, from any number of threads """
+
+    def __init__(self, workers=PARSE_WORKERS):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        # docs handed to the pool and not finished yet, across every run using it. Each one keeps it's doc in memory until a worker
+        # takes it, so this is what bounds memory when lots of runs share the pool: every worker busy plus one doc each waiting
+        self.slots = threading.BoundedSemaphore(workers * 2)
+
+    def submit(self, fn, *args):
+        with self.lock:
+            executor = self.executor
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker died (killed, out of memory). This run fails, but start a new pool so the runs after it don't all fail too
+            with self.lock:
+                if self.executor is executor:
+                    logger.warning("Parser pool broke, starting a new one")
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            raise
+
+    def close(self, wait=True):
+        with self.lock:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+def run(items, download, parse, download_workers=sec_http.MAX_WORKERS, parse_workers=PARSE_WORKERS, queue_size=QUEUE_SIZE, parsers=None):
+    """
+        Downloads and parses every item.
+
+        Args:
+            items (list): things to download, e.g. Filings
+            download (function): download(item) -> data to parse. Runs on the download threads
+            parse (function): parse(data) -> result. Runs in a worker process, so it has to be a module level function and it's
+                result has to be picklable
+            parse_workers (int): worker processes, when this run creates it's own pool
+            parsers (ParserPool): shared pool to parse on. None creates one just for this run and shuts it down after
+
+        Returns:
+            list of results in the same order as items. If either stage failed for an item, that item's result is the exception instead
+    """
+    n = len(items)
+    if n == 0:
+        return []
+
+    if parsers is None:
+        with ParserPool(max(1, min(parse_workers, n))) as parsers:
+            return _run(items, download, parse, download_workers, queue_size, parsers)
+    return _run(items, download, parse, download_workers, queue_size, parsers)
+
+
+def _run(items, download, parse, download_workers, queue_size, parsers):
+    n = len(items)
+    results = [None] * n
+    docs = queue.Queue(maxsize=queue_size)
+    stop = threading.Event() # set if the main loop dies, so downloaders stop instead of blocking forever on a queue nobody reads
+
+    def download_one(i):
+        if stop.is_set():
+            return
+        try:
+            item = (i, download(items[i]), None)
+        except Exception as e:
+            logger.error(f"download failed for {items[i]}: {e}")
+            item = (i, None, e)
+        while not stop.is_set():
+            try:
+                docs.put(item, timeout=1) # blocks while the queue is full, that's the backpressure
+                return
+            except queue.Full:
+                continue
+
+    parsing = {} # future -> item index
+    with ThreadPoolExecutor(max_workers=download_workers) as downloaders:
+        for i in range(n):
+            downloaders.submit(download_one, i)
+
+        try:
+            received = 0
+            while received < n or parsing:
+                # take another doc if there's a free slot in the parser pool. If nothing of ours is parsing there's nothing to wait on
+                # but other runs' docs, so block until one of them frees a slot
+                if received < n and parsers.slots.acquire(blocking=not parsing):
+                    try:
+                        i, data, error = docs.get()
+                        received += 1
+                        if error is not None:
+                            results[i] = error
+                            parsers.slots.release()
+                        else:
+                            parsing[parsers.submit(parse, data)] = i
+                    except BaseException:
+                        parsers.slots.release()
+                        raise
+                    continue
+
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = parsing.pop(future)
+                    parsers.slots.release()
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        logger.error(f"parse failed for {items[i]}: {e}")
+                        results[i] = e
+        except BaseException:
+            # parser pool broke (a worker got killed), ctrl-c, etc. Stop everything before leaving the with, which waits on the downloads:
+            # downloads that haven't started are cancelled, running ones see the flag, and the queue is emptied so nothing's stuck on it.
+            # Our docs still in the parser pool are cancelled and their slots handed back, the pool itself may be shared
+            stop.set()
+            downloaders.shutdown(wait=False, cancel_futures=True)
+            for future in parsing:
+                future.cancel()
+                parsers.slots.release()
+            parsing.clear()
+            while True:
+                try:
+                    docs.get_nowait()
+                except queue.Empty:
+                    break
+            raise
+
+    return results
@@ -0,0 +1,129 @@
+"""
+    Shared HTTP layer for every request we make to the SEC.
+
+    - one requests.Session with keep-alive, shared by every thread, so we aren't doing a new TLS handshake per filing
+    - a global token-bucket rate limiter so we never go over the SEC's 10 requests/second fair access policy, no matter how many
+      threads are fetching at once
+    - retries with backoff on 429s and 5xx errors
+    - fetch_all() to run a list of fetches on a bounded thread pool
+
+    Base urls can be overridden with the EARNI_SEC_DATA_URL / EARNI_SEC_WWW_URL environment variables (or by setting DATA_URL / WWW_URL
+    directly), which is how the fetch code gets pointed at a local fixture server, e.g. `python -m http.server` in a directory laid
+    out like the SEC's (submissions/CIK0000320193.json, Archives/edgar/data/...).
+"""
+
+import os
+import sys
+import time
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import http_cache
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from rate_limit import RateLimiter # shared with the price scrapers
+
+
+logger = logging.getLogger('EDGAR')
+
+headers = {
+    'User-Agent': 'Your Name (your.email@example.com)'
+}
+
+DATA_URL = os.environ.get("EARNI_SEC_DATA_URL", "https://data.sec.gov")  # submissions json
+WWW_URL = os.environ.get("EARNI_SEC_WWW_URL", "https://www.sec.gov")     # filing archives
+
+MAX_REQUESTS_PER_SECOND = 10 # SEC fair access policy: https://www.sec.gov/os/accessing-edgar-data
+MAX_WORKERS = 8 # fetch threads. More than this doesn't help much since we're capped at 10 req/s anyway
+TIMEOUT = 30
+RETRIES = 4
+
+limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+session = requests.Session()
+session.headers.update(headers)
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+
+def get(url, **kwargs):
+    """ GETs a url through the shared session and rate limiter. Retries 429s, 5xxs and connection errors with exponential backoff,
+        raises for anything else that isn't a 2xx/304
+
+        Returns:
+            requests.Response
+    """
+    for attempt in range(RETRIES + 1):
+        limiter.acquire()
+        try:
+            resp = session.get(url, timeout=TIMEOUT, **kwargs)
+        except requests.ConnectionError:
+            if attempt == RETRIES:
+                logger.error(f"Connection failed after {RETRIES + 1} attempts: {url}")
+                raise
+            resp = None
+
+        if resp is not None and resp.status_code != 429 and resp.status_code < 500:
+            if resp.status_code != 304:
+                resp.raise_for_status()
+            return resp
+
+        if attempt == RETRIES:
+            logger.error(f"Giving up on {url} after {RETRIES + 1} attempts (status {resp.status_code})")
+            resp.raise_for_status()
+
+        delay = 2 ** attempt
+        logger.warning(f"Request failed ({resp.status_code if resp is not None else 'connection error'}), retrying in {delay}s: {url}")
+        time.sleep(delay)
+
+
+cache = http_cache.DiskCache() if http_cache.ENABLED else None
+
+
+def get_cached(url, immutable=False, max_age=http_cache.MUTABLE_MAX_AGE):
+    """ get() through the on-disk cache (see http_cache.py). Use immutable=True for archive pages and filing docs, which never change
+        once they're filed, so a cached copy never needs another request. Everything else is revalidated with a conditional GET
+        once it's older than max_age
+
+        Returns:
+            http_cache.CachedResponse, or a requests.Response if the cache is turned off
+    """
+    if cache is None:
+        return get(url)
+    return cache.get(url, lambda u, conditional: get(u, headers=conditional), immutable=immutable, max_age=max_age)
+
+
+def submissions_url(name):
+    """ url for a file in the submissions api, e.g. CIK0000320193.json or CIK0000320193-submissions-001.json """
+    return f"{DATA_URL}/submissions/{name}"
+
+
+def archive_url(cik, access_num):
+    return f"{WWW_URL}/Archives/edgar/data/{cik}/{access_num}"
+
+
+def absolute_url(href):
+    """ archive pages link to docs with site-relative hrefs """
+    if href.startswith("http://") or href.startswith("https://"):
+        return href
+    return WWW_URL + href
+
+
+def fetch_all(items, fn, max_workers=MAX_WORKERS):
+    """ Runs fn(item) for every item on a bounded thread pool and returns the results in the same order as items.
+        The rate limiter is global, so this is safe to use with any number of workers
+
+        If fn raises for an item, that item's result is the exception instead, so one bad filing doesn't sink the whole batch
+    """
+    def run(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            logger.error(f"fetch failed for {item}: {e}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, items))
@@ -0,0 +1,251 @@
+"""
+    Incremental EDGAR sync.
+
+    request_all_filings refetches a company's whole submissions history every time, and the only cutoff is a start_date someone has to
+    pass in by hand. This keeps a watermark per cik instead (sec_sync_state: the newest 10-Q/10-K filing date and accession number we've
+    processed) and only downloads and parses filings newer than that:
+
+    - the submissions json is revalidated with a conditional request, so a company with nothing new costs one 304 and no parsing
+    - new filings are found in the 'recent' block (the last ~1000 filings), which is all a nightly run ever needs. The paginated 'files'
+      are only fetched when the watermark is older than everything in 'recent' (first sync, or a company that files a LOT)
+    - each new filing is parsed into a FactIndex, it's facts are loaded into the fact store (fact_store.py) and it's recorded in
+      sec_filings, and the watermark moves forward in the same transaction. A nightly run's handful of filings are parsed right on the
+      fetch thread (edgar_api.fetch_filing). A first sync or a big backlog goes through the download -> parse pipeline instead
+      (edgar_api.fetch_filings), so the parsing is spread across every core
+
+    If a filing fails to download, the watermark is held back to it's filing date so the next run retries it. Filings on that date
+    that did succeed are already in sec_filings, so they aren't done twice.
+
+    Usage:
+        python sync.py              # every company in the symbol master
+        python sync.py aapl msft    # just these
+        python sync.py --no-parse   # just record new filings, don't download/parse the xbrl docs
+"""
+
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+import edgar_api
+import sec_http
+import database as db # edgar_api already put data/src on the path for symbols
+import fact_store
+import pipeline
+from fact_store import Filing
+import symbols
+
+
+logger = logging.getLogger('EDGAR')
+
+FORMS = ("10-Q", "10-K")
+INLINE_FILINGS = 4 # up to this many new filings are parsed on the fetch thread, more go through the pipeline
+
+
+def load_watermarks(conn, ciks=None):
+    """ Returns {cik: (last_accession, last_filing_date)} """
+    with conn.cursor() as curs:
+        if ciks is None:
+            curs.execute("SELECT cik, last_accession, last_filing_date FROM sec_sync_state")
+        else:
+            curs.execute("SELECT cik, last_accession, last_filing_date FROM sec_sync_state WHERE cik = ANY(%s)", (list(ciks),))
+        return {row[0]: (row[1], row[2]) for row in curs.fetchall()}
+
+
+def known_accessions(conn, cik, since):
+    """ accession numbers already processed for a cik on or after 'since' """
+    if since is None:
+        return set()
+    with conn.cursor() as curs:
+        curs.execute("SELECT accession FROM sec_filings WHERE cik = %s AND filing_date >= %s", (cik, since))
+        return {row[0] for row in curs.fetchall()}
+
+
+def _block_filings(block, forms=FORMS):
+    """ turns a 'recent' block (or a paginated file, same layout) into Filings for the forms we want """
+    types = block.get('form') or block['primaryDocDescription']
+    infos = []
+    for i, form in enumerate(types):
+        if form.upper() not in forms:
+            continue
+        infos.append(Filing(
+            access_num=block['accessionNumber'][i].replace("-", ""),
+            filing_date=block['filingDate'][i],
+            filing_type=form,
+            report_date=block['reportDate'][i] or None,
+        ))
+    return infos
+
+
+def new_filings(cik, since=None, known=(), forms=FORMS):
+    """
+        Finds the filings for a cik that haven't been processed yet.
+
+        Args:
+            cik (int): company to check
+            since (date): watermark filing date. None means we've never synced this company, so everything is new
+            known (set): accession numbers on or after 'since' that were already processed
+
+        Returns:
+            (list of Filings, oldest first, bool True if the paginated history had to be fetched)
+    """
+    since = since.isoformat() if since is not None else None
+    filings = edgar_api.request_filings(str(cik), max_age=0)
+    recent = filings['recent']
+
+    blocks = [recent]
+    # 'recent' only reaches back so far. If our watermark is older than the oldest filing in it, there could be new filings we'd miss,
+    # so pull in the paginated files that overlap the gap
+    oldest_recent = min(recent['filingDate']) if recent['filingDate'] else None
+    paged = since is None or oldest_recent is None or oldest_recent > since
+    if paged:
+        names = [f['name'] for f in filings.get('files', []) if since is None or f['filingTo'] >= since]
+        for name, f in zip(names, sec_http.fetch_all(names, edgar_api.request_filing)):
+            if isinstance(f, Exception):
+                raise f # a gap in the history would move the watermark past filings we never saw
+            blocks.append(f)
+
+    infos = []
+    seen = set()
+    for block in blocks:
+        for f in _block_filings(block, forms):
+            if since is not None and f.filing_date < since:
+                continue
+            if f.access_num in known or f.access_num in seen:
+                continue
+            seen.add(f.access_num)
+            infos.append(f)
+
+    infos.sort(key=lambda f: (f.filing_date, f.access_num))
+    return infos, paged
+
+
+def _sync_one(cik, watermark, known, parsers):
+    """ network half of a sync: find new filings for a cik and (optionally) download + index them. Runs on the fetch threads.
+        parsers is the run's shared pipeline.ParserPool, or None to just find the new filings without parsing them """
+    since = watermark[1] if watermark else None
+    infos, paged = new_filings(cik, since, known)
+
+    if parsers is None:
+        return infos, [], paged
+
+    if since is None or len(infos) > INLINE_FILINGS:
+        results = edgar_api.fetch_filings(cik, infos, parsers)
+    else:
+        results = []
+        for filing in infos:
+            try:
+                results.append(edgar_api.fetch_filing(cik, filing))
+            except Exception as e:
+                results.append(e)
+
+    done, failed = [], []
+    for filing, result in zip(infos, results):
+        if isinstance(result, Exception):
+            logger.error(f"{cik} Unable to fetch filing {filing.access_num}: {result}")
+            failed.append(filing)
+        else:
+            done.append(filing)
+
+    return done, failed, paged
+
+
+def _record(conn, cik, watermark, done, failed):
+    """ db half of a sync: record processed filings and move the watermark, in one transaction """
+    if len(done) == 0 and len(failed) == 0:
+        return
+
+    with conn.cursor() as curs:
+        for f in done:
+            curs.execute("""
+                INSERT INTO sec_filings (cik, accession, form, filing_date, report_date) VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (cik, accession) DO NOTHING""",
+                (cik, f.access_num, f.filing_type, f.filing_date, f.report_date))
+        fact_store.copy_facts(curs, cik, done) # facts commit (or don't) together with the filings and the watermark
+        for f in done:
+            f.index = None # it's saved to disk and in the db now, no need to hold every filing's facts for the rest of the run
+
+        if failed:
+            # hold the watermark back so the failures get retried. Anything that succeeded is in sec_filings so it won't be redone
+            last = min(failed, key=lambda f: (f.filing_date, f.access_num))
+            last_accession, last_date = (watermark or (None, None))[0], last.filing_date
+        else:
+            last = done[-1]
+            last_accession, last_date = last.access_num, last.filing_date
+
+        curs.execute("""
+            INSERT INTO sec_sync_state (cik, last_accession, last_filing_date, synced_at) VALUES (%s, %s, %s, now())
+            ON CONFLICT (cik) DO UPDATE SET last_accession = EXCLUDED.last_accession, last_filing_date = EXCLUDED.last_filing_date,
+                synced_at = EXCLUDED.synced_at""",
+            (cik, last_accession, last_date))
+    conn.commit()
+
+
+def sync(ciks=None, parse=True, conn=None):
+    """
+        Syncs every cik in 'ciks' (default: the whole symbol master). Companies are checked concurrently on a thread pool (sec_http's
+        rate limiter keeps the requests under the SEC's limit), and each one is recorded and committed on this thread as soon as it's done.
+
+        Returns:
+            dict of counts: companies, unchanged, paged (needed the paginated history), new filings, failed filings
+    """
+    conn = conn or db.get_conn()
+    if ciks is None:
+        ciks = sorted(symbols.get_master().by_cik)
+
+    start = time.perf_counter()
+    watermarks = load_watermarks(conn, ciks)
+    known = {cik: known_accessions(conn, cik, watermarks[cik][1]) for cik in watermarks}
+
+    stats = {'companies': len(ciks), 'unchanged': 0, 'paged': 0, 'new': 0, 'failed': 0, 'errors': 0}
+    # one parser pool for the whole run, shared by every company that goes through the pipeline (first syncs, big backlogs)
+    parsers = pipeline.ParserPool() if parse else None
+    pool = ThreadPoolExecutor(max_workers=sec_http.MAX_WORKERS)
+    try:
+        futures = {pool.submit(_sync_one, cik, watermarks.get(cik), known.get(cik, set()), parsers): cik for cik in ciks}
+        for future in as_completed(futures):
+            cik = futures.pop(future) # drop our reference so the company's filings can be freed once they're recorded
+            try:
+                done, failed, paged = future.result()
+            except Exception as e:
+                logger.error(f"{cik} Sync failed: {e}")
+                stats['errors'] += 1 # watermark is left alone, so the next run just tries this company again
+                continue
+
+            # committed now, not at the end of the run, so a crash or ctrl-c only loses the companies still in flight
+            _record(conn, cik, watermarks.get(cik), done, failed)
+            stats['new'] += len(done)
+            stats['failed'] += len(failed)
+            stats['paged'] += paged
+            if len(done) == 0 and len(failed) == 0:
+                stats['unchanged'] += 1
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True) # don't sit through every company that hasn't started yet
+        if parsers is not None:
+            parsers.close(wait=False)
+        raise
+    pool.shutdown()
+    if parsers is not None:
+        parsers.close()
+
+    stats['seconds'] = round(time.perf_counter() - start, 1)
+    logger.info(f"Sync finished: {stats}")
+    return stats
+
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    ciks = None
+    if args:
+        ciks = [symbols.get_cik(t) for t in args]
+        missing = [t for t, c in zip(args, ciks) if c is None]
+        if missing:
+            print(f"Unknown tickers: {missing}")
+            sys.exit(2)
+
+    try:
+        sync(ciks, parse="--no-parse" not in sys.argv)
+    finally:
+        db.close_conn()
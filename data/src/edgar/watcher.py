@@ -0,0 +1,367 @@
+"""
+    Near-real-time filing watcher for alerts.
+
+    Polls EDGAR's latest filings feed (the atom version of https://www.sec.gov/cgi-bin/browse-edgar?action=getcurrent) for new 10-Qs
+    and 8-Ks from companies in the symbol master, parses the new ones, and checks every saved alert against them:
+
+    - the feed is fetched through the on-disk cache with max_age=0, so every poll is a conditional request. A 304 (nothing new)
+      costs no parsing at all
+    - filings are deduped by accession number, so a filing that stays in the feed across polls (or shows up in both the 10-Q and 8-K
+      feeds) is only processed once
+    - 10-Qs are parsed into a FactIndex for their EPS. 8-Ks only matter if they're earnings releases (Item 2.02), and those don't carry
+      the numbers in xbrl, so they come through as an event without EPS
+    - everything new in a poll is evaluated against every alert in one pass: the batch is turned into columns and handed to the api's
+      FilterEngine, so each distinct filter clause is a single numpy comparison across the whole batch (and clauses shared by several
+      alerts are only computed once), instead of a query per alert per filing
+
+    For every filing it logs the end-to-end latency, from the SEC accepting the filing to our alerts being evaluated.
+
+    Alerts are kept in a json file (ALERTS_PATH), a list of:
+        {"id": "big-beat", "user": "moe", "tickers": ["aapl", "msft"], "forms": ["10-Q"],
+         "filters": [{"fn": "where_value_is", "args": ["eps_diff", ">", 0.08]}]}
+    'tickers' and 'forms' are optional. 'filters' use the same functions and arguments as DatabaseHelper/FilterEngine.
+
+    Usage:
+        python watcher.py                       # poll forever
+        python watcher.py --once --backfill     # process whatever is in the feed right now, then exit
+        python watcher.py --feed http://localhost:8000/feed.xml    # use a local stand-in for the feed (a saved copy of the atom output)
+"""
+
+import re
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from lxml import etree
+
+import edgar_api
+import sec_http
+import symbols
+import database as db # edgar_api already put data/src on the path
+from fact_store import Filing
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from api.columnar import ColumnarResult
+from api.filter_engine import FilterEngine, _default_fields
+
+
+logger = logging.getLogger('EDGAR')
+
+ALERTS_PATH = Path(__file__).resolve().parent / "alerts.json"
+FORMS = ("10-Q", "8-K")
+POLL_SECONDS = 30
+FEED_COUNT = 100 # entries per feed request, the most the SEC returns
+SEEN_MAX = 20000 # accession numbers to remember for dedupe
+PARSE_RETRIES = 10 # polls to keep retrying a filing that fails to parse, e.g. a 10-Q whose xbrl isn't posted yet right at acceptance
+EARNINGS_ITEM = "2.02" # 8-K item for 'Results of Operations and Financial Condition', i.e. an earnings release
+EPS_CONCEPTS = ("EarningsPerShareDiluted", "EarningsPerShareBasic")
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_accession = re.compile(r"accession-number=([\d-]+)")
+_title_cik = re.compile(r"\((\d{10})\)")
+_items = re.compile(r"Item (\d+\.\d+)")
+
+_filter_fns = ("where_value_is", "where_price_diff")
+
+
+def feed_url(form):
+    return (f"{sec_http.WWW_URL}/cgi-bin/browse-edgar?action=getcurrent&type={form}&company=&dateb=&owner=include"
+            f"&start=0&count={FEED_COUNT}&output=atom")
+
+
+def parse_feed(content):
+    """ Parses the atom feed into a list of {'access_num', 'cik', 'form', 'accepted', 'items'} dicts, newest first """
+    root = etree.fromstring(content)
+    entries = []
+    for entry in root.iter(_ATOM + "entry"):
+        acc = _accession.search(entry.findtext(_ATOM + "id") or "")
+        cik = _title_cik.search(entry.findtext(_ATOM + "title") or "")
+        category = entry.find(_ATOM + "category")
+        if acc is None or cik is None or category is None:
+            continue
+
+        updated = entry.findtext(_ATOM + "updated")
+        entries.append({
+            'access_num': acc.group(1).replace("-", ""),
+            'cik': int(cik.group(1)),
+            'form': category.get("term"),
+            'accepted': datetime.fromisoformat(updated) if updated else None,
+            'items': set(_items.findall(entry.findtext(_ATOM + "summary") or "")),
+        })
+    return entries
+
+
+def load_alerts(path=ALERTS_PATH):
+    if not Path(path).exists():
+        logger.warning(f"No alerts file at {path}, nothing to evaluate")
+        return []
+    with open(path, "r", encoding="utf-8") as file:
+        alerts = json.load(file)
+
+    valid = []
+    for a in alerts:
+        bad = [f.get('fn') for f in a.get('filters', []) if f.get('fn') not in _filter_fns]
+        if bad or 'filters' not in a:
+            logger.error(f"Skipping alert {a.get('id')}, invalid filter functions: {bad or 'no filters'}. Expected one of: {_filter_fns}")
+            continue
+        valid.append(a)
+    return valid
+
+
+def quarterly_eps(index):
+    """ The company-wide quarterly EPS from a filing's FactIndex: the latest ~90 day period without dimensions. (eps, period_end) """
+    for concept in EPS_CONCEPTS:
+        best = None
+        for (end, bucket, c), facts in index.by_key.items():
+            if c != concept or bucket != "Q":
+                continue
+            for f in facts:
+                if f['dims'] or (best is not None and end <= best[1]):
+                    continue
+                try:
+                    best = (float(f['value']), end)
+                except (TypeError, ValueError):
+                    continue # nil/empty fact, don't let it sink the whole filing
+        if best is not None:
+            return best
+    return None, None
+
+
+def lookup_estimates(filings, conn=None):
+    """ Fills in eps_estimate for a batch of filings from earnings_reports, with one query for the whole batch. Best effort: without
+        a db (or an estimate for that report) the estimate is just missing, and any filter on it won't match.
+        Reads on it's own short lived connection unless 'conn' is passed in, in which case the caller owns it's transaction """
+    tickers = list({f['ticker'] for f in filings})
+    own = None
+    try:
+        if conn is None:
+            conn = own = db.connect() # not the shared connection, someone else could be in the middle of a transaction on it
+        with conn.cursor() as curs:
+            curs.execute("""
+                SELECT DISTINCT ON (ticker) ticker, eps_estimate FROM earnings_reports
+                WHERE ticker = ANY(%s) AND date BETWEEN CURRENT_DATE - 7 AND CURRENT_DATE + 7
+                ORDER BY ticker, abs(date - CURRENT_DATE)""", (tickers,))
+            estimates = dict(curs.fetchall())
+    except Exception as e:
+        logger.warning(f"Couldn't look up eps estimates: {e}")
+        return
+    finally:
+        if own is not None:
+            own.close()
+
+    for f in filings:
+        if estimates.get(f['ticker']) is not None:
+            f['eps_estimate'] = float(estimates[f['ticker']])
+
+
+def batch_columns(filings, fields=_default_fields):
+    """ Turns a batch of parsed filings into a ColumnarResult with every filterable field. Fields we don't have at filing time
+        (post-report prices, etc) are all NULL, so filters on them just don't match, same as in the db """
+    n = len(filings)
+    columns, nulls = {}, {}
+    for name in fields:
+        values = [f.get(name) for f in filings]
+        missing = np.array([v is None for v in values], dtype=bool)
+        if name in ("ticker", "time_of_report"):
+            columns[name] = np.array([v or "" for v in values], dtype=str)
+        elif name in ("report_date", "period_end"):
+            columns[name] = np.array([v if v is not None else "NaT" for v in values], dtype="datetime64[D]")
+        else:
+            columns[name] = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+        if missing.any():
+            nulls[name] = missing
+
+    return ColumnarResult(list(fields), columns, nulls) if n else None
+
+
+def evaluate(alerts, filings):
+    """
+        Checks every alert against a batch of filings in one vectorized pass.
+
+        Returns:
+            list of (alert, filing) matches
+    """
+    columns = batch_columns(filings)
+    if columns is None or len(alerts) == 0:
+        return []
+
+    engine = FilterEngine(columns)
+    tickers = columns["ticker"]
+    forms = np.array([f['form'] for f in filings], dtype=str)
+
+    matches = []
+    for alert in alerts:
+        try:
+            screen = engine.screen()
+            for f in alert['filters']:
+                getattr(screen, f['fn'])(*f.get('args', []), **f.get('kwargs', {}))
+
+            mask = screen.mask()
+            if alert.get('tickers'):
+                mask &= np.isin(tickers, [symbols.normalize(t) for t in alert['tickers']])
+            if alert.get('forms'):
+                mask &= np.isin(forms, alert['forms'])
+        except Exception as e:
+            # bad alert definition (unknown field, wrong arguments, ...). Skip it, the rest still get evaluated
+            logger.error(f"Alert {alert.get('id')} couldn't be evaluated, skipping it: {e!r}")
+            continue
+
+        for i in np.flatnonzero(mask):
+            matches.append((alert, filings[i]))
+    return matches
+
+
+def notify(alert, filing):
+    """ default alert handler, just logs it. Swap in something that actually reaches the user with Watcher(on_match=...) """
+    logger.info(f"ALERT {alert.get('id')} for {alert.get('user')}: {filing['ticker']} {filing['form']} {filing['access_num']} "
+                f"eps={filing.get('eps_reported')} estimate={filing.get('eps_estimate')}")
+
+
+
+class Watcher:
+    def __init__(self, alerts_path=ALERTS_PATH, feed_urls=None, forms=FORMS, on_match=notify, backfill=False):
+        """
+            Args:
+                alerts_path (str): saved alerts json, reloaded every poll so edits are picked up without a restart
+                feed_urls (list): feed urls to poll. Defaults to the SEC's latest filings feed for each of 'forms'
+                backfill (bool): process filings that are already in the feed on the first poll. Otherwise they're just marked as seen,
+                    so restarting the watcher doesn't re-send every alert from the last hour
+        """
+        self.alerts_path = alerts_path
+        self.feed_urls = feed_urls or [feed_url(f) for f in forms]
+        self.forms = forms
+        self.on_match = on_match
+        self.seen = OrderedDict() # accession numbers that are done with (processed, skipped, or given up on)
+        self.retrying = {} # accession number -> feed entry, for filings that failed to parse and get another try next poll
+        self.first_poll = not backfill
+
+
+    def _is_new(self, access_num):
+        return access_num not in self.seen and access_num not in self.retrying
+
+    def _mark_seen(self, access_num):
+        self.retrying.pop(access_num, None)
+        self.seen[access_num] = True
+        if len(self.seen) > SEEN_MAX:
+            self.seen.popitem(last=False)
+
+    def _parse_failed(self, entry, error):
+        """ keeps a filing that failed to parse around for the next poll, up to PARSE_RETRIES times. The feed may well be a 304 by
+            then, so it can't be counted on to bring the filing back """
+        entry['attempts'] = entry.get('attempts', 0) + 1
+        if entry['attempts'] >= PARSE_RETRIES:
+            logger.error(f"Giving up on {entry['ticker']} {entry['form']} {entry['access_num']} after {entry['attempts']} tries: {error}")
+            self._mark_seen(entry['access_num'])
+        else:
+            logger.warning(f"Couldn't parse {entry['ticker']} {entry['form']} {entry['access_num']}, retrying next poll: {error}")
+            self.retrying[entry['access_num']] = entry
+
+
+    def poll_feeds(self):
+        """ One conditional request per feed. Returns the entries we haven't seen before, for companies we track, plus any earlier ones
+            that are waiting on a retry """
+        master = symbols.get_master()
+        new = []
+        batch = set() # the same filing can be in more than one feed
+        for url in self.feed_urls:
+            try:
+                resp = sec_http.get_cached(url, max_age=0)
+            except Exception as e:
+                logger.error(f"Feed request failed: {url}: {e}")
+                continue
+            if getattr(resp, "from_cache", False): # 304, feed hasn't changed since the last poll. Plain responses when EARNI_SEC_CACHE=0
+                continue
+
+            for entry in parse_feed(resp.content):
+                if entry['form'] not in self.forms or not self._is_new(entry['access_num']) or entry['access_num'] in batch:
+                    continue
+                entry['ticker'] = master.ticker(entry['cik'])
+                if entry['ticker'] is None or (entry['form'] == "8-K" and EARNINGS_ITEM not in entry['items']):
+                    self._mark_seen(entry['access_num']) # nothing to do for these
+                    continue
+                entry['seen'] = time.time()
+                batch.add(entry['access_num'])
+                new.append(entry)
+
+        if self.first_poll:
+            self.first_poll = False
+            for entry in new:
+                self._mark_seen(entry['access_num'])
+            logger.info(f"Marked {len(new)} filings already in the feed as seen")
+            return []
+        # only marked seen once they've parsed (see process), so a failure gets retried instead of silently dropped
+        return new + list(self.retrying.values())
+
+
+    def _parse(self, filing):
+        """ pulls the filterable fields out of a new filing. Runs on the fetch threads """
+        filing['report_date'] = (filing['accepted'] or datetime.now(timezone.utc)).date()
+        if filing['form'] == "10-Q":
+            record = edgar_api.fetch_filing(filing['cik'], Filing(filing['access_num'], filing_type=filing['form']))
+            filing['eps_reported'], filing['period_end'] = quarterly_eps(record.index)
+        filing['parsed'] = time.time()
+        return filing
+
+
+    def process(self, new):
+        """ parses a batch of new filings, then evaluates every alert against all of them at once """
+        results = sec_http.fetch_all(new, self._parse)
+        filings = []
+        for entry, result in zip(new, results):
+            if isinstance(result, Exception):
+                self._parse_failed(entry, result)
+            else:
+                self._mark_seen(entry['access_num'])
+                filings.append(result)
+        if len(filings) == 0:
+            return []
+
+        lookup_estimates(filings)
+        for f in filings:
+            if f.get('eps_reported') is not None and f.get('eps_estimate') is not None:
+                f['eps_diff'] = f['eps_reported'] - f['eps_estimate']
+                f['surprise'] = f['eps_diff']
+                if f['eps_estimate'] != 0:
+                    f['eps_surprise_ratio'] = f['eps_reported'] / f['eps_estimate']
+
+        matches = evaluate(load_alerts(self.alerts_path), filings)
+        evaluated = time.time()
+        for alert, filing in matches:
+            self.on_match(alert, filing)
+
+        for f in filings:
+            accepted = f['accepted'].timestamp() if f['accepted'] else f['seen']
+            logger.info(f"{f['ticker']} {f['form']} {f['access_num']}: detected +{f['seen'] - accepted:.1f}s, "
+                        f"parsed +{f['parsed'] - accepted:.1f}s, evaluated +{evaluated - accepted:.1f}s after acceptance")
+        return matches
+
+
+    def run(self, once=False):
+        while True:
+            start = time.monotonic()
+            try:
+                new = self.poll_feeds()
+                if new:
+                    logger.info(f"{len(new)} new filings")
+                    self.process(new)
+            except Exception:
+                # keep polling no matter what, a watcher that died overnight misses everything after it
+                logger.exception("Poll failed")
+            if once:
+                return
+            time.sleep(max(0, POLL_SECONDS - (time.monotonic() - start)))
+
+
+
+if __name__ == "__main__":
+    feeds = None
+    if "--feed" in sys.argv:
+        feeds = [sys.argv[sys.argv.index("--feed") + 1]]
+
+    watcher = Watcher(feed_urls=feeds, backfill="--backfill" in sys.argv)
+    watcher.run(once="--once" in sys.argv)
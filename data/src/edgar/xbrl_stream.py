@@ -0,0 +1,205 @@
+"""
+    Streaming XBRL fact extractor.
+
+    Building a BeautifulSoup for every filing and then find_all()-ing contexts out of it keeps the whole multi-MB doc (plus a python object
+    for every tag) in memory, and is slow. This does a single iterparse pass instead:
+
+    - each <context> is turned into a small dict (id, start/end/instant, dimensions) as soon as it closes and added to a context index
+    - each us-gaap fact is turned into a dict joined to it's context
+    - every element is cleared as soon as we're done with it, so memory stays flat no matter how big the doc is
+
+    Usage:
+        contexts, facts = xbrl_stream.extract(xdoc_bytes)
+        for fact in facts:
+            print(fact['concept'], fact['end'], fact['value'])
+
+    Run this file directly to benchmark it against the soup path on test.xbrl:
+        python xbrl_stream.py [path/to/doc.xbrl]
+"""
+
+import io
+import sys
+import time
+from datetime import date
+from lxml import etree
+
+
+XBRLI = "{http://www.xbrl.org/2003/instance}"
+XBRLDI = "{http://xbrl.org/2006/xbrldi}"
+US_GAAP_PREFIX = "{http://fasb.org/us-gaap/" # the namespace has the taxonomy year on the end, e.g. http://fasb.org/us-gaap/2024
+
+_CONTEXT = XBRLI + "context"
+
+
+def _to_date(text):
+    return date.fromisoformat(text.strip()) if text else None
+
+
+def _parse_context(elem):
+    """ turns a closed <context> element into {'id', 'start', 'end', 'instant', 'days', 'dims'}
+        'end' is also set for instant contexts, so anything matching on period end date works for both """
+    start = _to_date(elem.findtext(f"{XBRLI}period/{XBRLI}startDate"))
+    end = _to_date(elem.findtext(f"{XBRLI}period/{XBRLI}endDate"))
+    instant = _to_date(elem.findtext(f"{XBRLI}period/{XBRLI}instant"))
+
+    dims = {}
+    for member in elem.iter(XBRLDI + "explicitMember", XBRLDI + "typedMember"):
+        if member.tag == XBRLDI + "explicitMember":
+            dims[member.get("dimension")] = (member.text or "").strip()
+        else: # typed members wrap their value in a child element
+            dims[member.get("dimension")] = "".join(member.itertext()).strip()
+
+    return {
+        'id': elem.get("id"),
+        'start': start,
+        'end': end if end is not None else instant,
+        'instant': instant,
+        'days': (end - start).days if start is not None and end is not None else 0,
+        'dims': dims,
+    }
+
+
+def join_context(fact, context):
+    """ copies a context's period and dimensions onto a fact """
+    fact['start'] = context['start']
+    fact['end'] = context['end']
+    fact['days'] = context['days']
+    fact['dims'] = context['dims']
+    return fact
+
+
+def iter_facts(source, contexts=None):
+    """
+        Generator over the us-gaap facts in an xbrl instance doc, each joined to it's context.
+
+        Args:
+            source (bytes | str | file): the doc itself as bytes, a path to it, or an open binary file
+            contexts (dict): optional dict to fill with the context index (id -> context dict) as the doc is parsed
+
+        Yields:
+            dicts like {'concept', 'value', 'unit', 'decimals', 'context', 'start', 'end', 'days', 'dims'}. 'concept' is the local name,
+            e.g. EarningsPerShareDiluted, and 'value' is the raw text (numbers aren't converted since some facts are text blocks)
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if contexts is None:
+        contexts = {}
+
+    pending = [] # facts that show up before their context. Contexts almost always come first, but the spec doesn't require it
+    depth = 0
+    for event, elem in etree.iterparse(source, events=("start", "end"), huge_tree=True, remove_blank_text=True):
+        if event == "start":
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1: # only handle direct children of the root. Their descendants get cleared along with them
+            continue
+
+        tag = elem.tag
+        if tag == _CONTEXT:
+            c = _parse_context(elem)
+            contexts[c['id']] = c
+        elif isinstance(tag, str) and tag.startswith(US_GAAP_PREFIX):
+            fact = {
+                'concept': etree.QName(tag).localname,
+                'value': (elem.text or "").strip(),
+                'unit': elem.get("unitRef"),
+                'decimals': elem.get("decimals"),
+                'context': elem.get("contextRef"),
+            }
+            context = contexts.get(fact['context'])
+            if context is None:
+                pending.append(fact)
+            else:
+                yield join_context(fact, context)
+
+        # free the element and everything before it, otherwise the tree still grows as the root keeps references to every child
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    for fact in pending:
+        context = contexts.get(fact['context'])
+        if context is not None:
+            yield join_context(fact, context)
+
+
+def extract(source):
+    """ Parses a whole doc. Returns (contexts, facts): the context index (id -> context dict) and a list of every us-gaap fact """
+    contexts = {}
+    facts = list(iter_facts(source, contexts))
+    return contexts, facts
+
+
+def extract_records(source):
+    """ Like extract, but returns compact records made of plain strings and lists instead of dicts with date objects:
+            {'contexts': {id: [start, end, instant, dims]}, 'facts': [[concept, value, unit, decimals, context id]]}
+        Dates are iso strings. This is what the parse workers in pipeline.py send back, and what FactIndex saves to disk """
+    contexts = {}
+    facts = [[f['concept'], f['value'], f['unit'], f['decimals'], f['context']] for f in iter_facts(source, contexts)]
+    return {
+        'contexts': {cid: [_iso(c['start']), _iso(c['end']), _iso(c['instant']), c['dims']] for cid, c in contexts.items()},
+        'facts': facts,
+    }
+
+
+def _iso(d):
+    return d.isoformat() if d is not None else None
+
+
+
+######################################################################
+# benchmark: python xbrl_stream.py [doc]
+
+def _soup_path(xdoc):
+    """ what EdgarInstance + populate_reports used to do per filing: build a soup, then pull every context's start/end dates out of it """
+    import re
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(xdoc, features="xml")
+    periods = []
+    for c in soup.find_all('context'):
+        ed = c.find(re.compile(r'enddate', re.IGNORECASE))
+        sd = c.find(re.compile(r'startdate', re.IGNORECASE))
+        if ed is not None and sd is not None:
+            periods.append((sd.text, ed.text))
+    facts = [tag for tag in soup.find_all() if tag.prefix == "us-gaap"]
+    return len(periods), len(facts)
+
+
+def _stream_path(xdoc):
+    contexts, facts = extract(xdoc)
+    periods = [c for c in contexts.values() if c['start'] is not None]
+    return len(periods), len(facts)
+
+
+def _bench(name, fn, xdoc, runs=3):
+    """ best-of-runs time, plus peak python heap from tracemalloc (lxml's C side isn't counted, so the soup number is a lower bound) """
+    import tracemalloc
+
+    best = None
+    for _ in range(runs):
+        t = time.perf_counter()
+        result = fn(xdoc)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    fn(xdoc)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{name:<8} {best * 1000:8.1f}ms  peak {peak / 1024 ** 2:6.1f}MB  (duration contexts, us-gaap facts) = {result}")
+    return best
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "test.xbrl"
+    with open(path, "rb") as file:
+        xdoc = file.read()
+
+    print(f"{path}: {len(xdoc) / 1024 ** 2:.1f}MB")
+    soup_time = _bench("soup", _soup_path, xdoc)
+    stream_time = _bench("stream", _stream_path, xdoc)
+    print(f"stream is {soup_time / stream_time:.1f}x faster")
@@ -0,0 +1,30 @@
+"""
+    Rate limiting shared by everything that talks to an outside service: the SEC fetchers (edgar/sec_http.py) and the price source
+    for populate_prices (scrapers/price_source.py).
+"""
+
+import time
+import threading
+
+
+class RateLimiter:
+    """ Thread-safe token bucket. Holds up to 'burst' tokens, refilled at 'rate' tokens per second. acquire() blocks until a token is free """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
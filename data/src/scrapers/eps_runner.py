@@ -3,8 +3,14 @@ import eps_scraper as eps
 import psycopg2
 import psycopg2.extras
 import traceback
+import sys
+import os
 from logger import Logger
 
+sys.path.append(os.path.abspath(os.path.join(os.getcwd(), '..')))
+import database as db
+import bulk_load
+
 log = Logger("eps_runner")
 conn = None
 
@@ -125,39 +131,32 @@ def scrape_eps(tickers):
 
 def insert_eps(eps_data):
     """
-    This method writes all EPS data to the database
+    This method writes all EPS data to the database, all or nothing
     """
 
-    # grab database password from file
     conn = get_conn()
 
-    insert_query = """
-    INSERT INTO earnings_reports (
-        ticker,
-        date,
-        period_end,
-        eps_reported,
-        eps_estimate,
-        surprise,
-        surprice_percent,
-        time_of_report
-    )
-    VALUES (
-        %(ticker)s,
-        %(date)s,
-        %(period_end)s,
-        %(eps_reported)s,
-        %(eps_estimate)s,
-        %(surprise)s,
-        %(surprise_percent)s,
-        %(time_of_report)s
-    )
-    """
+    # the scraper calls it surprise_percent, the column is surprice_percent
+    rows = [{
+        'ticker': r['ticker'],
+        'date': r['date'],
+        'period_end': r['period_end'],
+        'eps_reported': r['eps_reported'],
+        'eps_estimate': r['eps_estimate'],
+        'surprise': r['surprise'],
+        'surprice_percent': r['surprise_percent'],
+        'time_of_report': r['time_of_report'],
+    } for r in eps_data]
 
     with conn.cursor() as curs:
         try:
-            for record in eps_data:
-                curs.execute(insert_query, record)
+            # one COPY + merge for the whole batch. Re-scraping a ticker updates it's existing reports instead of duplicating them
+            bulk_load.upsert(curs, "earnings_reports", rows, key=("ticker", "date"))
+
+            # recompute precomputed eps/price ratios, and drop cached api results for these tickers. Only delivered if the commit below goes through
+            for ticker in {record['ticker'] for record in eps_data}:
+                db.refresh_derived(curs, ticker)
+                db.notify_changed(curs, ticker)
 
             conn.commit()
         except Exception as e:
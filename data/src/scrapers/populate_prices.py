@@ -1,7 +1,6 @@
-import yfinance as yf
 import psycopg2 as pg2
 import pandas as pd
-import pandas_market_calendars as mcal
+import numpy as np
 import traceback
 import sys
 import os
@@ -10,9 +9,20 @@ from datetime import date, timedelta
 
 sys.path.append(os.path.abspath(os.path.join(os.getcwd(), '..')))
 import database as db
+import trading_calendar
+import price_source
+import bar_store
+import bulk_load
 
-nyse = mcal.get_calendar("NYSE")
-query = None
+cal = trading_calendar.get_calendar()
+store = bar_store.get_store()
+
+# every price_history column we fill in. Rows missing some offsets(e.g. a report from the last 30 days) have those loaded as NULL, so a
+# re-run replaces the whole row instead of leaving stale values in the columns it didn't have this time
+PH_KEY = ("ticker", "report_date")
+PH_COLUMNS = list(PH_KEY) + ["is_valid"] + [
+    f"{t}_{'plus' if o > 0 else 'minus'}_{abs(o)}" for t in ["open", "close", "high", "low", "volume"] for o in trading_calendar.OFFSETS
+]
 
 
 
@@ -39,52 +49,28 @@ def get_dates_for_ticker(ticker):
     return dates
 
 
-def find_relative_dates(date, offset):
-    if offset:
-        date = date - timedelta(days=1)
-
-    offsets = [1, 2, 3, 4, 5, 10, 20, 30]
-    rel_dates = []
-    end_date = date + timedelta(days=55)
-    sched = nyse.schedule(start_date=date.strftime("%Y-%m-%d"), end_date=end_date.strftime("%Y-%m-%d"))
-    
-    for o in offsets:
-        odate = sched.iloc[o].iloc[0].date()
-        rel_dates.append((o, odate))
-
-    
-    #REVERSE!
-    offsets = [-1, -2, -3, -4, -5, -10, -20, -30]
-    start_date = date - timedelta(days=50)
-    sched = nyse.schedule(start_date=start_date.strftime("%Y-%m-%d"), end_date=date.strftime("%Y-%m-%d"))
-
-    for o in offsets:
-        odate = sched.iloc[o].iloc[0].date()
-        rel_dates.append((o, odate))
-    
-    #sched[1] is the day after 'date'. For post-market this makes sense. for pre-market we set 'date' back by 1 day, so sched[1] is
-    #actually the same day as the report, which is what we want because thats the first trading session 'after' the report
-    
-    #sched.iloc[-1].iloc[0].date() is equal to date. The [-1] element is the original date passed into this func.
-    #that corresponds to the -1 offset, because if it was an after-hours report then the last day before the report
-    #IS the same day. If it was a pre-market
+def find_relative_dates(dates, before_open):
+    """
+        Finds the trading days around each earnings report (-30 to +30, see trading_calendar.OFFSETS), for all of a ticker's reports
+        in one pass over the precomputed NYSE calendar instead of two nyse.schedule() calls per report.
 
-    return rel_dates
+        Args:
+            dates (list): report dates
+            before_open (list): bool for each report, True if it was pre-market
 
+        Returns:
+            list with a list of (offset, date) for each report. Offsets past the end of the calendar are left out
+    """
+    rel = cal.relative_dates(dates, before_open)
 
-def get_prices_for_dates(ticker, dates, report_date):
-    yt = yf.Ticker(ticker)
+    # for post-market, +1 is the day after the report. For pre-market the date is set back by 1 day first, so +1 is actually the same
+    # day as the report, which is what we want because thats the first trading session 'after' the report.
+    # -1 is the last session before the report: the same day for an after-hours report, the day before for a pre-market one
+    return [[(o, d.item()) for o, d in zip(trading_calendar.OFFSETS, row) if not np.isnat(d)] for row in rel]
 
-    # yt.history end date isn't inclusive, have to increase our last date by 1 day to include it
-    end_date = dates[-1][1] + timedelta(days=1)
-    try:
-        prices = yt.history(start=dates[0][1].strftime("%Y-%m-%d"), end=end_date.strftime("%Y-%m-%d"))
-    except:
-        print("\n\n YAHOO RATE LIMIT REACHED. Pausing for 90s then continuing")
-        time.sleep(90)
-        return get_prices_for_dates(ticker, dates, report_date)
 
-    prices.index = prices.index.map(lambda d: d.date().strftime("%Y-%m-%d"))
+def get_prices_for_dates(ticker, dates, report_date, prices):
+    """ Slices the prices for each relative date out of the ticker's bars (from bar_store), no downloading here """
     price_data = []
     
     # NOTE :: I AM HERE! KeyError occurs if earnings report was less than 30 days ago because prices won't have an entry for the plus_30 values.
@@ -92,15 +78,16 @@ def get_prices_for_dates(ticker, dates, report_date):
     for d in dates:
         d_string = d[1].strftime("%Y-%m-%d")
         try:
+            bar = prices.loc[d_string]
             price_point = {
                 "ticker": ticker,
                 "report_date": report_date,
                 "offset": d[0],
-                "open": int(round(prices.loc[d_string]['Open'], 2) * 100),
-                "close": int(round(prices.loc[d_string]['Close'], 2) * 100),
-                "high": int(round(prices.loc[d_string]['High'], 2) * 100),
-                "low": int(round(prices.loc[d_string]['Low'], 2) * 100),
-                "volume": int(prices.loc[d_string]['Volume'])
+                "open": int(round(bar['Open'], 2) * 100),
+                "close": int(round(bar['Close'], 2) * 100),
+                "high": int(round(bar['High'], 2) * 100),
+                "low": int(round(bar['Low'], 2) * 100),
+                "volume": int(bar['Volume'])
             }
             price_data.append(price_point)
         except:
@@ -130,11 +117,11 @@ def get_db_entry(price_data):
     return entry
 
 
-def create_row(report, rel):
+def create_row(report, rel, prices):
     """
         (realizing this func needs to be renamed... in fact, the whole structure of this script has changed and needs to be reorganized)
-        Takes a single earnings report, and a list of relative dates, and retrieves necessary price data by calling
-        get_prices_for_dates. Then inserts all of that data into the database by calling insert_price_data
+        Takes a single earnings report, a list of relative dates and the ticker's price history, and picks out the necessary price data by
+        calling get_prices_for_dates. Returns the price_history row for it as a dict of column -> value
     """
     # Some entries don't have a valid time_of_report(e.g. After Hours or Before Open). I need an is_valid field to make it easier to find or ignore these entries
     is_valid = True
@@ -144,49 +131,72 @@ def create_row(report, rel):
     # sort dates so logs are easier to comprehend
     rel.sort(key=lambda d: d[0])
 
-    # grab price data from yfinance for the relative dates
-    price_data = get_prices_for_dates(report[0], rel, report[1])
+    # grab price data for the relative dates
+    price_data = get_prices_for_dates(report[0], rel, report[1], prices)
 
     # create entry dicts with correct format for db
     entry = get_db_entry(price_data)
     entry['is_valid'] = is_valid
 
-    # create query because I don't feel like hand writing it
-    global query
-    
-    # recreate query each time, because some keys may be missing in some cases and will require a different query
-    # this should probably be handled somewhere else but it was the last fix I noticed was necessary and it's
-    # not worth refactoring since this is a 1-time script to populate DB
-    query = f"""
-    INSERT INTO price_history ({', '.join(entry.keys())})
-    VALUES ({', '.join([f'%({key})s' for key in entry.keys()])})
+    return entry
+
+
+
+def get_dates_for_tickers(tickers):
     """
+    Retrieves the earnings report dates for a whole list of tickers in one query, for the parallel runner (price_runner.py)
 
-    return query, entry
+    Returns:
+        dict: ticker -> list of (ticker, date, time_of_report), same rows get_dates_for_ticker returns
+    """
+    conn = db.get_conn()
+    with conn.cursor() as curs:
+        curs.execute("SELECT ticker, date, time_of_report FROM earnings_reports WHERE ticker = ANY(%s)", (list(tickers),))
+        dates = {t: [] for t in tickers}
+        for row in curs.fetchall():
+            dates[row[0]].append(row)
+    conn.rollback() # just a read, don't leave the connection idle in a transaction
 
+    print(f"Retrieved {sum(len(d) for d in dates.values())} dates for {len(tickers)} tickers")
+    return dates
 
 
-def populate_prices(ticker):
+def build_rows(ticker, dates):
     """
-        Populates relative stock prices for all earnings report records for a given ticker
-        This is the root function called which handles every step to update all records for a given ticker
+        Builds the price_history rows for all of a ticker's earnings reports (steps 2-5 of populate_prices). Doesn't touch the db, so
+        the runner can build rows for several tickers at once on it's worker threads
 
-        1. Retrieve all earning report dates for the ticker [get_dates_for_ticker(ticker)]
-        2. for each ER date:
-            3. find all relative dates for the given date(-30d, +5d, etc) [find_relative_dates(report_date)]
-            4. insert stock price data(open, close, high, etc) for each relative date into DB [insert_rel_dates]:
-                5. insert_rel_dates first calls get_prices_for_dates(ticker, dates) to get prices at each date
-                6. then it will call insert_prices(price_data) where it inserts all prices for each date into the DB
+        Args:
+            ticker (str): ticker
+            dates (list): (ticker, date, time_of_report) for each report, from get_dates_for_ticker
+
+        Returns:
+            list of row dicts for bulk_load
     """
-        
-    dates = get_dates_for_ticker(ticker)
     # dates includes the date of each earnings report for the given ticker
     # for each date in dates, find all 'relative_dates'. 
     # add the closing price for each relative_date to the database WHERE ticker=ticker AND date=date (undo the -1 day for pre-market!)
     # column names will be minus_1_day, minus_5_day, plus_1_day, plus_30_day, etc...
 
+    all_rel_dates = find_relative_dates([d[1] for d in dates], [d[2] == "Before Open" for d in dates])
+
+    # bars come from the local bar store. Only days it doesn't have yet get downloaded, in one request covering every report's window
+    needed = [r[1] for rel in all_rel_dates for r in rel]
+    prices = None
+    if needed:
+        try:
+            store.update(ticker, min(needed), max(needed), price_source.get_history)
+        except Exception as e:
+            # couldn't get prices at all(delisted, bad symbol, still rate limited after all the retries). Skip the ticker, it's
+            # recorded as failed so it can be retried later
+            print(f"[Skipping Ticker] Unable to get prices for {ticker}: {e}")
+            with open("./ph_skips.txt", "a", encoding="utf-8") as file:
+                file.write(f"\n[Skipping Ticker] Unable to get prices for {ticker}: {e}\n")
+            raise
+        prices = bar_store.to_frame(store.read(ticker, min(needed), max(needed)))
+
     rows = []
-    for d in dates:
+    for d, rel_dates in zip(dates, all_rel_dates):
         if d[2] != "Before Open" and d[2] != "After Close":
             print(f"[Skipping Row] Invalid time_of_report for {ticker} - {d}")
             with open("./ph_skips.txt", "a", encoding="utf-8") as file:
@@ -195,54 +205,58 @@ def populate_prices(ticker):
             d = list(d)
             d[2] = 'Invalid'
             d = tuple(d)
-        
-        rel_dates = find_relative_dates(d[1], d[2] == "Before Open")
+
         try:
-            rows.append(create_row(d, rel_dates))
+            rows.append(create_row(d, rel_dates, prices))
         except:
             print(f"[Price Data Failed] Unable to create row: {d} - skipping", traceback.format_exc())    
             with open("./ph_errors.txt", "a", encoding="utf-8") as file:
                 file.write(f"\n\n[Price Data Failed] Unable to create row: {d} - skipping. {traceback.format_exc()}")
 
-    conn = db.get_conn()
-    with conn.cursor() as curs:
-        for r in rows: # each row is a tuple: (query, entry)
-            try:
-                curs.execute(r[0], r[1])
-            except:
-                conn.rollback()
-                print(f"!!!!!!!!!!!!!!Failed to insert row for {ticker}!", traceback.format_exc())
-                with open("./ph_errors.txt", "a", encoding="utf-8") as file:
-                    file.write(f"\n\n[Insertion Failed!] {ticker} - {r[1]} :: {r[0]}\n")
-                # if we fail to insert a row, just abort the whole ticker. Would rather have no data and deal with it afterwards than have to sort through incomplete data
-                break 
-        else:
-            print(f"Inserted {len(rows)} rows for ticker {ticker}!")
-        
-    conn.commit()
+    return rows
 
 
+def write_rows(curs, ticker, rows):
+    """
+        Loads a ticker's rows with one COPY + merge, and refreshes the derived tables for it. Doesn't commit: everything for the ticker
+        goes in the caller's transaction(or savepoint) so it's all or nothing
+    """
+    bulk_load.upsert(curs, "price_history", rows, key=PH_KEY, columns=PH_COLUMNS)
+    db.refresh_derived(curs, ticker) # recompute precomputed returns for this ticker
+    db.notify_changed(curs, ticker) # drop cached api results for this ticker once we commit
 
 
-def update_tickerlist(tickers):
+def populate_prices(ticker):
     """
-    After each ticker, update the tickerlist file with the remaining tickers. This makes it easier if there is a problem with the script,
-    I can just re-run it and it will pickup where it left off
+        Populates relative stock prices for all earnings report records for a given ticker
+        This is the root function called which handles every step to update all records for a given ticker.
+        To do a lot of tickers, use the parallel runner in price_runner.py instead of calling this in a loop
+
+        1. Retrieve all earning report dates for the ticker [get_dates_for_ticker(ticker)]
+        2. find all relative dates for every ER date at once(-30d, +5d, etc) [find_relative_dates(report_dates, before_open)]
+        3. get the ticker's daily bars covering all of those dates from the local bar store, downloading whatever it's missing in one
+           request [store.update(ticker, start, end, price_source.get_history)]
+        4. for each ER date:
+            5. create_row picks the prices(open, close, high, etc) for each relative date out of the bars [get_prices_for_dates]
+        6. load every row into the DB with one bulk upsert, all or nothing for the ticker [write_rows]
     """
-    print(f"Updating tickerlist before starting next ticker. {len(tickers)} tickers left.")
-    with open("./tickerlist.txt", "w", encoding="utf-8") as file:
-        file.write("\n".join(tickers))
-
-# get list of tickers that still need to be populated in db
-with open("./tickerlist.txt", "r", encoding="utf-8") as file:
-    tickers = [line.strip() for line in file]
-
-# loop through tickers 1 at a time. 
-print(f"Retrieving and inserting data for {len(tickers)} tickers. Starting with {tickers[-1]}")
-while len(tickers) > 0:
-   t = tickers.pop()
-   print(f"Next Ticker: {t}")
-   populate_prices(t)
-   update_tickerlist(tickers)
-
-db.close_conn()
\ No newline at end of file
+    rows = build_rows(ticker, get_dates_for_ticker(ticker))
+
+    conn = db.get_conn()
+    try:
+        # if anything fails, abort the whole ticker. Would rather have no data and deal with it afterwards than have to sort through incomplete data
+        with conn.cursor() as curs:
+            write_rows(curs, ticker, rows)
+        conn.commit()
+        print(f"Inserted {len(rows)} rows for ticker {ticker}!")
+    except:
+        conn.rollback()
+        print(f"!!!!!!!!!!!!!!Failed to insert rows for {ticker}!", traceback.format_exc())
+        with open("./ph_errors.txt", "a", encoding="utf-8") as file:
+            file.write(f"\n\n[Insertion Failed!] {ticker} - {len(rows)} rows :: {traceback.format_exc()}\n")
+
+
+
+if __name__ == "__main__":
+    import price_runner
+    price_runner.main()
@@ -0,0 +1,240 @@
+"""
+    Parallel runner for populate_prices.
+
+    Backfills price_history for a whole list of tickers:
+
+    - report dates for every pending ticker are read up front in one query
+    - a pool of worker threads builds each ticker's rows (calendar offsets, bar store updates, price downloads) N tickers at a time.
+      Downloads all go through price_source's shared rate limiter, so adding workers never means hammering Yahoo harder
+    - one writer thread owns the db connection and loads finished tickers in batches: one transaction per batch, with a savepoint per
+      ticker so a ticker that fails to load is rolled back on it's own and the rest of the batch still commits (all or nothing per ticker,
+      same as populate_prices)
+    - progress is kept in an append-only checkpoint file (one 'ticker<TAB>ok|failed' line per ticker, fsynced after each batch
+      commits) instead of rewriting tickerlist.txt after every ticker. Re-running skips everything already in the checkpoint, so a
+      crashed or stopped run just picks up where it left off
+
+    Usage (from data/src/scrapers, like the other scripts):
+        python price_runner.py                          # every ticker in tickerlist.txt that isn't done yet
+        python price_runner.py --workers 8 aapl msft    # just these
+        python price_runner.py --retry-failed           # also redo tickers that failed last time
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import populate_prices as pp
+import database as db # populate_prices already put data/src on the path
+
+
+TICKERLIST_PATH = "./tickerlist.txt"
+CHECKPOINT_PATH = "./ph_progress.txt"
+WORKERS = 4
+BATCH_TICKERS = 25 # tickers per db transaction
+FLUSH_SECONDS = 15 # commit a partial batch if nothing else has finished for this long
+
+
+class Checkpoint:
+    """ Append-only record of finished tickers. A line only gets written after the ticker's rows are committed """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.status = {} # ticker -> 'ok' or 'failed', the last line for a ticker wins
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.status[parts[0]] = parts[1]
+
+    def pending(self, tickers, retry_failed=False):
+        return [t for t in tickers if t not in self.status or (retry_failed and self.status[t] == "failed")]
+
+    def record(self, results):
+        """ results: list of (ticker, ok) """
+        with open(self.path, "a", encoding="utf-8") as file:
+            for ticker, ok in results:
+                file.write(f"{ticker}\t{'ok' if ok else 'failed'}\n")
+                self.status[ticker] = "ok" if ok else "failed"
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class WriterStopped(Exception):
+    """ The writer thread hit an error it can't recover from (e.g. the db is unreachable), so there's no point building more rows """
+
+
+class Writer(threading.Thread):
+    """ Owns the db connection. Takes (ticker, rows) from the workers and loads them in batches """
+
+    def __init__(self, checkpoint, total, batch_tickers=BATCH_TICKERS, flush_seconds=FLUSH_SECONDS):
+        super().__init__(name="price-writer", daemon=True)
+        self.checkpoint = checkpoint
+        self.total = total
+        self.batch_tickers = batch_tickers
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize=batch_tickers * 4) # workers block if the db falls behind, instead of piling rows up in memory
+        self.done = 0
+        self.failed = 0
+        self.error = None # set if the writer dies, so workers stop instead of blocking on a queue nobody reads
+
+    def check(self):
+        if self.error is not None:
+            raise WriterStopped(f"price writer stopped: {self.error!r}")
+
+    def put(self, ticker, rows):
+        """ rows=None means building the rows failed, it just gets recorded as failed """
+        while True:
+            self.check()
+            try:
+                self.queue.put((ticker, rows), timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.join()
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+            print("!!!!!!!!!!!!!!Price writer stopped, no more batches will be committed!", traceback.format_exc())
+
+    def _run(self):
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = False # nothing new, but flush what we have
+
+            if item is not None and item is not False:
+                batch.append(item)
+            if item is None or len(batch) >= self.batch_tickers or (batch and time.monotonic() - last_flush >= self.flush_seconds):
+                self.flush(batch)
+                batch = []
+                last_flush = time.monotonic()
+            if item is None:
+                return
+
+    def flush(self, batch):
+        if len(batch) == 0:
+            return
+        conn = db.get_conn()
+        results = []
+        try:
+            with conn.cursor() as curs:
+                for ticker, rows in batch:
+                    if rows is None:
+                        results.append((ticker, False))
+                        continue
+                    curs.execute("SAVEPOINT ticker_rows")
+                    try:
+                        pp.write_rows(curs, ticker, rows)
+                        curs.execute("RELEASE SAVEPOINT ticker_rows")
+                        results.append((ticker, True))
+                    except:
+                        # if we fail to insert a ticker, abort the whole ticker. Would rather have no data and deal with it afterwards
+                        curs.execute("ROLLBACK TO SAVEPOINT ticker_rows")
+                        results.append((ticker, False))
+                        print(f"!!!!!!!!!!!!!!Failed to insert rows for {ticker}!", traceback.format_exc())
+                        with open("./ph_errors.txt", "a", encoding="utf-8") as file:
+                            file.write(f"\n\n[Insertion Failed!] {ticker} - {len(rows)} rows :: {traceback.format_exc()}\n")
+            conn.commit()
+        except Exception:
+            # the commit itself (or the connection) failed. Nothing from this batch is recorded, so it all gets redone next run
+            print(f"!!!!!!!!!!!!!!Failed to commit a batch of {len(batch)} tickers!", traceback.format_exc())
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            if conn.closed:
+                db.reset_conn() # connection is gone, the next batch gets a new one from db.get_conn()
+            return
+
+        self.checkpoint.record(results)
+        self.done += len(results)
+        self.failed += sum(1 for _, ok in results if not ok)
+        print(f"Committed {len(results)} tickers. {self.done}/{self.total} done, {self.failed} failed")
+
+
+def run(tickers, workers=WORKERS, checkpoint=None):
+    """
+        Populates price_history for every ticker in 'tickers', 'workers' tickers at a time.
+
+        Returns:
+            (done, failed) counts
+    """
+    checkpoint = checkpoint or Checkpoint()
+    if len(tickers) == 0:
+        print("Nothing to do, every ticker is already in the checkpoint")
+        return 0, 0
+
+    start = time.perf_counter()
+    dates = pp.get_dates_for_tickers(tickers)
+    writer = Writer(checkpoint, len(tickers))
+    writer.start()
+
+    def build(ticker):
+        writer.check() # don't bother downloading anything if nothing will be written
+        try:
+            writer.put(ticker, pp.build_rows(ticker, dates[ticker]))
+        except WriterStopped:
+            raise
+        except Exception:
+            print(f"[Price Data Failed] Unable to build rows for {ticker}", traceback.format_exc())
+            with open("./ph_errors.txt", "a", encoding="utf-8") as file:
+                file.write(f"\n\n[Price Data Failed] Unable to build rows for {ticker}. {traceback.format_exc()}")
+            writer.put(ticker, None)
+
+    print(f"Retrieving and inserting data for {len(tickers)} tickers with {workers} workers")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(build, tickers))
+    finally:
+        writer.close() # commits whatever finished, even if we're stopping early
+    writer.check()
+
+    print(f"Done: {writer.done} tickers ({writer.failed} failed) in {time.perf_counter() - start:.0f}s")
+    return writer.done, writer.failed
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    workers = WORKERS
+    if "--workers" in argv:
+        workers = int(argv[argv.index("--workers") + 1])
+        argv = argv[:argv.index("--workers")] + argv[argv.index("--workers") + 2:]
+    tickers = [a for a in argv if not a.startswith("--")]
+
+    if not tickers:
+        # tickers that still need to be populated in db
+        with open(TICKERLIST_PATH, "r", encoding="utf-8") as file:
+            tickers = [line.strip() for line in file if line.strip()]
+
+    checkpoint = Checkpoint()
+    pending = checkpoint.pending(tickers, retry_failed="--retry-failed" in argv)
+    print(f"{len(tickers) - len(pending)} of {len(tickers)} tickers already done according to {checkpoint.path}")
+
+    try:
+        run(pending, workers, checkpoint)
+    finally:
+        db.close_conn()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+    Where populate_prices gets it's daily bars from.
+
+    get_history returns one contiguous daily OHLCV series for a ticker, so all of a ticker's earnings reports can be sliced out of a
+    single download instead of one yfinance request per report.
+
+    By default the bars come from Yahoo, at most MAX_REQUESTS_PER_SECOND across every thread. Set EARNI_PRICE_DIR to a folder of
+    csvs (one per ticker, named like aapl.csv, in the same layout yfinance's history().to_csv() writes: Date,Open,High,Low,Close,
+    Volume,...) to use those instead, e.g. a small fixture for testing populate_prices without hitting Yahoo at all.
+
+    Usage:
+        prices = price_source.get_history("aapl", date(2020, 1, 1), date(2021, 1, 1))
+        prices.loc["2020-06-01"]["Close"]
+"""
+
+import os
+import sys
+import time
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+import pandas as pd
+import yfinance as yf
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from rate_limit import RateLimiter
+
+
+PRICE_DIR = os.environ.get("EARNI_PRICE_DIR")
+MAX_REQUESTS_PER_SECOND = float(os.environ.get("EARNI_PRICE_RATE", 2)) # shared by every thread downloading prices
+RATE_LIMIT_PAUSE = 90 # seconds to wait when yahoo starts refusing requests
+MAX_RATE_LIMIT_PAUSES = 10 # rate limited this many times in a row for one download and it gives up
+DOWNLOAD_RETRIES = 2 # retries for any other error
+RETRY_DELAY = 5
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+ACTIONS = ["Dividends", "Stock Splits"] # passed through when the source has them, bar_store needs them to know when to refetch
+
+limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+_paused_until = 0 # when one download gets rate limited, every thread waits out the pause instead of each one finding out on it's own
+_pause_lock = threading.Lock()
+
+
+def _wait_for_pause():
+    while True:
+        with _pause_lock:
+            wait = _paused_until - time.monotonic()
+        if wait <= 0:
+            return
+        time.sleep(wait)
+
+
+def _is_rate_limit(e):
+    """ yfinance raises YFRateLimitError for 429s (older versions just pass the http error through) """
+    return type(e).__name__ == "YFRateLimitError" or "Too Many Requests" in str(e) or "429" in str(e)
+
+
+def _download(ticker, start, end):
+    global _paused_until
+    # yt.history end date isn't inclusive, have to increase our last date by 1 day to include it
+    end = end + timedelta(days=1)
+    rate_limited = 0
+    failures = 0
+    while True:
+        _wait_for_pause()
+        limiter.acquire()
+        try:
+            return yf.Ticker(ticker).history(start=start.strftime("%Y-%m-%d"), end=end.strftime("%Y-%m-%d"))
+        except Exception as e:
+            if _is_rate_limit(e):
+                # yahoo is refusing everyone, not just this ticker, so every thread waits
+                rate_limited += 1
+                if rate_limited > MAX_RATE_LIMIT_PAUSES:
+                    raise
+                print(f"\n\n YAHOO RATE LIMIT REACHED. Pausing for {RATE_LIMIT_PAUSE}s then continuing")
+                with _pause_lock:
+                    _paused_until = max(_paused_until, time.monotonic() + RATE_LIMIT_PAUSE)
+            else:
+                # something wrong with this ticker (delisted, bad symbol, garbage response). Retry a couple times in case it was a blip,
+                # then give up on it. Only this thread waits
+                failures += 1
+                if failures > DOWNLOAD_RETRIES:
+                    raise
+                time.sleep(RETRY_DELAY * failures)
+
+
+def _read_csv(ticker, start, end, directory):
+    path = os.path.join(directory, f"{ticker.lower()}.csv")
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=COLUMNS)
+    prices = pd.read_csv(path, index_col=0)
+    prices.index = pd.to_datetime(prices.index.str[:10]) # yfinance writes timestamps with a tz offset, only the day matters
+    return prices.loc[start.strftime("%Y-%m-%d"):end.strftime("%Y-%m-%d")]
+
+
+def get_history(ticker, start, end, directory=PRICE_DIR):
+    """
+        Gets daily bars for a ticker.
+
+        Args:
+            ticker (str): ticker
+            start (date): first day needed
+            end (date): last day needed (inclusive)
+            directory (str): folder of local csvs to read instead of downloading. Defaults to EARNI_PRICE_DIR
+
+        Returns:
+            DataFrame of Open/High/Low/Close/Volume (plus Dividends/Stock Splits when the source has them) indexed by 'YYYY-MM-DD'
+            strings. Prices are split and dividend adjusted as of the download, like yfinance always gives them. Empty if there's no data
+    """
+    if directory:
+        prices = _read_csv(ticker, start, end, directory)
+    else:
+        prices = _download(ticker, start, end)
+
+    prices = prices[[c for c in COLUMNS + ACTIONS if c in prices.columns]]
+    prices.index = prices.index.map(lambda d: d.date().strftime("%Y-%m-%d"))
+    return prices
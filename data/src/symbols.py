@@ -0,0 +1,190 @@
+"""
+    Symbol master: the one place that maps tickers <-> CIKs (and company names).
+
+    The map is loaded once into dicts and shared by everything in the process, instead of each caller re-opening and scanning cikmap.txt
+    line by line on every lookup. Lookups go both ways (ticker -> cik and cik -> ticker), and if the file changes on disk the map is
+    reloaded on the next lookup, so long running processes pick up new tickers without a restart.
+
+    When the earni db is set up, rows from the companies table are layered on top of the file (they win on conflicts, and they're
+    where the names come from).
+
+    Usage:
+        import symbols
+        symbols.get_cik("aapl")      # 320193
+        symbols.get_ticker(320193)   # 'aapl'
+"""
+
+import os
+import time
+import threading
+import logging
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+CIKMAP_PATH = Path(__file__).resolve().parent / "edgar" / "cikmap.txt"
+RELOAD_CHECK = 5 # seconds between checks of the file's mtime. Keeps lookups in a hot loop from stat()ing the file every call
+
+
+def normalize(ticker):
+    """ tickers are stored lowercase, with share classes written like the SEC does (brk-b, not BRK.B) """
+    return ticker.strip().lower().replace(".", "-")
+
+
+class SymbolMaster:
+    def __init__(self, path=CIKMAP_PATH, use_db=True):
+        """
+            Args:
+                path (str): ticker/cik file. One company per line: 'ticker cik' (space or tab separated), optionally followed by the name
+                use_db (bool): also load the companies table, if the db is reachable
+        """
+        self.path = Path(path)
+        self.use_db = use_db
+        self.lock = threading.Lock()
+
+        self.by_ticker = {}  # ticker -> cik
+        self.by_cik = {}     # cik -> [tickers], first one is the primary
+        self.names = {}      # ticker -> name
+        self.mtime = None
+        self.checked = 0
+
+        self.reload()
+
+
+    def _read_file(self, by_ticker, names):
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                parts = line.split(None, 2)
+                if len(parts) < 2 or not parts[1].isdigit():
+                    continue
+                ticker = normalize(parts[0])
+                by_ticker[ticker] = int(parts[1])
+                if len(parts) == 3:
+                    names[ticker] = parts[2].strip()
+
+
+    def _read_db(self, by_ticker, names):
+        """ overlays the companies table. Only tried if the db has been set up (the password file exists), and any failure just
+            means we run off the file """
+        import database as db
+        if not db.pwpath.exists():
+            return
+
+        # own connection, not the shared one. A hot reload can happen in the middle of someone else's transaction on it
+        conn = None
+        try:
+            conn = db.connect()
+            with conn.cursor() as curs:
+                curs.execute("SELECT ticker, cik, name FROM companies")
+                rows = curs.fetchall()
+        except Exception as e:
+            logger.warning(f"Couldn't load symbols from the companies table, using {self.path.name} only: {e}")
+            self.use_db = False # don't retry (and wait on a dead db again) on every hot reload
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for ticker, cik, name in rows:
+            ticker = normalize(ticker)
+            by_ticker[ticker] = int(cik)
+            if name:
+                names[ticker] = name
+
+
+    def reload(self):
+        """ Re-reads the file (and the companies table). The new maps are built off to the side then swapped in, so lookups running
+            on other threads never see a half loaded map """
+        with self.lock:
+            by_ticker = {}
+            names = {}
+            mtime = self.path.stat().st_mtime if self.path.exists() else None
+            if mtime is not None:
+                self._read_file(by_ticker, names)
+            if self.use_db:
+                self._read_db(by_ticker, names)
+
+            by_cik = {}
+            for ticker, cik in by_ticker.items():
+                by_cik.setdefault(cik, []).append(ticker)
+
+            self.by_ticker, self.by_cik, self.names = by_ticker, by_cik, names
+            self.mtime = mtime
+            self.checked = time.monotonic()
+
+        logger.info(f"Loaded {len(by_ticker)} symbols ({len(by_cik)} ciks)")
+
+
+    def _check_reload(self):
+        now = time.monotonic()
+        if now - self.checked < RELOAD_CHECK:
+            return
+        self.checked = now
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return
+        if mtime != self.mtime:
+            logger.info(f"{self.path.name} changed, reloading symbols")
+            self.reload()
+
+
+    def cik(self, ticker):
+        """ Returns the cik for a ticker as an int, or None if we don't know it """
+        self._check_reload()
+        return self.by_ticker.get(normalize(ticker))
+
+
+    def ticker(self, cik):
+        """ Returns the primary ticker for a cik, or None """
+        self._check_reload()
+        tickers = self.by_cik.get(int(cik))
+        return tickers[0] if tickers else None
+
+
+    def tickers(self, cik):
+        """ Returns every ticker for a cik (companies with several share classes have more than one) """
+        self._check_reload()
+        return list(self.by_cik.get(int(cik), []))
+
+
+    def name(self, ticker):
+        self._check_reload()
+        return self.names.get(normalize(ticker))
+
+
+    def items(self):
+        """ (ticker, cik) pairs for every symbol """
+        self._check_reload()
+        return list(self.by_ticker.items())
+
+
+    def __len__(self):
+        return len(self.by_ticker)
+
+
+    def __contains__(self, ticker):
+        return self.cik(ticker) is not None
+
+
+
+_master = None
+_master_lock = threading.Lock()
+
+def get_master():
+    """ Returns the shared SymbolMaster, loading it on first use """
+    global _master
+    if _master is None:
+        with _master_lock:
+            if _master is None:
+                _master = SymbolMaster(os.environ.get("EARNI_CIKMAP", CIKMAP_PATH))
+    return _master
+
+
+def get_cik(ticker):
+    return get_master().cik(ticker)
+
+
+def get_ticker(cik):
+    return get_master().ticker(cik)
@@ -0,0 +1,121 @@
+"""
+    NYSE trading calendar as a sorted numpy array, built once per process.
+
+    Finding the trading days around an earnings report used to mean two nyse.schedule() calls per report, each building a fresh
+    DataFrame just to pick 16 rows out of it. Here every trading day from START through about a year from now is loaded once into a
+    datetime64[D] array, and offsets for any number of reports are found with one searchsorted over that array.
+
+    Offsets work the same way find_relative_dates always has:
+        +n  the n-th trading day after the report date (the first trading day on or after it is +0)
+        -n  the n-th trading day counting back from the report date, where -1 is the last trading day on or before it
+    Pre-market reports are moved back a day first, so +1 is the session on the day of the report.
+
+    Usage:
+        import trading_calendar
+        cal = trading_calendar.get_calendar()
+        cal.relative_dates(report_dates, before_open)    # (n reports, len(OFFSETS)) array of datetime64[D], NaT past the calendar's end
+        cal.offset(date, 5)                              # a single date
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas_market_calendars as mcal
+
+
+START = "1990-01-01"
+LOOKAHEAD = 400 # days past today to include, so +30 offsets for recent reports resolve to real (future) trading days
+OFFSETS = (-30, -20, -10, -5, -4, -3, -2, -1, 1, 2, 3, 4, 5, 10, 20, 30) # the price_history columns
+
+NEW_YORK = ZoneInfo("America/New_York")
+SESSION_DONE = (16, 30) # NY time a session's daily bar is final. Regular close is 16:00, this leaves time for the source to settle it
+
+NaT = np.datetime64("NaT", "D")
+
+
+class TradingCalendar:
+    def __init__(self, days):
+        """
+            Args:
+                days (array-like): every trading day, sorted. Anything np.array(..., dtype="datetime64[D]") accepts
+        """
+        self.days = np.asarray(days, dtype="datetime64[D]")
+        self.positions = {d: i for i, d in enumerate(self.days.tolist())} # date -> index into days
+
+    @classmethod
+    def load(cls, start=START, end=None, calendar="NYSE"):
+        end = end or (date.today() + timedelta(days=LOOKAHEAD)).isoformat()
+        days = mcal.get_calendar(calendar).valid_days(start_date=start, end_date=end)
+        return cls(np.array(days.date, dtype="datetime64[D]"))
+
+    def __len__(self):
+        return len(self.days)
+
+    def __contains__(self, d):
+        return d in self.positions
+
+    def index_of(self, d):
+        """ position of a trading day in 'days', or None if it isn't one """
+        return self.positions.get(d)
+
+
+    def offset_positions(self, dates, before_open=False, offsets=OFFSETS):
+        """
+            Finds the positions in 'days' of every offset for every date, in one pass.
+
+            Args:
+                dates (array-like): report dates (datetime.date, 'YYYY-MM-DD' strings or datetime64)
+                before_open (bool or array of bools): pre-market report(s), which are moved back a day first
+                offsets (tuple): trading day offsets, see the module docstring
+
+            Returns:
+                (positions, valid): two (len(dates), len(offsets)) arrays. positions is an int array of indexes into 'days', valid is
+                False wherever the offset falls outside the calendar (positions are clipped to 0 there)
+        """
+        dates = np.asarray(dates, dtype="datetime64[D]") - np.asarray(before_open, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        # first trading day on or after each date is +0, the last one on or before it is -1. For a trading day they're the same day,
+        # for a weekend/holiday they're the days on either side of it
+        after = np.searchsorted(self.days, dates, side="left")[:, None]
+        before = np.searchsorted(self.days, dates, side="right")[:, None]
+        positions = np.where(offsets >= 0, after + offsets, before + offsets)
+
+        valid = (positions >= 0) & (positions < len(self.days)) & ~np.isnat(dates)[:, None]
+        return np.where(valid, positions, 0), valid
+
+    def relative_dates(self, dates, before_open=False, offsets=OFFSETS):
+        """ Same as offset_positions, but returns the trading days themselves: a (len(dates), len(offsets)) datetime64[D] array with
+            NaT for offsets outside the calendar """
+        positions, valid = self.offset_positions(dates, before_open, offsets)
+        return np.where(valid, self.days[positions], NaT)
+
+    def last_completed(self, now=None):
+        """ The most recent trading day whose session has finished (as of 'now', default the current time in New York), as a
+            datetime.date. Today only counts once it's past SESSION_DONE, so nothing reads a partial bar for a session that's still open """
+        now = now or datetime.now(NEW_YORK)
+        today = np.datetime64(now.date(), "D")
+        done_today = (now.hour, now.minute) >= SESSION_DONE
+        pos = np.searchsorted(self.days, today, side="right" if done_today else "left") - 1
+        return self.days[pos].item() if pos >= 0 else None
+
+    def offset(self, d, n, before_open=False):
+        """ The trading day 'n' days from 'd' as a datetime.date, or None if that's outside the calendar """
+        rel = self.relative_dates([d], before_open, (n,))[0, 0]
+        return None if np.isnat(rel) else rel.item()
+
+
+
+_calendar = None
+_calendar_lock = threading.Lock()
+
+def get_calendar():
+    """ Returns the shared NYSE calendar, building it on first use """
+    global _calendar
+    if _calendar is None:
+        with _calendar_lock:
+            if _calendar is None:
+                _calendar = TradingCalendar.load()
+    return _calendar
@@ -139,3 +139,7 @@ else
     );"
 
 fi
+
+# indexes and any other schema changes made after the initial tables live in db/migrations. Safe to re-run, applied migrations are skipped
+echo "Applying migrations"
+python3 "$(dirname "$0")/migrate.py" up
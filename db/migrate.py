@@ -0,0 +1,171 @@
+"""
+    Versioned schema migrations for the earni db. create_db.sh creates the base tables, everything after that lives in db/migrations/
+    as numbered .sql files (001_xxx.sql, 002_xxx.sql, ...) that get applied in order, each in it's own transaction. Applied versions are
+    recorded in the schema_migrations table so re-running is always safe.
+
+    Usage (from anywhere):
+        python db/migrate.py status   # list migrations and whether they've been applied
+        python db/migrate.py up       # apply every pending migration
+        python db/migrate.py check    # EXPLAIN the queries DatabaseHelper generates and make sure they actually use the indexes
+"""
+
+import sys
+import re
+import json
+from pathlib import Path
+import psycopg2
+
+_db_dir = Path(__file__).resolve().parent
+_migrations_dir = _db_dir / "migrations"
+
+# the api package has the connection settings and the query builder we want to check plans for
+sys.path.append(str(_db_dir.parent))
+from api import db_pool
+from api.db_helpers import DatabaseHelper
+
+
+def get_conn():
+    return psycopg2.connect(db_pool.get_dsn())
+
+
+def get_migrations():
+    """ Returns a sorted list of (version, name, path) for every migration file """
+    migrations = []
+    for path in _migrations_dir.glob("*.sql"):
+        match = re.match(r"^(\d+)_(.+)\.sql$", path.name)
+        if match is None:
+            print(f"[migrate] Skipping {path.name}, migration files need to be named like 001_description.sql")
+            continue
+        migrations.append((int(match.group(1)), match.group(2), path))
+
+    migrations.sort()
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {_migrations_dir}: {versions}")
+
+    return migrations
+
+
+def get_applied(conn):
+    with conn.cursor() as curs:
+        curs.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )""")
+        curs.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in curs.fetchall()}
+    conn.commit()
+    return applied
+
+
+def status(conn):
+    applied = get_applied(conn)
+    for version, name, _ in get_migrations():
+        state = "applied" if version in applied else "PENDING"
+        print(f"{version:03d} {name:<40} {state}")
+
+
+def up(conn):
+    """ Applies every pending migration in order. Stops at the first failure, and that migration is rolled back completely """
+    applied = get_applied(conn)
+    pending = [m for m in get_migrations() if m[0] not in applied]
+    if len(pending) == 0:
+        print("[migrate] Nothing to do, db is up to date")
+        return
+
+    for version, name, path in pending:
+        print(f"[migrate] Applying {version:03d}_{name}")
+        sql = path.read_text(encoding="utf-8")
+        try:
+            with conn.cursor() as curs:
+                curs.execute(sql)
+                curs.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"[migrate] Migration {version:03d}_{name} failed, rolled back. Later migrations were not applied")
+            raise
+
+    print(f"[migrate] Applied {len(pending)} migrations")
+
+
+
+# representative queries from DatabaseHelper and the index each one should be able to use.
+# (description, function that builds the query on a DatabaseHelper, index name expected in the plan)
+_plan_checks = [
+    ("join on (ticker, date)",
+        lambda dbh: dbh.select(["ticker", "eps_reported"]).where_value_is("ticker", "=", "aapl"),
+        "earnings_reports_ticker_date_key"), # was earnings_reports_ticker_date_idx before 006 made it unique
+    ("eps surprise threshold",
+        lambda dbh: dbh.select(["ticker", "eps_diff"]).where_value_is("eps_diff", ">", 0.08),
+        "earnings_reports_eps_diff_idx"), # back on earnings_reports since 009
+    ("post-earnings price ratio",
+        lambda dbh: dbh.select(["ticker", "close_plus_1"]).where_price_diff(1, -1, percent=1.2),
+        "price_returns_return_plus_1_minus_1_idx"),
+    ("pre-earnings drawdown",
+        lambda dbh: dbh.select(["ticker", "close_minus_1"]).where_price_diff(-1, -10, percent=1.1),
+        "price_returns_return_minus_1_minus_10_idx"),
+    ("report date range",
+        lambda dbh: dbh.select(["ticker", "report_date"]).where_value_is("report_date", ">=", "2024-01-01"),
+        "price_history_report_date_brin"),
+]
+
+
+def _plan_indexes(plan):
+    """ collects every index name used anywhere in an EXPLAIN (FORMAT JSON) plan """
+    found = set()
+    if "Index Name" in plan:
+        found.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found |= _plan_indexes(child)
+    return found
+
+
+def check(conn):
+    """
+        EXPLAINs the queries in _plan_checks and makes sure each one can use it's index. Sequential scans are disabled for the session,
+        otherwise a small or freshly loaded table would get a seq scan no matter what and every check would 'fail'. So this checks that the
+        generated sql is *able* to use the index, it doesn't say the planner will always prefer it.
+
+        Returns:
+            bool: True if every check passed
+    """
+    dbh = DatabaseHelper()
+    failed = 0
+    with conn.cursor() as curs:
+        curs.execute("SET enable_seqscan = off")
+        for desc, build, index in _plan_checks:
+            sql, params = build(dbh).build()
+            curs.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = curs.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_indexes(plan[0]["Plan"])
+
+            if index in used:
+                print(f"[check] OK    {desc}: uses {index}")
+            else:
+                failed += 1
+                print(f"[check] FAIL  {desc}: expected {index}, plan used {sorted(used) or 'no indexes'}\n        {sql}")
+    conn.rollback()
+
+    print(f"[check] {len(_plan_checks) - failed}/{len(_plan_checks)} checks passed")
+    return failed == 0
+
+
+
+if __name__ == "__main__":
+    commands = {"status": status, "up": up, "check": check}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        print(f"Usage: python migrate.py [{'|'.join(commands)}]")
+        sys.exit(2)
+
+    conn = get_conn()
+    try:
+        ok = commands[sys.argv[1]](conn)
+    finally:
+        conn.close()
+
+    sys.exit(1 if ok is False else 0)
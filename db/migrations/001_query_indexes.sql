@@ -0,0 +1,32 @@
+-- 001 :: indexes for the query patterns DatabaseHelper generates
+--
+-- every DatabaseHelper query joins price_history to earnings_reports on (ticker, date). price_history's primary key already covers
+-- (ticker, report_date), but earnings_reports only had it's serial report_id so the join side had nothing to use.
+CREATE INDEX IF NOT EXISTS earnings_reports_ticker_date_idx ON earnings_reports (ticker, date);
+
+-- eps surprise filters: where_value_is('eps_diff', ...) compiles to (er.eps_reported - er.eps_estimate) <op> value
+CREATE INDEX IF NOT EXISTS earnings_reports_eps_diff_idx ON earnings_reports ((eps_reported - eps_estimate));
+
+-- price ratio filters: where_price_diff(a, b, percent=p) compiles to (ph.<a>::float8 / NULLIF(ph.<b>, 0)) > p
+-- the expressions here have to match db_helpers.where_price_diff exactly or the planner won't use them.
+-- post-earnings moves are all measured against close_minus_1, plus the pre-earnings drawdowns from the readme (minus_1 vs minus_5/10/20/30)
+CREATE INDEX IF NOT EXISTS price_history_close_plus_1_ratio_idx ON price_history (((close_plus_1)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_2_ratio_idx ON price_history (((close_plus_2)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_3_ratio_idx ON price_history (((close_plus_3)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_4_ratio_idx ON price_history (((close_plus_4)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_5_ratio_idx ON price_history (((close_plus_5)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_10_ratio_idx ON price_history (((close_plus_10)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_20_ratio_idx ON price_history (((close_plus_20)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_plus_30_ratio_idx ON price_history (((close_plus_30)::float8 / NULLIF(close_minus_1, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_minus_1_minus_5_ratio_idx ON price_history (((close_minus_1)::float8 / NULLIF(close_minus_5, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_minus_1_minus_10_ratio_idx ON price_history (((close_minus_1)::float8 / NULLIF(close_minus_10, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_minus_1_minus_20_ratio_idx ON price_history (((close_minus_1)::float8 / NULLIF(close_minus_20, 0)));
+CREATE INDEX IF NOT EXISTS price_history_close_minus_1_minus_30_ratio_idx ON price_history (((close_minus_1)::float8 / NULLIF(close_minus_30, 0)));
+
+-- report date ranges. BRIN indexes are tiny, but they only help as much as the table is physically ordered by date.
+-- the scrapers load ticker by ticker, so CLUSTER the tables on these columns after a big backfill if range scans get slow
+CREATE INDEX IF NOT EXISTS price_history_report_date_brin ON price_history USING brin (report_date);
+CREATE INDEX IF NOT EXISTS earnings_reports_date_brin ON earnings_reports USING brin (date);
+
+ANALYZE earnings_reports;
+ANALYZE price_history;
@@ -0,0 +1,107 @@
+-- 002 :: precomputed returns and eps surprise ratios
+--
+-- the heavy screens all compute close_plus_N / close_minus_M (and eps_reported - eps_estimate) for every row on every query.
+-- price_returns holds those values precomputed for the standard offset pairs, one row per price_history row, so filtering on them
+-- is an index scan on a plain column. DatabaseHelper routes matching fields and where_price_diff calls here automatically
+-- (see _return_pairs in api/db_helpers.py, which has to stay in sync with the columns below).
+--
+-- rows are refreshed per ticker with refresh_price_returns(ticker), which populate_prices and insert_eps call in the same
+-- transaction as their inserts (data/src/database.py refresh_derived)
+
+CREATE TABLE IF NOT EXISTS price_returns (
+    ticker VARCHAR(10) NOT NULL,
+    report_date DATE NOT NULL,
+
+    eps_diff NUMERIC,
+    eps_surprise_ratio DOUBLE PRECISION,
+    return_plus_1_minus_1 DOUBLE PRECISION,
+    return_plus_2_minus_1 DOUBLE PRECISION,
+    return_plus_3_minus_1 DOUBLE PRECISION,
+    return_plus_4_minus_1 DOUBLE PRECISION,
+    return_plus_5_minus_1 DOUBLE PRECISION,
+    return_plus_10_minus_1 DOUBLE PRECISION,
+    return_plus_20_minus_1 DOUBLE PRECISION,
+    return_plus_30_minus_1 DOUBLE PRECISION,
+    return_plus_2_plus_1 DOUBLE PRECISION,
+    return_plus_3_plus_1 DOUBLE PRECISION,
+    return_plus_4_plus_1 DOUBLE PRECISION,
+    return_plus_5_plus_1 DOUBLE PRECISION,
+    return_plus_10_plus_1 DOUBLE PRECISION,
+    return_plus_20_plus_1 DOUBLE PRECISION,
+    return_plus_30_plus_1 DOUBLE PRECISION,
+    return_minus_1_minus_5 DOUBLE PRECISION,
+    return_minus_1_minus_10 DOUBLE PRECISION,
+    return_minus_1_minus_20 DOUBLE PRECISION,
+    return_minus_1_minus_30 DOUBLE PRECISION,
+
+    PRIMARY KEY (ticker, report_date)
+);
+
+CREATE OR REPLACE FUNCTION refresh_price_returns(p_ticker VARCHAR) RETURNS void AS $$
+    DELETE FROM price_returns WHERE ticker = p_ticker;
+
+    INSERT INTO price_returns (ticker, report_date, eps_diff, eps_surprise_ratio, return_plus_1_minus_1, return_plus_2_minus_1, return_plus_3_minus_1, return_plus_4_minus_1, return_plus_5_minus_1, return_plus_10_minus_1, return_plus_20_minus_1, return_plus_30_minus_1, return_plus_2_plus_1, return_plus_3_plus_1, return_plus_4_plus_1, return_plus_5_plus_1, return_plus_10_plus_1, return_plus_20_plus_1, return_plus_30_plus_1, return_minus_1_minus_5, return_minus_1_minus_10, return_minus_1_minus_20, return_minus_1_minus_30)
+    SELECT
+        ph.ticker,
+        ph.report_date,
+        er.eps_reported - er.eps_estimate,
+        er.eps_reported::float8 / NULLIF(er.eps_estimate, 0),
+        ph.close_plus_1::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_2::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_3::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_4::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_5::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_10::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_20::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_30::float8 / NULLIF(ph.close_minus_1, 0),
+        ph.close_plus_2::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_3::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_4::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_5::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_10::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_20::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_plus_30::float8 / NULLIF(ph.close_plus_1, 0),
+        ph.close_minus_1::float8 / NULLIF(ph.close_minus_5, 0),
+        ph.close_minus_1::float8 / NULLIF(ph.close_minus_10, 0),
+        ph.close_minus_1::float8 / NULLIF(ph.close_minus_20, 0),
+        ph.close_minus_1::float8 / NULLIF(ph.close_minus_30, 0)
+    FROM price_history ph JOIN earnings_reports er ON ph.ticker = er.ticker AND ph.report_date = er.date
+    WHERE ph.ticker = p_ticker;
+$$ LANGUAGE sql;
+
+-- backfill everything that's already loaded
+SELECT refresh_price_returns(t.ticker) FROM (SELECT DISTINCT ticker FROM price_history) t;
+
+-- index the columns screens filter on directly. The rebound pairs (plus_N vs plus_1) are usually combined with a post-earnings
+-- filter, so they don't get their own indexes
+CREATE INDEX IF NOT EXISTS price_returns_eps_diff_idx ON price_returns (eps_diff);
+CREATE INDEX IF NOT EXISTS price_returns_eps_surprise_ratio_idx ON price_returns (eps_surprise_ratio);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_1_minus_1_idx ON price_returns (return_plus_1_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_2_minus_1_idx ON price_returns (return_plus_2_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_3_minus_1_idx ON price_returns (return_plus_3_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_4_minus_1_idx ON price_returns (return_plus_4_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_5_minus_1_idx ON price_returns (return_plus_5_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_10_minus_1_idx ON price_returns (return_plus_10_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_20_minus_1_idx ON price_returns (return_plus_20_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_plus_30_minus_1_idx ON price_returns (return_plus_30_minus_1);
+CREATE INDEX IF NOT EXISTS price_returns_return_minus_1_minus_5_idx ON price_returns (return_minus_1_minus_5);
+CREATE INDEX IF NOT EXISTS price_returns_return_minus_1_minus_10_idx ON price_returns (return_minus_1_minus_10);
+CREATE INDEX IF NOT EXISTS price_returns_return_minus_1_minus_20_idx ON price_returns (return_minus_1_minus_20);
+CREATE INDEX IF NOT EXISTS price_returns_return_minus_1_minus_30_idx ON price_returns (return_minus_1_minus_30);
+
+-- the expression indexes from 001 covered exactly the pairs that are routed to price_returns now, so they'd only slow down inserts
+DROP INDEX IF EXISTS earnings_reports_eps_diff_idx;
+DROP INDEX IF EXISTS price_history_close_plus_1_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_2_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_3_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_4_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_5_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_10_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_20_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_plus_30_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_minus_1_minus_5_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_minus_1_minus_10_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_minus_1_minus_20_ratio_idx;
+DROP INDEX IF EXISTS price_history_close_minus_1_minus_30_ratio_idx;
+
+ANALYZE price_returns;
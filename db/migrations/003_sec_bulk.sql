@@ -0,0 +1,34 @@
+-- 003 :: tables for the SEC bulk archive ingest (data/src/edgar/bulk_ingest.py)
+--
+-- sec_filings is the filing index from submissions.zip, one row per filing. sec_quarterly holds quarterly (~90 day) EPS and revenue
+-- facts from companyfacts.zip, one row per cik/concept/unit/quarter. When a quarter was reported more than once (restatements, the
+-- prior year column of a later 10-Q) the most recently filed value wins.
+
+CREATE TABLE IF NOT EXISTS sec_filings (
+    cik INT NOT NULL,
+    accession VARCHAR(20) NOT NULL,
+    form VARCHAR(20) NOT NULL,
+    filing_date DATE NOT NULL,
+    report_date DATE,
+    PRIMARY KEY (cik, accession)
+);
+
+CREATE INDEX IF NOT EXISTS sec_filings_form_date_idx ON sec_filings (form, filing_date);
+
+CREATE TABLE IF NOT EXISTS sec_quarterly (
+    cik INT NOT NULL,
+    ticker VARCHAR(10),
+    concept VARCHAR(200) NOT NULL,
+    unit VARCHAR(30) NOT NULL,
+    period_start DATE NOT NULL,
+    period_end DATE NOT NULL,
+    value NUMERIC NOT NULL,
+    accession VARCHAR(20) NOT NULL,
+    form VARCHAR(20),
+    filed DATE NOT NULL,
+    fiscal_year INT,
+    fiscal_period VARCHAR(4),
+    PRIMARY KEY (cik, concept, unit, period_end)
+);
+
+CREATE INDEX IF NOT EXISTS sec_quarterly_ticker_end_idx ON sec_quarterly (ticker, period_end);
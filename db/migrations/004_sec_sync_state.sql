@@ -0,0 +1,11 @@
+-- 004 :: per-cik watermarks for the incremental EDGAR sync (data/src/edgar/sync.py)
+--
+-- last_filing_date / last_accession are the newest 10-Q/10-K we've processed for a company. The next sync only looks at filings on or
+-- after last_filing_date, and skips ones already recorded in sec_filings (so several filings on the same day are handled correctly).
+
+CREATE TABLE IF NOT EXISTS sec_sync_state (
+    cik INT PRIMARY KEY,
+    last_accession VARCHAR(20),
+    last_filing_date DATE,
+    synced_at TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,37 @@
+-- 005 :: compact store for xbrl facts extracted from filings (data/src/edgar/fact_store.py)
+--
+-- concept and unit names are stored once each in small dictionary tables, and xbrl_facts only holds their integer ids. The facts table
+-- is narrow, fixed width and period keyed: one row per cik/concept/unit/period, where a period is its end date plus its length in days
+-- (0 for instant facts like balance sheet values). Only numeric, company-wide facts are kept (no dimensions/segments, no text
+-- blocks), which is all the screens use. When a period is reported more than once (the prior year column of a later filing,
+-- restatements) the most recent accession number wins.
+
+CREATE TABLE IF NOT EXISTS xbrl_concepts (
+    concept_id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS xbrl_units (
+    unit_id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS xbrl_facts (
+    cik INT NOT NULL,
+    concept_id INT NOT NULL REFERENCES xbrl_concepts (concept_id),
+    period_end DATE NOT NULL,
+    period_days SMALLINT NOT NULL,
+    unit_id SMALLINT NOT NULL REFERENCES xbrl_units (unit_id),
+    value DOUBLE PRECISION NOT NULL,
+    accession BIGINT NOT NULL, -- accession number without dashes, it's 18 digits so it fits
+    PRIMARY KEY (cik, concept_id, period_end, period_days, unit_id)
+);
+
+CREATE INDEX IF NOT EXISTS xbrl_facts_concept_end_idx ON xbrl_facts (concept_id, period_end);
+
+-- names joined back in, for ad hoc queries
+CREATE OR REPLACE VIEW xbrl_facts_named AS
+    SELECT f.cik, c.name AS concept, f.period_end, f.period_days, u.name AS unit, f.value, lpad(f.accession::text, 18, '0') AS accession
+    FROM xbrl_facts f
+    JOIN xbrl_concepts c ON c.concept_id = f.concept_id
+    JOIN xbrl_units u ON u.unit_id = f.unit_id;
@@ -0,0 +1,14 @@
+-- 006 :: natural key for earnings_reports, so the bulk loader (data/src/bulk_load.py) can upsert into it
+--
+-- earnings_reports only had it's serial report_id, so re-running insert_eps for a ticker piled up duplicate rows instead of updating
+-- the existing ones. A company reports once per date, so (ticker, date) is the key. Any duplicates already in the table are cleaned
+-- up first, keeping the most recently inserted row for each ticker/date.
+
+DELETE FROM earnings_reports er
+USING earnings_reports newer
+WHERE newer.ticker = er.ticker AND newer.date = er.date AND newer.report_id > er.report_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS earnings_reports_ticker_date_key ON earnings_reports (ticker, date);
+
+-- the unique index covers the same lookups as the plain one from 001
+DROP INDEX IF EXISTS earnings_reports_ticker_date_idx;
@@ -0,0 +1,15 @@
+-- 007 :: filing date for xbrl_facts, so "the latest filing wins" really means the latest filing
+--
+-- 005 kept whichever fact had the higher accession number, but accession numbers start with the filer agent's id, not the date, so
+-- a restatement filed through a different agent could lose to the older filing it restates. fact_store now orders by the filing date
+-- instead (same as sec_quarterly does with filed). Rows loaded before this have no date, and are replaced by the next filing that
+-- reports the same fact.
+
+ALTER TABLE xbrl_facts ADD COLUMN IF NOT EXISTS filed DATE;
+
+CREATE OR REPLACE VIEW xbrl_facts_named AS
+    SELECT f.cik, c.name AS concept, f.period_end, f.period_days, u.name AS unit, f.value, lpad(f.accession::text, 18, '0') AS accession,
+        f.filed
+    FROM xbrl_facts f
+    JOIN xbrl_concepts c ON c.concept_id = f.concept_id
+    JOIN xbrl_units u ON u.unit_id = f.unit_id;
@@ -0,0 +1,10 @@
+-- 008 :: int ids for xbrl_units
+--
+-- unit_id was a SMALLSERIAL, and fact_store used to run INSERT ... ON CONFLICT DO NOTHING for every unit in every batch it loaded.
+-- That calls nextval() even when the name already exists, so a backfill of a few thousand filings used up all 32767 ids and every
+-- load after that failed. fact_store only inserts names that are actually missing now, and the ids are plain ints so the sequence
+-- has plenty of room either way.
+
+ALTER TABLE xbrl_facts ALTER COLUMN unit_id TYPE INT;
+ALTER TABLE xbrl_units ALTER COLUMN unit_id TYPE INT;
+ALTER SEQUENCE xbrl_units_unit_id_seq AS INT;
@@ -0,0 +1,10 @@
+-- 009 :: eps_diff filters go back to earnings_reports
+--
+-- 002 moved eps_diff to price_returns, but a report only has a price_returns row once it's prices are loaded and refreshed, so
+-- screens on eps_diff missed every report that didn't have one yet. DatabaseHelper computes it from earnings_reports again
+-- ((er.eps_reported - er.eps_estimate), same expression as 001), so the expression index 002 dropped comes back and the
+-- price_returns one isn't used anymore. price_returns.eps_diff itself is left in place, refresh_price_returns still fills it.
+
+CREATE INDEX IF NOT EXISTS earnings_reports_eps_diff_idx ON earnings_reports ((eps_reported - eps_estimate));
+
+DROP INDEX IF EXISTS price_returns_eps_diff_idx;